@@ -0,0 +1,88 @@
+"""Guitarix banks and presets known without guitarix running."""
+
+import os
+import json
+import logging
+
+logger = logging.getLogger("bank_cache")
+
+CACHE_FILE = os.path.expanduser("~/.config/ampi_app/banks_cache.json")
+GUITARIX_BANKS_DIR = os.path.expanduser("~/.config/guitarix/banks")
+
+def load_cache():
+    """Load the banks saved by save_cache().
+
+    Returns (banks, current_bank, current_preset), banks being a mapping of
+    bank name to list of preset names, or None if there is no cache."""
+    try:
+        with open(CACHE_FILE, "rt", encoding="utf-8") as cache_f:
+            data = json.load(cache_f)
+        banks = {name: list(presets) for name, presets in data["banks"].items()}
+        current_bank, current_preset = data.get("current") or (None, None)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, TypeError, KeyError, AttributeError) as err:
+        logger.warning("Cannot load %r: %s", CACHE_FILE, err)
+        return None
+    return banks, current_bank, current_preset
+
+def save_cache(banks, current_bank, current_preset):
+    data = {
+            "banks": banks,
+            "current": [current_bank, current_preset],
+            }
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        tmp_path = CACHE_FILE + ".tmp"
+        with open(tmp_path, "wt", encoding="utf-8") as cache_f:
+            json.dump(data, cache_f)
+        os.replace(tmp_path, CACHE_FILE)
+    except OSError as err:
+        logger.warning("Cannot save %r: %s", CACHE_FILE, err)
+
+def read_bank_contents(path):
+    """Read presets from a guitarix bank (.gx) file.
+
+    The file is a JSON list: a "gx_head_file_version" header, followed by
+    preset name, preset data pairs. Returns a dict of preset name to
+    preset data, in file order."""
+    with open(path, "rt", encoding="utf-8") as bank_f:
+        data = json.load(bank_f)
+    if not isinstance(data, list) or data[:1] != ["gx_head_file_version"]:
+        raise ValueError("not a guitarix bank file")
+    return {name: contents for name, contents in zip(data[2::2], data[3::2])
+            if isinstance(name, str)}
+
+def read_bank_file(path):
+    """Read preset names from a guitarix bank (.gx) file."""
+    return list(read_bank_contents(path))
+
+def read_guitarix_banks(banks_dir=GUITARIX_BANKS_DIR):
+    """Read banks from guitarix bank files (banklist.js and the *.gx files
+    listed there).
+
+    Returns a mapping of bank name to list of preset names."""
+    banklist_path = os.path.join(banks_dir, "banklist.js")
+    try:
+        with open(banklist_path, "rt", encoding="utf-8") as banklist_f:
+            banklist = json.load(banklist_f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as err:
+        logger.warning("Cannot load %r: %s", banklist_path, err)
+        return {}
+    banks = {}
+    for entry in banklist:
+        try:
+            name, filename = entry[0], entry[1]
+        except (TypeError, IndexError):
+            logger.warning("Unexpected %r entry: %r", banklist_path, entry)
+            continue
+        path = os.path.join(banks_dir, filename)
+        try:
+            banks[name] = read_bank_file(path)
+        except FileNotFoundError:
+            logger.debug("Bank file %r not found", path)
+        except (OSError, ValueError) as err:
+            logger.warning("Cannot load %r: %s", path, err)
+    return banks
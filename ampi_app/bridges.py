@@ -0,0 +1,165 @@
+"""ALSA bridges: extra audio interfaces in the JACK graph."""
+
+import time
+import logging
+
+from .proc import Nanny, OutputLogger, LineAssembler, output_options
+from .sched import SchedSettings
+
+logger = logging.getLogger("bridges")
+
+# bridge type: (capture, resampling quality option)
+BRIDGE_TYPES = {
+        "alsa_in": (True, "-q"),
+        "alsa_out": (False, "-q"),
+        "zita-a2j": (True, "-Q"),
+        "zita-j2a": (False, "-Q"),
+        }
+
+# output of the bridges reporting an xrun or lost synchronisation
+XRUN_MARKERS = ["xrun", "excessive timing errors", "restarting synchronisation"]
+
+def bridge_sections(config):
+    """(name, config section) of each bridge listed in [Jack] bridges."""
+    result = []
+    for name in config["Jack"].get("bridges", "").split():
+        section_name = "Bridge." + name
+        if not config.has_section(section_name):
+            logger.warning("No [%s] section, bridge ignored", section_name)
+            continue
+        bridge_type = config[section_name].get("type", "zita-a2j")
+        if bridge_type not in BRIDGE_TYPES:
+            logger.warning("Unknown bridge type %r, bridge %r ignored",
+                           bridge_type, name)
+            continue
+        result.append((name, config[section_name]))
+    return result
+
+class _OutputScanner:
+    """Counts xrun reports in the bridge output and logs it."""
+    def __init__(self, bridge, level):
+        self.bridge = bridge
+        self.level = level
+        self.output_logger = None
+        self.lines = LineAssembler()
+
+    def __call__(self, data):
+        for line in self.lines.feed(data):
+            self._check(line)
+        if self.output_logger is None:
+            self.output_logger = OutputLogger(self.bridge.nanny, self.level)
+        self.output_logger(data)
+
+    def _check(self, line):
+        line = line.decode("utf-8", "replace").lower()
+        if any(marker in line for marker in XRUN_MARKERS):
+            self.bridge.xrun()
+
+    def close(self):
+        self._check(self.lines.flush())
+        if self.output_logger:
+            self.output_logger.close()
+
+class Bridge:
+    """An alsa_in/alsa_out or zita-a2j/zita-j2a process adding an ALSA
+    device to the JACK graph, run by a Nanny.
+
+    The bridge ports (capture_N or playback_N of the `name` JACK client)
+    are wired to the `ports` of the config section. Xruns (and resyncs)
+    are counted from the bridge output, the added latency is read from
+    the JACK port latencies."""
+    def __init__(self, name, section, jack_rate):
+        self.name = name
+        self.section = section
+        self.type = section.get("type", "zita-a2j")
+        self.capture = BRIDGE_TYPES[self.type][0]
+        self.jack_rate = jack_rate
+        self.nanny = None
+        self.xruns = 0
+        self.last_xrun = 0
+
+    def __repr__(self):
+        return "<Bridge {!r} ({})>".format(self.name, self.type)
+
+    def get_command(self):
+        """Bridge command line built from the per-device settings."""
+        section = self.section
+        cmdline = section.get("cmdline")
+        if cmdline:
+            return [arg.format(name=self.name, device=section["device"])
+                    for arg in cmdline.split()]
+        command = [section.get("command", "/usr/bin/" + self.type),
+                   "-j", self.name,
+                   "-d", section["device"],
+                   "-c", section.get("channels", "2"),
+                   "-r", section.get("rate", str(self.jack_rate)),
+                   "-p", section.get("period", "256"),
+                   "-n", section.get("nperiods", "2")]
+        quality = section.get("quality")
+        if quality:
+            command += [BRIDGE_TYPES[self.type][1], quality]
+        if self.type.startswith("alsa_"):
+            target = section.get("target_delay")
+            if target:
+                command += ["-t", target]
+        return command
+
+    def get_ports(self):
+        """JACK ports of the bridge."""
+        prefix = "capture" if self.capture else "playback"
+        return ["{}:{}_{}".format(self.name, prefix, i + 1)
+                for i in range(self.section.getint("channels", 2))]
+
+    def get_wiring(self):
+        """Connections of the bridge ports to the configured `ports`
+        (one per bridge port, '-' for none)."""
+        connections = []
+        for port, peer in zip(self.get_ports(), self.section.get("ports", "").split()):
+            if peer == "-":
+                peer = None
+            if self.capture:
+                connections.append(("audio", port, peer))
+            else:
+                connections.append(("audio", peer, port))
+        return connections
+
+    def create_nanny(self):
+        name = "bridge-" + self.name
+        self.nanny = Nanny(name, self.get_command(),
+                           stdout_callback=_OutputScanner(self, logging.INFO),
+                           stderr_callback=_OutputScanner(self, logging.WARNING),
+                           sched=SchedSettings.from_config(self.section),
+                           **output_options(self.section))
+        return self.nanny
+
+    def xrun(self):
+        """Called from the output thread."""
+        self.xruns += 1
+        self.last_xrun = time.monotonic()
+
+    def get_added_latency(self, jack_client):
+        """Latency of the bridge over the main interface one (ms), None
+        when not known."""
+        port = self.get_ports()[0]
+        latency = jack_client.get_port_latency(port)
+        if latency is None:
+            return None
+        if self.capture:
+            reference = jack_client.get_port_latency("system:capture_1")
+        else:
+            reference = jack_client.get_port_latency("system:playback_1")
+        return (latency - (reference or 0)) / self.jack_rate * 1000
+
+    def get_status_string(self, jack_client):
+        if not self.nanny or not self.nanny.is_started():
+            return "{}: stopped".format(self.name)
+        status = self.name
+        latency = self.get_added_latency(jack_client)
+        if latency is not None:
+            status += ": +{:.1f} ms".format(latency)
+        else:
+            status += ": latency unknown"
+        status += ", {} xruns".format(self.xruns)
+        if self.xruns:
+            status += " (last {:.0f}s ago)".format(time.monotonic() - self.last_xrun)
+        return status
@@ -1,37 +1,104 @@
 """Device monitoring."""
 
+import time
 import logging
 
 import gi
 gi.require_version('GUdev', '1.0')
-from gi.repository import GUdev
+from gi.repository import GUdev, GLib
 
 logger = logging.getLogger("dev")
 
+# default time for device events to settle (ms)
+SETTLE_TIME = 500
+
 class InterfaceMonitor:
-    def __init__(self, callback=None):
+    """Watches for the audio interface (a USB sound card).
+
+    The interface is identified by USB vendor and product id and/or serial
+    number (any USB sound card when none is given). One plug-in or removal
+    brings a burst of uevents, so the state is checked only when no event
+    came for `settle_time` ms and `callback(present)` is called only when
+    it actually changes. `card_id` is the ALSA id of the card found
+    and `plugged_at` the time (monotonic) of the first event of
+    the plug-in."""
+    def __init__(self, callback=None, vendor=None, product=None, serial=None,
+                 settle_time=SETTLE_TIME):
         self.client = GUdev.Client(subsystems=["sound"])
         self.callback = callback
+        self.vendor = vendor.lower() if vendor else None
+        self.product = product.lower() if product else None
+        self.serial = serial or None
+        self.settle_time = settle_time
+        self.present = None
+        self.card_id = None
+        self.plugged_at = None
+        self._first_event = None
+        self._settle_id = None
         self.client.connect("uevent", self.uevent)
 
+    @classmethod
+    def from_config(cls, section, callback=None):
+        """Create the monitor from the [Jack] config."""
+        return cls(callback,
+                   vendor=section.get("usb_vendor"),
+                   product=section.get("usb_product"),
+                   serial=section.get("usb_serial"),
+                   settle_time=section.getint("settle_time", SETTLE_TIME))
+
     def uevent(self, client, action, device):
-        logger.debug("uevent(%r, %r, %r)", client, action, device)
-        name = device.get_name()
-        bus = device.get_property("ID_BUS")
-        if name.startswith("card") and bus == "usb":
-            if action in ("add", "change"):
-                logger.info("USB interface added")
-                if self.callback:
-                    self.callback(True)
-            elif action == "remove":
-                logger.info("USB interface removed")
-                if self.callback:
-                    self.callback(False)
+        logger.debug("uevent(%r, %r, %r)", client, action, device.get_name())
+        if self._first_event is None:
+            self._first_event = time.monotonic()
+        if self._settle_id is not None:
+            GLib.source_remove(self._settle_id)
+        self._settle_id = GLib.timeout_add(self.settle_time, self._settled)
 
-    def is_present(self, **kwargs):
+    def _settled(self):
+        self._settle_id = None
+        first_event, self._first_event = self._first_event, None
+        was_present, old_id = self.present, self.card_id
+        present = self.is_present()
+        if present == was_present and self.card_id == old_id:
+            logger.debug("Device events settled, no interface change")
+            return False
+        settled_in = (time.monotonic() - first_event) * 1000
+        if present:
+            self.plugged_at = first_event
+            logger.info("USB interface %r added (events settled in %.0f ms)",
+                        self.card_id, settled_in)
+        else:
+            self.plugged_at = None
+            logger.info("USB interface removed (events settled in %.0f ms)",
+                        settled_in)
+        if self.callback:
+            self.callback(present)
+        return False
+
+    def _matches(self, device):
+        if self.vendor and device.get_property("ID_VENDOR_ID") != self.vendor:
+            return False
+        if self.product and device.get_property("ID_MODEL_ID") != self.product:
+            return False
+        if self.serial and self.serial not in (device.get_property("ID_SERIAL_SHORT"),
+                                               device.get_property("ID_SERIAL")):
+            return False
+        return True
+
+    def _find_card(self):
         for device in self.client.query_by_subsystem("sound"):
             name = device.get_name()
             bus = device.get_property("ID_BUS")
-            if name.startswith("card") and bus == "usb":
-                return True
-        return False
+            if name.startswith("card") and bus == "usb" and self._matches(device):
+                return device
+        return None
+
+    def is_present(self, **kwargs):
+        """Check for the interface now, update `present` and `card_id`."""
+        device = self._find_card()
+        if device:
+            self.card_id = device.get_sysfs_attr("id") or device.get_name()[4:]
+        else:
+            self.card_id = None
+        self.present = device is not None
+        return self.present
@@ -9,8 +9,6 @@ import logging
 
 from gi.repository import GLib
 
-from ._guitarix_methods import GuitarixMethods
-
 logger = logging.getLogger("guitarix")
 
 SEND_QUEUE_LEN = 100
@@ -27,7 +25,7 @@ class GuitarixClient:
     def __init__(self, host="localhost", port=9090):
         self.host = host
         self.port = port
-        self.api = GuitarixMethods(self)
+        self._api = None
         self._req_id = random.randint(0, 2**30)
         self._lock = threading.RLock()
         self._thread = None
@@ -35,6 +33,14 @@ class GuitarixClient:
         self._socket = None
         self._results = {}
 
+    @property
+    def api(self):
+        if self._api is None:
+            # the generated method table is big, load it on demand
+            from ._guitarix_methods import GuitarixMethods
+            self._api = GuitarixMethods(self)
+        return self._api
+
     def add_observer(self, observer, tokens=None):
         if isinstance(tokens, str):
             tokens = {tokens}
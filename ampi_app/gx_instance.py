@@ -0,0 +1,122 @@
+"""Managed guitarix instances."""
+
+import os
+import time
+import logging
+
+from gi.repository import GLib
+
+from .proc import Nanny, output_options
+from .sched import SchedSettings
+from .guitarix import GuitarixClient
+
+logger = logging.getLogger("gx_instance")
+
+# name of the instance configured in the [Guitarix] section
+MAIN_INSTANCE = "main"
+
+def instance_sections(config):
+    """(name, config section) of each configured guitarix instance.
+
+    The first one is [Guitarix], the others are listed in its `instances`
+    key and configured in [Guitarix.<name>] sections, with the missing keys
+    taken from [Guitarix] (so e.g. ${rpc_port} in the inherited cmdline
+    refers to the instance port). Instances without their own `rpc_port`
+    and `jack_name` are skipped."""
+    main = config["Guitarix"]
+    result = [(MAIN_INSTANCE, main)]
+    for name in main.get("instances", "").split():
+        section_name = "Guitarix." + name
+        missing = [key for key in ("rpc_port", "jack_name")
+                   if not config.has_section(section_name)
+                   or not config.has_option(section_name, key)]
+        if missing:
+            logger.warning("Guitarix instance %r skipped: no %s in [%s]",
+                           name, " or ".join(missing), section_name)
+            continue
+        if not config.has_option(section_name, "cpus") and main.get("cpus"):
+            logger.warning("Guitarix instance %r uses the main instance"
+                           " CPUs (%s)", name, main.get("cpus"))
+        for key, value in config.items("Guitarix", raw=True):
+            if key != "instances" and not config.has_option(section_name, key):
+                config.set(section_name, key, value)
+        result.append((name, config[section_name]))
+    return result
+
+def instance_wiring(section):
+    """JACK connections of an instance: the `inputs` (JACK ports, space
+    separated) to its amp input, its fx outputs to the `outputs`."""
+    jack_name = section.get("jack_name", "gx_head")
+    connections = [("audio", port, jack_name + "_amp:in_0")
+                   for port in section.get("inputs", "").split()]
+    for i, port in enumerate(section.get("outputs", "").split()):
+        connections.append(("audio", "{}_fx:out_{}".format(jack_name, i), port))
+    return connections
+
+def _cpu_time(pid):
+    """User + system CPU time of a process (seconds)."""
+    with open("/proc/{}/stat".format(pid), "rt") as stat_f:
+        # skip 'pid (comm)', comm may contain spaces
+        fields = stat_f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+class GuitarixInstance:
+    """A guitarix process with its Nanny and RPC client.
+
+    The client connects when the process is started; `callback(instance,
+    started)` is called when the process state changes."""
+    def __init__(self, name, section, callback=None):
+        self.name = name
+        self.section = section
+        self.callback = callback
+        self.client = GuitarixClient(section["rpc_host"], int(section["rpc_port"]))
+        self.nanny = None
+        self._connect_id = None
+        self._cpu_sample = None
+        self.client.add_observer(self)
+
+    def __repr__(self):
+        return "<GuitarixInstance {!r}>".format(self.name)
+
+    def create_nanny(self, kill_list=None):
+        if self.name == MAIN_INSTANCE:
+            nanny_name = "guitarix"
+        else:
+            nanny_name = "guitarix-" + self.name
+        self.nanny = Nanny(nanny_name, self.section["cmdline"].split(),
+                           kill_list=kill_list,
+                           callback=self._proc_status,
+                           sched=SchedSettings.from_config(self.section),
+                           **output_options(self.section))
+        return self.nanny
+
+    def _proc_status(self, started):
+        if started:
+            self._connect_id = GLib.timeout_add(1000, self.client.connect)
+        elif self._connect_id is not None:
+            GLib.source_remove(self._connect_id)
+            self._connect_id = None
+        if self.callback:
+            self.callback(self, started)
+
+    def gx_connected(self, gx_client):
+        # if connected, then the connect function returned None
+        # and this has already been removed from glib
+        self._connect_id = None
+
+    def get_cpu_load(self):
+        """CPU usage of the process since the previous call (percent of one
+        CPU), None when not known."""
+        pid = self.nanny.get_pid() if self.nanny else None
+        if not pid:
+            self._cpu_sample = None
+            return None
+        try:
+            sample = (pid, time.monotonic(), _cpu_time(pid))
+        except (OSError, ValueError, IndexError):
+            self._cpu_sample = None
+            return None
+        previous, self._cpu_sample = self._cpu_sample, sample
+        if not previous or previous[0] != pid or sample[1] <= previous[1]:
+            return None
+        return (sample[2] - previous[2]) / (sample[1] - previous[1]) * 100
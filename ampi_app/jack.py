@@ -2,7 +2,6 @@
 
 import logging
 from collections import defaultdict
-import jack
 import time
 from functools import partial
 
@@ -10,28 +9,44 @@ from gi.repository import GObject
 
 logger = logging.getLogger("jack")
 
+# the JACK-Client module (loads libjack), imported on first connect
+jack = None
+
+def _import_jack():
+    global jack
+    if jack is None:
+        import jack as jack_module
+        jack = jack_module
+
+# the main guitarix instance ports are '{gx}_amp' and '{gx}_fx',
+# {gx} is replaced with its JACK client name ([Guitarix] jack_name)
 WIRING = [
         ("Mono R", [
-            ("audio", "system:capture_1", "gx_head_amp:in_0"),
+            ("audio", "system:capture_1", "{gx}_amp:in_0"),
             ("audio", "system:capture_2", None),
-            ("audio", "gx_head_fx:out_0", "system:playback_2"),
-            ("audio", "gx_head_fx:out_1", "system:playback_2"),
+            ("audio", "{gx}_fx:out_0", "system:playback_2"),
+            ("audio", "{gx}_fx:out_1", "system:playback_2"),
             ("audio", None, "system:playback_1"),
             ("audio", "ampi_mplayer:out_0", "system:playback_2"),
-            ("audio", "ampi_mplayer:out_1", "system:playback_2")
+            ("audio", "ampi_mplayer:out_1", "system:playback_2"),
+            ("audio", "ampi_player:out_0", "system:playback_2"),
+            ("audio", "ampi_player:out_1", "system:playback_2")
             ]),
         ("Stereo", [
-            ("audio", "system:capture_1", "gx_head_amp:in_0"),
+            ("audio", "system:capture_1", "{gx}_amp:in_0"),
             ("audio", "system:capture_2", None),
-            ("audio", "gx_head_fx:out_0", "system:playback_1"),
-            ("audio", "gx_head_fx:out_1", "system:playback_2"),
+            ("audio", "{gx}_fx:out_0", "system:playback_1"),
+            ("audio", "{gx}_fx:out_1", "system:playback_2"),
             ("audio", "ampi_mplayer:out_0", "system:playback_1"),
-            ("audio", "ampi_mplayer:out_1", "system:playback_2")
+            ("audio", "ampi_mplayer:out_1", "system:playback_2"),
+            ("audio", "ampi_player:out_0", "system:playback_1"),
+            ("audio", "ampi_player:out_1", "system:playback_2")
             ]),
         ]
 
 class JackClient:
-    def __init__(self):
+    def __init__(self, gx_name="gx_head"):
+        self.gx_name = gx_name
         self.jack = None
         self.wiring = None
         self.source_wiring = {}
@@ -41,23 +56,31 @@ class JackClient:
         self.last_xrun = 0
         self.last_xrun_log = 0
         self.in_shutdown = False
+        # connections added to every wiring (e.g. extra guitarix instances)
+        self.extra_connections = []
         self._load_wiring(WIRING[0])
 
     def _load_wiring(self, wiring):
         name, connections = wiring
+        connections = [(c_type,
+                        s_port and s_port.format(gx=self.gx_name),
+                        d_port and d_port.format(gx=self.gx_name))
+                       for c_type, s_port, d_port in connections]
         source_wiring = defaultdict(set)
         sink_wiring = defaultdict(set)
-        for c_type, s_port, d_port in connections:
+        for c_type, s_port, d_port in connections + self.extra_connections:
+            # a port with a None peer is still a port with rules
+            # (no connections, unless other rules add some)
             if s_port:
                 if d_port:
                     source_wiring[c_type, s_port].add(d_port)
                 else:
-                    source_wiring[c_type, s_port] = {}
+                    source_wiring[c_type, s_port].update()
             if d_port:
                 if s_port:
                     sink_wiring[c_type, d_port].add(s_port)
                 else:
-                    sink_wiring[c_type, d_port] = {}
+                    sink_wiring[c_type, d_port].update()
         self.wiring = name
         self.source_wiring = source_wiring
         self.sink_wiring = sink_wiring
@@ -68,6 +91,7 @@ class JackClient:
         if self.jack:
             return
         logger.info("Connecting to Jack...")
+        _import_jack()
         try:
             self.jack = jack.Client("ampi_app")
         except jack.JackError as err:
@@ -223,6 +247,11 @@ class JackClient:
         for port in self.jack.get_ports(is_input=True):
             self._connect_sink(port)
 
+    def add_connections(self, connections):
+        """Add (type, source, destination) connections to every wiring."""
+        self.extra_connections += connections
+        self.load_wiring(self.wiring)
+
     def get_wirings(self):
         return [name for name, connections in WIRING]
 
@@ -232,6 +261,32 @@ class JackClient:
                 return self._load_wiring(wiring)
         raise KeyError(name)
 
+    def get_cpu_load(self):
+        """Current JACK DSP load (percent) or None when not available."""
+        if not self.jack or self.in_shutdown:
+            return None
+        try:
+            return self.jack.cpu_load()
+        except jack.JackError as err:
+            logger.debug("cpu_load: %s", err)
+            return None
+
+    def get_port_latency(self, name):
+        """Maximum latency of a port (frames): capture latency for an output
+        port, playback latency for an input one. None when not available."""
+        if not self.jack or self.in_shutdown:
+            return None
+        try:
+            port = self.jack.get_port_by_name(name)
+            if port.is_output:
+                mode = jack.CAPTURE_LATENCY
+            else:
+                mode = jack.PLAYBACK_LATENCY
+            return port.get_latency_range(mode)[1]
+        except jack.JackError as err:
+            logger.debug("get_port_latency(%r): %s", name, err)
+            return None
+
     def get_status_string(self):
         if not self.jack or self.in_shutdown:
             return "<span foreground='#800000'>disconnected</span>"
@@ -0,0 +1,128 @@
+"""JACK backend switching, for the interface failover."""
+
+import time
+import logging
+import threading
+import subprocess
+
+from gi.repository import GLib
+
+logger = logging.getLogger("jack_backend")
+
+# max time for a jack_control run (seconds)
+JACK_CONTROL_TIMEOUT = 30
+
+class BackendSwitcher:
+    """Starts the JACK D-Bus server and switches its backend (the 'master'
+    driver) with jack_control.
+
+    While the audio interface is gone the server runs on the dummy backend,
+    so the JACK clients (guitarix with its current preset and tweaks) keep
+    running, and only the backend is switched back when the interface
+    returns. jack_control runs in a worker thread, one run at a time;
+    of the requests made meanwhile only the last one is carried out.
+    `callback(device, ok, start)` is called in the main loop after each
+    run, `device` is None for the dummy backend."""
+    def __init__(self, jack_control, rate, frames, periods,
+                 latency_in=None, latency_out=None, callback=None):
+        self.jack_control = jack_control
+        self.rate = rate
+        self.frames = frames
+        self.periods = periods
+        self.latency_in = latency_in
+        self.latency_out = latency_out
+        self.callback = callback
+        self.device = None
+        # the JACK server has been started
+        self.running = False
+        self._busy = False
+        self._pending = None
+
+    @classmethod
+    def from_config(cls, section, callback=None):
+        """Create the switcher from the [Jack] config, None if disabled."""
+        if not section.getboolean("failover", False):
+            return None
+        return cls(section.get("jack_control", "/usr/bin/jack_control"),
+                   section.getint("rate"),
+                   section.getint("frames"),
+                   section.getint("periods"),
+                   latency_in=section.getint("io_latency_in"),
+                   latency_out=section.getint("io_latency_out"),
+                   callback=callback)
+
+    def _driver_args(self, device):
+        if device is None:
+            args = ["ds", "dummy"]
+        else:
+            args = ["ds", "alsa",
+                    "dps", "device", device,
+                    "dps", "nperiods", self.periods]
+            if self.latency_in is not None:
+                args += ["dps", "input-latency", self.latency_in]
+            if self.latency_out is not None:
+                args += ["dps", "output-latency", self.latency_out]
+        args += ["dps", "rate", self.rate, "dps", "period", self.frames]
+        return [str(arg) for arg in args]
+
+    def start_server(self, device):
+        """Configure the backend and start the JACK server."""
+        self._request((device, True))
+
+    def switch(self, device):
+        """Switch the running server to another backend (None: dummy)."""
+        self._request((device, False))
+
+    def _request(self, request):
+        if self._busy:
+            if self._pending and self._pending[1]:
+                # the server start must not be lost
+                request = (request[0], True)
+            self._pending = request
+            return
+        self._busy = True
+        thread = threading.Thread(name="JACK backend switch",
+                                  target=self._run,
+                                  args=request,
+                                  daemon=True)
+        thread.start()
+
+    def _run(self, device, start):
+        command = [self.jack_control] + self._driver_args(device)
+        command.append("start" if start else "sm")
+        logger.debug("Running: %s", " ".join(command))
+        started = time.monotonic()
+        try:
+            result = subprocess.run(command,
+                                    stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.PIPE,
+                                    timeout=JACK_CONTROL_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired) as err:
+            logger.error("Cannot run %r: %s", self.jack_control, err)
+            ok = False
+        else:
+            ok = result.returncode == 0
+            if not ok:
+                logger.error("jack_control failed: %s",
+                             result.stderr.decode("utf-8", "replace").strip())
+        elapsed = time.monotonic() - started
+        GLib.idle_add(self._done, device, start, ok, elapsed)
+
+    def _done(self, device, start, ok, elapsed):
+        self._busy = False
+        backend = device or "dummy"
+        if ok:
+            self.device = device
+            self.running = True
+            logger.info("JACK %s on the %s backend in %.0f ms",
+                        "started" if start else "switched", backend,
+                        elapsed * 1000)
+        if self.callback:
+            self.callback(device, ok, start)
+        if self._pending:
+            request, self._pending = self._pending, None
+            if request == (self.device, False):
+                return False
+            self._request(request)
+        return False
@@ -0,0 +1,223 @@
+"""DSP overload protection."""
+
+import time
+import logging
+from collections import deque
+
+from gi.repository import GLib
+
+from .guitarix import GuitarixClientError
+
+logger = logging.getLogger("load_guard")
+
+# load check interval (ms)
+GUARD_INTERVAL = 250
+
+# rack units switched off first by the 'bypass' action, most expensive first
+EXPENSIVE_UNITS = [
+        "jconv", "jconv_mono", "zita_rev1", "cab_st", "cab", "pre_st", "pre",
+        "reverb", "stereoreverb", "moog", "flanger", "chorus", "chorus_mono",
+        "phaser", "phaser_mono", "delay", "stereodelay", "echo", "stereoecho",
+        ]
+
+def parse_preset(value):
+    """Parse 'bank,preset' config value."""
+    if not value or "," not in value:
+        return None
+    bank_name, preset_name = value.split(",", 1)
+    return bank_name.strip(), preset_name.strip()
+
+class LoadGuard:
+    """Watches JACK DSP load and xrun rate and falls back to the safe preset
+    (or switches off the most expensive rack units) when they stay too high.
+
+    At start-up the safe preset is loaded first and the default (or the one
+    requested with set_startup_target()) only when the system is stable.
+    Overload and stable conditions use different thresholds and both have
+    to last, so the guard does not flap."""
+    def __init__(self, gx_client, jack_client, config):
+        self.gx_client = gx_client
+        self.jack_client = jack_client
+        self.enabled = config.getboolean("enabled", True)
+        self.max_load = config.getfloat("max_load", 85)
+        self.max_xrun_rate = config.getfloat("max_xrun_rate", 1)
+        self.overload_time = config.getfloat("overload_time", 3)
+        self.stable_load = config.getfloat("stable_load", 60)
+        self.stable_time = config.getfloat("stable_time", 5)
+        self.action = config.get("action", "safe")
+        self.safe_preset = None
+        self.default_preset = None
+        self.state = "disconnected"
+        # set while overload is expected (e.g. when profiling presets)
+        self.paused = False
+        self._startup_target = None
+        self._expected_preset = None
+        self._current = None
+        self._xrun_history = deque()
+        self._overload_since = None
+        self._stable_since = None
+        self._timer_id = None
+        gx_client.add_observer(self, "preset")
+
+    def set_presets(self, safe, default):
+        self.safe_preset = parse_preset(safe)
+        self.default_preset = parse_preset(default)
+
+    def set_startup_target(self, bank_name, preset_name):
+        """Preset to load instead of the default one when stable."""
+        self._startup_target = (bank_name, preset_name)
+
+    def is_starting(self):
+        return self.state == "starting"
+
+    def get_status_string(self):
+        if not self.enabled:
+            return "disabled"
+        if self.paused:
+            return "paused"
+        return self.state
+
+    def gx_connected(self, gx_client):
+        if not self.enabled:
+            return
+        self._reset()
+        if self.safe_preset:
+            logger.info("Loading safe preset %r until the system is stable",
+                        self.safe_preset)
+            self._load(self.safe_preset)
+            self.state = "starting"
+        else:
+            self.state = "normal"
+        if self._timer_id is None:
+            self._timer_id = GLib.timeout_add(GUARD_INTERVAL, self._check)
+
+    def gx_disconnected(self, gx_client):
+        self.state = "disconnected"
+        if self._timer_id is not None:
+            GLib.source_remove(self._timer_id)
+            self._timer_id = None
+
+    def preset_switched(self, bank_name, preset_name):
+        """Preset loaded by parameter delta (see PresetSwitcher)."""
+        self._current = (bank_name, preset_name)
+
+    def gx_preset_changed(self, gx_client, bank_name, preset_name):
+        self._current = (bank_name, preset_name)
+        if self._expected_preset == (bank_name, preset_name):
+            self._expected_preset = None
+            return
+        if self.state == "starting":
+            # somebody else chose a preset, respect that
+            logger.info("Preset changed during start-up, not loading the default")
+            self.state = "normal"
+            self._startup_target = None
+
+    def _reset(self):
+        self._xrun_history.clear()
+        self._overload_since = None
+        self._stable_since = None
+        self._expected_preset = None
+        self._current = None
+
+    def _load(self, preset):
+        self._expected_preset = preset
+        try:
+            self.gx_client.api.setpreset(*preset)
+        except GuitarixClientError as err:
+            logger.warning("Cannot load preset %r: %s", preset, err)
+
+    def _xrun_rate(self, now):
+        history = self._xrun_history
+        history.append((now, self.jack_client.xruns))
+        while len(history) > 1 and now - history[0][0] > self.overload_time:
+            history.popleft()
+        span = now - history[0][0]
+        if span <= 0:
+            return 0.0
+        return (history[-1][1] - history[0][1]) / span
+
+    def _check(self):
+        now = time.monotonic()
+        load = self.jack_client.get_cpu_load()
+        if load is None or self.paused:
+            self._reset()
+            return True
+        xrun_rate = self._xrun_rate(now)
+
+        if load > self.max_load or xrun_rate > self.max_xrun_rate:
+            self._stable_since = None
+            if self._overload_since is None:
+                self._overload_since = now
+            elif now - self._overload_since >= self.overload_time:
+                self._overloaded(load, xrun_rate)
+                self._overload_since = None
+                self._xrun_history.clear()
+            return True
+        self._overload_since = None
+
+        if load < self.stable_load and xrun_rate == 0:
+            if self._stable_since is None:
+                self._stable_since = now
+            elif now - self._stable_since >= self.stable_time:
+                self._stable()
+        else:
+            self._stable_since = None
+        return True
+
+    def _stable(self):
+        if self.state == "starting":
+            target = self._startup_target or self.default_preset
+            self._startup_target = None
+            self.state = "normal"
+            if target:
+                logger.info("System stable, loading preset %r", target)
+                self._load(target)
+        elif self.state == "tripped":
+            logger.info("System stable again")
+            self.state = "normal"
+
+    def _overloaded(self, load, xrun_rate):
+        reason = "DSP load {:.0f}%, {:.1f} xruns/s for {:g}s".format(
+                load, xrun_rate, self.overload_time)
+        if self._current == self.safe_preset:
+            # nothing more to do
+            logger.warning("Overload on the safe preset (%s)", reason)
+            return
+        if self.action == "bypass" and self._bypass_unit(reason):
+            self.state = "tripped"
+            return
+        if self.safe_preset:
+            logger.warning("Overload (%s), loading safe preset %r",
+                           reason, self.safe_preset)
+            self._load(self.safe_preset)
+            self.state = "tripped"
+        else:
+            logger.warning("Overload (%s), no safe preset configured", reason)
+
+    def _bypass_unit(self, reason):
+        """Switch off the most expensive active rack unit."""
+        try:
+            units = set(self.gx_client.api.get_rack_unit_order(False))
+            units.update(self.gx_client.api.get_rack_unit_order(True))
+        except GuitarixClientError as err:
+            logger.warning("Cannot get rack units: %s", err)
+            return False
+        candidates = [unit + ".on_off" for unit in EXPENSIVE_UNITS if unit in units]
+        if not candidates:
+            return False
+        try:
+            values = self.gx_client.api.get_parameter_value(*candidates)
+        except GuitarixClientError as err:
+            logger.warning("Cannot get rack unit state: %s", err)
+            return False
+        for name in candidates:
+            if values.get(name):
+                logger.warning("Overload (%s), switching off %r",
+                               reason, name.rsplit(".", 1)[0])
+                try:
+                    self.gx_client.api.set(name, 0)
+                except GuitarixClientError as err:
+                    logger.warning("Cannot switch off %r: %s", name, err)
+                    return False
+                return True
+        return False
@@ -1,26 +1,46 @@
 #!/usr/bin/python
 
+import time
+
+# reference point for --profile-startup, taken before the heavy imports
+_START_TIME = time.monotonic()
+
 import configparser
 import os
 import logging
 import argparse
 import signal
+from collections import deque
 
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, GLib
 
-from .dev import InterfaceMonitor
-from .proc import Nanny
+from .proc import Nanny, KillOperation, stop_all_async, output_options
+from .sched import SchedSettings, describe as describe_sched
 from .jack import JackClient
-from .guitarix import GuitarixClient
+from .gx_instance import GuitarixInstance, instance_sections, instance_wiring
+from .bridges import Bridge, bridge_sections
+from .preset_switch import PresetSwitcher
+from .switch_latency import SwitchLatencyTracker
+from .load_guard import LoadGuard
+from .state_snapshot import StateSnapshot
 from .status_tab import StatusTab
-from .presets_tab import PresetsTab
-from .tracks_tab import TracksTab
-from .system_tab import SystemTab
 
 logger = logging.getLogger("main")
 
+# log view refresh interval (ms)
+LOG_FLUSH_INTERVAL = 200
+# max number of log records waiting for the log view
+LOG_QUEUE_LEN = 5000
+
+# time given to guitarix to shut down by itself (seconds)
+GX_SHUTDOWN_GRACE = 2
+# hard limit for the whole shutdown sequence (ms)
+QUIT_TIMEOUT = 10000
+# delay before retrying a failed JACK backend switch (ms)
+BACKEND_RETRY_DELAY = 3000
+
 LOG_COLORS = [
         (logging.DEBUG, "#505050"),
         (logging.INFO, "#101010"),
@@ -32,11 +52,20 @@ LOG_COLORS = [
 class TextBufferHandler(logging.Handler):
     """
     A logging handler class which writes logging records to a Gtk text buffer.
+
+    Records are queued and written in batches, at most once every
+    LOG_FLUSH_INTERVAL ms and only while the view is visible. The buffer
+    is trimmed to `max_lines` lines.
     """
-    def __init__(self, text_buffer):
+    def __init__(self, text_buffer, max_lines=1000):
         logging.Handler.__init__(self)
         self.buffer = text_buffer
+        self.max_lines = max_lines
         self.text_tags = {}
+        self.visible = True
+        self._queue = deque(maxlen=LOG_QUEUE_LEN)
+        self._dropped = 0
+        self._flush_pending = False
 
     def _get_tag(self, level):
         tag = self.text_tags.get(level)
@@ -59,15 +88,127 @@ class TextBufferHandler(logging.Handler):
         """
         try:
             msg = self.format(record)
-            level = record.levelno
-            def add_line():
-                tag = self._get_tag(level)
-                buf_iter = self.buffer.get_end_iter()
-                self.buffer.insert_with_tags(buf_iter, msg + "\n", tag)
-            GLib.idle_add(add_line)
+            if len(self._queue) == LOG_QUEUE_LEN:
+                self._dropped += 1
+            # deque.append() is atomic, no locking needed
+            self._queue.append((msg, record.levelno))
+            if not self._flush_pending:
+                self._flush_pending = True
+                GLib.timeout_add(LOG_FLUSH_INTERVAL, self._flush)
         except Exception:
             self.handleError(record)
 
+    def set_visible(self, visible):
+        """Enable or disable rendering (e.g. when the log view is hidden)."""
+        self.visible = visible
+        if visible and self._flush_pending:
+            self._flush()
+
+    def _flush(self):
+        if not self.visible:
+            # keep _flush_pending set, set_visible() will flush
+            return False
+        self._flush_pending = False
+        records = []
+        try:
+            while True:
+                records.append(self._queue.popleft())
+        except IndexError:
+            pass
+        dropped, self._dropped = self._dropped, 0
+        if dropped:
+            records.insert(0, ("[{} log messages dropped]".format(dropped),
+                               logging.WARNING))
+        if not records:
+            return False
+        records = records[-self.max_lines:]
+
+        buf_iter = self.buffer.get_end_iter()
+        offset = buf_iter.get_offset()
+        self.buffer.insert(buf_iter, "".join(msg + "\n" for msg, level in records))
+
+        # one tag per run of same-level records
+        run_start = offset
+        run_level = records[0][1]
+        for msg, level in records:
+            if level != run_level:
+                self._apply_tag(run_level, run_start, offset)
+                run_start = offset
+                run_level = level
+            offset += len(msg) + 1
+        self._apply_tag(run_level, run_start, offset)
+
+        self._trim()
+        return False
+
+    def _apply_tag(self, level, start, end):
+        self.buffer.apply_tag(self._get_tag(level),
+                              self.buffer.get_iter_at_offset(start),
+                              self.buffer.get_iter_at_offset(end))
+
+    def _trim(self):
+        # the last (empty) line after the final newline does not count
+        excess = self.buffer.get_line_count() - 1 - self.max_lines
+        if excess > 0:
+            self.buffer.delete(self.buffer.get_start_iter(),
+                               self.buffer.get_iter_at_line(excess))
+
+def process_age():
+    """Time since the process was started (seconds)."""
+    try:
+        with open("/proc/self/stat", "rt") as stat_f:
+            # skip 'pid (comm)', comm may contain spaces
+            fields = stat_f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", "rt") as uptime_f:
+            uptime = float(uptime_f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    start_ticks = int(fields[19])
+    return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+class StartupTimer:
+    """Logs start-up milestones, for --profile-startup."""
+    def __init__(self):
+        self.enabled = False
+        self._last = _START_TIME
+
+    def enable(self):
+        self.enabled = True
+        age = process_age()
+        if age is not None:
+            since_start = time.monotonic() - _START_TIME
+            logger.info("startup: %7.1f ms before ampi_app.main was imported",
+                        (age - since_start) * 1000)
+
+    def mark(self, label):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        logger.info("startup: %7.1f ms (+%6.1f ms) %s",
+                    (now - _START_TIME) * 1000, (now - self._last) * 1000, label)
+        self._last = now
+
+startup_timer = StartupTimer()
+
+class LazyTab(Gtk.Box):
+    """Notebook page placeholder which builds the real tab on first view."""
+    def __init__(self, name, factory):
+        Gtk.Box.__init__(self)
+        self.name = name
+        self.factory = factory
+        self.tab = None
+
+    def build(self):
+        if self.tab is None:
+            start = time.monotonic()
+            self.tab = self.factory()
+            self.pack_start(self.tab, True, True, 0)
+            self.tab.show_all()
+            logger.debug("%s tab built in %.1f ms", self.name,
+                         (time.monotonic() - start) * 1000)
+            startup_timer.mark("{} tab built".format(self.name))
+        return self.tab
+
 class MainWindow(Gtk.Window):
 
     def __init__(self, args):
@@ -82,13 +223,46 @@ class MainWindow(Gtk.Window):
                               self.config["UI"].getint("height"))
         self.connect("delete-event", self.quit)
 
+        self.sched = SchedSettings.from_config(self.config["UI"])
+        if self.sched:
+            logger.debug("Applying %r to ampi_app", self.sched)
+            self.sched.apply(os.getpid())
+
         self.jack_nanny = None
         self.gx_nanny = None
+        self._gx_cleanup = None
+        self.backend_switcher = None
+        self._backend_retry_id = None
+        self.tracks_tab = None
+        self._quitting = False
+        self._quit_timeout_id = None
 
-        self.jack_client = JackClient()
-        self._gx_start_id = None
-        self.gx_client = GuitarixClient(self.config["Guitarix"]["rpc_host"],
-                                        int(self.config["Guitarix"]["rpc_port"]))
+        self.jack_client = JackClient(self.config["Guitarix"].get("jack_name",
+                                                                  "gx_head"))
+        # the first one is the main instance, the one the presets,
+        # load guard and state snapshot are for
+        self.gx_instances = [GuitarixInstance(name, section,
+                                              callback=self.update_gx_proc_status)
+                             for name, section in instance_sections(self.config)]
+        self.gx_client = self.gx_instances[0].client
+        for instance in self.gx_instances[1:]:
+            self.jack_client.add_connections(instance_wiring(instance.section))
+        jack_rate = self.config["Jack"].getint("rate")
+        self.bridges = [Bridge(name, section, jack_rate)
+                        for name, section in bridge_sections(self.config)]
+        for bridge in self.bridges:
+            self.jack_client.add_connections(bridge.get_wiring())
+        self.switch_tracker = SwitchLatencyTracker(self.jack_client)
+        self.preset_switcher = PresetSwitcher(
+                self.gx_client, self.config["Guitarix"].getboolean("fast_switch"),
+                tracker=self.switch_tracker)
+        self.load_guard = LoadGuard(self.gx_client, self.jack_client,
+                                    self.config["LoadGuard"])
+        self.load_guard.set_presets(self.config["Guitarix"].get("safe"),
+                                    self.config["Guitarix"].get("default"))
+        self.preset_switcher.add_observer(self.load_guard)
+        self.state_snapshot = StateSnapshot(self.gx_client, self.preset_switcher,
+                                            self.load_guard)
 
         GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGTERM, self._signal, "SIGTERM")
         GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGHUP, self._signal, "SIGHUP")
@@ -98,94 +272,337 @@ class MainWindow(Gtk.Window):
         self.add(self.notebook)
         self.status_tab = StatusTab(self)
         self.notebook.append_page(self.status_tab, Gtk.Label('Status'))
-        self.presets_tab = PresetsTab(self)
-        self.notebook.append_page(self.presets_tab, Gtk.Label('Presets'))
-        self.tracks_tab = TracksTab(self)
-        self.notebook.append_page(self.tracks_tab, Gtk.Label('Tracks'))
-        self.system_tab = SystemTab(self)
-        self.notebook.append_page(self.system_tab, Gtk.Label('System'))
+        self.presets_tab = None
+        self.notebook.append_page(LazyTab("Presets", self._build_presets_tab),
+                                  Gtk.Label('Presets'))
+        self.meters_tab = None
+        self.notebook.append_page(LazyTab("Meters", self._build_meters_tab),
+                                  Gtk.Label('Meters'))
+        self.scope_tab = None
+        self.notebook.append_page(LazyTab("Scope", self._build_scope_tab),
+                                  Gtk.Label('Scope'))
+        self.notebook.append_page(LazyTab("Tracks", self._build_tracks_tab),
+                                  Gtk.Label('Tracks'))
+        self.system_tab = None
+        self.notebook.append_page(LazyTab("System", self._build_system_tab),
+                                  Gtk.Label('System'))
         self.notebook.show_all()
         self.notebook.set_current_page(0)
+        startup_timer.mark("tabs created")
 
-        log_handler = TextBufferHandler(self.status_tab.log_b)
-        log_handler.setFormatter(logging.Formatter())
+        self.log_handler = TextBufferHandler(self.status_tab.log_b,
+                                             self.config["UI"].getint("log_lines"))
+        self.log_handler.setFormatter(logging.Formatter())
+        self.notebook.connect("switch-page", self._page_switched)
         root_logger = logging.getLogger()
-        root_logger.addHandler(log_handler)
+        root_logger.addHandler(self.log_handler)
         if args.debug:
             root_logger.setLevel(logging.DEBUG)
         else:
             root_logger.setLevel(logging.INFO)
-        self.iface_monitor = InterfaceMonitor(self.update_iface_status)
 
-        jack_cmd = self.config["Jack"]["cmdline"].split()
+        self.iface_monitor = None
+        self.gx_client.add_observer(self, "all")
+        self.gx_client.add_observer(self.status_tab, "state")
+        self._first_frame_id = self.connect("draw", self._first_frame)
+
+    def _first_frame(self, widget, cairo_ctx):
+        self.disconnect(self._first_frame_id)
+        startup_timer.mark("first frame")
+        # idle priority is lower than redraw, so the frame gets shown first
+        GLib.idle_add(self._start_services)
+
+    def _start_services(self):
+        """Start device monitoring and the managed processes."""
+        from .dev import InterfaceMonitor
+        self.iface_monitor = InterfaceMonitor.from_config(self.config["Jack"],
+                                                          self.update_iface_status)
+
+        from .jack_backend import BackendSwitcher
+        self.backend_switcher = BackendSwitcher.from_config(self.config["Jack"],
+                                                            self._backend_switched)
+        if self.backend_switcher:
+            # the D-Bus server, JACK itself is started with jack_control
+            jack_cmd = self.config["Jack"]["dbus_cmdline"].split()
+        else:
+            jack_cmd = self._jack_command()
         jack_name = os.path.basename(jack_cmd[0])
 
         self.jack_nanny = Nanny(jack_name, jack_cmd,
                                 kill_list=["jackd", "jackdbus", "qjackctl"],
-                                callback=self.update_jackd_proc_status)
+                                callback=self.update_jackd_proc_status,
+                                sched=SchedSettings.from_config(self.config["Jack"]),
+                                **output_options(self.config["Jack"]))
 
-        gx_cmd = self.config["Guitarix"]["cmdline"].split()
-        self.gx_nanny = Nanny("guitarix", gx_cmd,
-                                kill_list=["guitarix"],
-                                callback=self.update_gx_proc_status)
+        if len(self.gx_instances) > 1:
+            # a nanny must not kill the other instances when it starts,
+            # stray ones are killed once, before any is started
+            self._gx_cleanup = KillOperation(["guitarix"])
+            self._gx_cleanup.start()
+            kill_list = None
+        else:
+            kill_list = ["guitarix"]
+        for instance in self.gx_instances:
+            instance.create_nanny(kill_list)
+        self.gx_nanny = self.gx_instances[0].nanny
+        for bridge in self.bridges:
+            bridge.create_nanny()
 
         self.update_jackd_proc_status(False)
-        self.update_gx_proc_status(False)
-        self.gx_client.add_observer(self, "all")
-        self.gx_client.add_observer(self.status_tab, "state")
+        self.update_gx_proc_status(self.gx_instances[0], False)
         self.update_iface_status(self.iface_monitor.is_present())
-        if not self.config["Jack"].getboolean("wait_for_device"):
+        if (self.backend_switcher
+                or not self.config["Jack"].getboolean("wait_for_device")):
             GLib.timeout_add(1000, self.jack_nanny.start)
+        startup_timer.mark("services started")
+        return False
+
+    def _build_presets_tab(self):
+        from .presets_tab import PresetsTab
+        self.presets_tab = PresetsTab(self)
+        return self.presets_tab
+
+    def _build_meters_tab(self):
+        from .meters_tab import MetersTab
+        self.meters_tab = MetersTab(self)
+        return self.meters_tab
+
+    def _build_scope_tab(self):
+        from .scope_tab import ScopeTab
+        self.scope_tab = ScopeTab(self)
+        return self.scope_tab
+
+    def _build_tracks_tab(self):
+        from .tracks_tab import TracksTab
+        self.tracks_tab = TracksTab(self)
+        return self.tracks_tab
+
+    def _build_system_tab(self):
+        from .system_tab import SystemTab
+        self.system_tab = SystemTab(self)
+        return self.system_tab
+
+    def _page_switched(self, notebook, page, page_num):
+        if isinstance(page, LazyTab):
+            page.build()
+        self.log_handler.set_visible(page is self.status_tab)
 
     def _signal(self, signum):
         logger.info("Exitting with signal: %r", signum)
         self.quit()
 
     def quit(self, *args):
-        if self.gx_nanny:
-            self.gx_nanny.let_it_stop()
-        if self.gx_client:
-            GLib.idle_add(self.gx_client.api.shutdown)
+        if self._quitting:
+            return
+        self._quitting = True
+        logger.info("Shutting down...")
+        for instance in self.gx_instances:
+            GLib.idle_add(instance.client.api.shutdown)
+        self._quit_timeout_id = GLib.timeout_add(QUIT_TIMEOUT, self._quit_timeout)
+        # guitarix and the player are jack clients, jackd goes last
+        nannies = self.get_gx_nannies() + self.get_bridge_nannies()
         if self.tracks_tab:
-            self.tracks_tab.stop_player()
-        GLib.timeout_add(2000, self._do_quit)
+            nannies.append(self.tracks_tab.player_nanny)
+            if self.tracks_tab.track_player:
+                self.tracks_tab.track_player.close()
+        stop_all_async(nannies, self._clients_stopped, self._stop_progress,
+                       grace=GX_SHUTDOWN_GRACE)
+
+    def _clients_stopped(self):
+        stop_all_async([self.jack_nanny], self._do_quit, self._stop_progress)
+
+    def _quit_timeout(self):
+        logger.warning("Shutdown takes too long, quitting anyway")
+        self._do_quit()
+        return False
 
     def _do_quit(self):
-        if self.gx_nanny:
-            self.gx_nanny.stop()
-        if self.jack_nanny:
-            self.jack_nanny.stop()
+        if self._quit_timeout_id is None:
+            # already done
+            return
+        GLib.source_remove(self._quit_timeout_id)
+        self._quit_timeout_id = None
         Gtk.main_quit()
 
+    def _stop_progress(self, nanny, stage):
+        if nanny is self.jack_nanny:
+            self.status_tab.update_jackd_proc_stage(stage)
+        elif nanny is self.gx_nanny:
+            self.status_tab.update_gx_proc_stage(stage)
+
+    def get_nannies(self):
+        nannies = ([self.jack_nanny] + self.get_gx_nannies()
+                   + self.get_bridge_nannies())
+        if self.tracks_tab:
+            nannies.append(self.tracks_tab.player_nanny)
+        return [nanny for nanny in nannies if nanny]
+
+    def check_cpu_layout(self):
+        """Re-apply and verify CPU affinity and scheduling of ampi_app and
+        the managed processes. Returns True when all is as configured."""
+        problems = []
+        if self.sched:
+            self.sched.apply(os.getpid())
+            problems += ["ampi_app: " + problem
+                         for problem in self.sched.check(os.getpid())]
+        for line in describe_sched(os.getpid()):
+            logger.info("ampi_app: %s", line)
+        for nanny in self.get_nannies():
+            nanny.apply_sched()
+            problems += [nanny.name + ": " + problem
+                         for problem in nanny.check_sched()]
+            pid = nanny.get_pid()
+            if pid:
+                for line in describe_sched(pid):
+                    logger.info("%s: %s", nanny.name, line)
+        for problem in problems:
+            logger.warning("CPU layout: %s", problem)
+        if not problems:
+            logger.info("CPU layout OK")
+        return not problems
+
+    def _jack_command(self):
+        """jackd command line for the interface currently found.
+
+        The configured device is replaced with the ALSA card id, so
+        a renumbered card still works."""
+        command = self.config["Jack"]["cmdline"].split()
+        card_id = self.iface_monitor.card_id if self.iface_monitor else None
+        if not card_id:
+            return command
+        device = self.config["Jack"]["device"]
+        card = "hw:" + card_id
+        return [arg[:-len(device)] + card if arg in (device, "-d" + device)
+                else arg for arg in command]
+
+    def _jack_device(self):
+        """ALSA device for the JACK backend, None for the dummy one."""
+        if not self.iface_monitor or not self.iface_monitor.present:
+            return None
+        if self.iface_monitor.card_id:
+            return "hw:" + self.iface_monitor.card_id
+        return self.config["Jack"]["device"]
+
+    def _start_jack_server(self):
+        self.backend_switcher.start_server(self._jack_device())
+        return False
+
+    def _backend_switched(self, device, ok, start):
+        self.status_tab.update_backend_status(self.backend_switcher, device, ok)
+        if start:
+            if ok:
+                self._jack_status_changed(True)
+                if device != self._jack_device():
+                    # the interface came or went meanwhile
+                    self.backend_switcher.switch(self._jack_device())
+            else:
+                # e.g. jackdbus not ready yet
+                logger.error("Could not start JACK, retrying in %.0f s",
+                             BACKEND_RETRY_DELAY / 1000)
+                self._schedule_backend_retry()
+            return
+        if not ok:
+            logger.warning("JACK backend switch to %s failed, retrying in %.0f s",
+                           device or "dummy", BACKEND_RETRY_DELAY / 1000)
+            self._schedule_backend_retry()
+        elif device:
+            self._log_plug_in_time("audio (backend switched)")
+            self.iface_monitor.plugged_at = None
+
+    def _schedule_backend_retry(self):
+        if self._backend_retry_id is None:
+            self._backend_retry_id = GLib.timeout_add(BACKEND_RETRY_DELAY,
+                                                      self._retry_backend)
+
+    def _retry_backend(self):
+        self._backend_retry_id = None
+        switcher = self.backend_switcher
+        # the wanted device may have changed since the failure
+        if not switcher.running:
+            if self.jack_nanny.is_started():
+                # jackdbus is still there
+                switcher.start_server(self._jack_device())
+        elif switcher.device != self._jack_device():
+            switcher.switch(self._jack_device())
+        return False
+
+    def _log_plug_in_time(self, stage):
+        plugged_at = self.iface_monitor and self.iface_monitor.plugged_at
+        if plugged_at is not None:
+            logger.info("Interface plug-in to %s: %.2f s", stage,
+                        time.monotonic() - plugged_at)
+
     def update_iface_status(self, present):
-        self.status_tab.update_iface_status(present)
-        if present:
-            GLib.timeout_add(1000, self.jack_nanny.start)
+        self.status_tab.update_iface_status(present, self.iface_monitor.card_id)
+        if self.backend_switcher:
+            if self.backend_switcher.running:
+                # keep guitarix running, replace only the JACK backend
+                self.backend_switcher.switch(self._jack_device())
+            elif not self.jack_nanny.is_started():
+                self.jack_nanny.start()
+        elif present:
+            command = self._jack_command()
+            if self.jack_nanny.is_started() and command != self.jack_nanny.command:
+                # another card (or the same one under another id)
+                logger.info("Audio interface changed, restarting jackd")
+                self.jack_nanny.command = command
+                self.jack_nanny.restart_async(progress=self._stop_progress)
+                return
+            self.jack_nanny.command = command
+            # events already settled, no need to wait
+            self.jack_nanny.start()
         else:
-            self.gx_nanny.stop()
-            self.jack_nanny.stop()
+            # the device is gone, nothing to lose by stopping both at once
+            stop_all_async(self.get_gx_nannies() + self.get_bridge_nannies()
+                           + [self.jack_nanny],
+                           progress=self._stop_progress)
 
     def update_jackd_proc_status(self, started):
+        if started and self.backend_switcher:
+            # jackdbus is running, now the server itself
+            GLib.timeout_add(1000, self._start_jack_server)
+            return
+        if self.backend_switcher:
+            self.backend_switcher.running = False
+            self.status_tab.update_backend_status(self.backend_switcher,
+                                                  None, True)
+        self._jack_status_changed(started)
+
+    def _jack_status_changed(self, started):
         self.status_tab.update_jackd_proc_status(started)
-        self.tracks_tab.update_jackd_proc_status(started)
+        if self.tracks_tab:
+            self.tracks_tab.update_jackd_proc_status(started)
         if started:
-            GLib.timeout_add(1000, self.gx_nanny.start)
+            self._log_plug_in_time("jackd started")
+            cleanup = self._gx_cleanup
+            for nanny in self.get_gx_nannies():
+                if cleanup and cleanup.running:
+                    cleanup.add_callback(lambda op, nanny=nanny: nanny.start())
+                else:
+                    GLib.timeout_add(1000, nanny.start)
+            for nanny in self.get_bridge_nannies():
+                GLib.timeout_add(1000, nanny.start)
             GLib.timeout_add(1000, self.jack_client.connect)
 
-    def update_gx_proc_status(self, started):
-        self.status_tab.update_gx_proc_status(started)
-        if started:
-            self._gx_start_id = GLib.timeout_add(1000, self.gx_client.connect)
+    def get_gx_nannies(self):
+        return [instance.nanny for instance in self.gx_instances
+                if instance.nanny]
+
+    def get_bridge_nannies(self):
+        return [bridge.nanny for bridge in self.bridges if bridge.nanny]
+
+    def update_gx_proc_status(self, instance, started):
+        if instance is self.gx_instances[0]:
+            self.status_tab.update_gx_proc_status(started)
         else:
-            if self._gx_start_id is not None:
-                GLib.source_remove(self._gx_start_id)
-                self._gx_start_id = None
+            logger.info("Guitarix %r %s", instance.name,
+                        "started" if started else "stopped")
 
     def gx_connected(self, gx_client):
-        if self._gx_start_id is not None:
-            # if connected, then the connect function returned None
-            # and thhis has already been removed from glib
-            self._gx_start_id = None
+        self._log_plug_in_time("audio (guitarix connected)")
+        if self.iface_monitor:
+            # measured once per plug-in
+            self.iface_monitor.plugged_at = None
 
     def gx_message(self, gx_client, level, message):
         logger.info("Guitarix: %s %s", level, message)
@@ -193,10 +610,18 @@ class MainWindow(Gtk.Window):
 def main():
     parser = argparse.ArgumentParser(description="Ampi UI and process management")
     parser.add_argument("-d", "--debug", action="store_true")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="log where the start-up time goes")
     args = parser.parse_args()
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
+    elif args.profile_startup:
+        logging.basicConfig(level=logging.INFO)
+    if args.profile_startup:
+        startup_timer.enable()
+        startup_timer.mark("imports done")
     win = MainWindow(args)
+    startup_timer.mark("main window created")
     win.show_all()
     Gtk.main()
 
@@ -0,0 +1,210 @@
+"""Tuner and level meters tab."""
+
+import math
+import time
+import logging
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, GLib
+
+from .guitarix import GuitarixClientError
+
+logger = logging.getLogger("meters_tab")
+
+NOTE_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+
+# level meter range (dB)
+METER_MIN_DB = -60.0
+# number of output channels metered
+OUTPUT_CHANNELS = 2
+# RPC cost statistics period (seconds)
+RPC_STATS_PERIOD = 1.0
+
+def freq_to_note(freq):
+    """Note name and offset in cents for a frequency."""
+    note = 12 * math.log2(freq / 440.0) + 69
+    nearest = round(note)
+    name = "{}{}".format(NOTE_NAMES[nearest % 12], nearest // 12 - 1)
+    return name, (note - nearest) * 100
+
+def level_to_fraction(level):
+    """Map linear peak level to 0..1 meter position (dB scale)."""
+    if level <= 0:
+        return 0.0
+    db = 20 * math.log10(level)
+    return min(1.0, max(0.0, (db - METER_MIN_DB) / -METER_MIN_DB))
+
+def as_list(value):
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+class TunerNeedle(Gtk.DrawingArea):
+    """Cents offset display: -50..+50 with a needle."""
+    def __init__(self):
+        Gtk.DrawingArea.__init__(self, hexpand=True)
+        self.set_size_request(-1, 40)
+        self.cents = None
+        self.connect("draw", self._draw)
+
+    def set_cents(self, cents):
+        if cents != self.cents:
+            self.cents = cents
+            self.queue_draw()
+
+    def _draw(self, widget, ctx):
+        width = self.get_allocated_width()
+        height = self.get_allocated_height()
+        ctx.set_source_rgb(0.5, 0.5, 0.5)
+        for cents in range(-50, 51, 10):
+            x = width * (cents + 50) / 100
+            ctx.move_to(x, height * (0.2 if cents else 0))
+            ctx.line_to(x, height * 0.4)
+        ctx.stroke()
+        if self.cents is None:
+            return
+        if abs(self.cents) < 5:
+            ctx.set_source_rgb(0, 0.6, 0)
+        else:
+            ctx.set_source_rgb(0.8, 0, 0)
+        x = width * (self.cents + 50) / 100
+        ctx.set_line_width(3)
+        ctx.move_to(x, 0)
+        ctx.line_to(x, height)
+        ctx.stroke()
+
+class MetersTab(Gtk.Box):
+    """Guitarix tuner and input/output level meters.
+
+    The values are polled at the [UI] meter_rate, only while the tab is
+    shown and guitarix connected. Each frame costs three RPC round-trips,
+    which are measured and shown."""
+    def __init__(self, main_window):
+        Gtk.Box.__init__(self)
+        self.main_window = main_window
+        self.gx_client = main_window.gx_client
+        self.rate = main_window.config["UI"].getint("meter_rate", 20)
+        self._timer_id = None
+        self._rpc_calls = 0
+        self._rpc_time = 0.0
+        self._stats_start = time.monotonic()
+
+        self.set_orientation(Gtk.Orientation.VERTICAL)
+
+        self.note_l = Gtk.Label("--",
+                                justify=Gtk.Justification.CENTER,
+                                xalign=0.5)
+        self.pack_start(self.note_l, False, False, 2)
+        self.needle = TunerNeedle()
+        self.pack_start(self.needle, False, False, 2)
+
+        grid = Gtk.Grid(border_width=10,
+                        column_spacing=5,
+                        row_spacing=5,
+                        hexpand=True)
+        label = Gtk.Label("Input:",
+                          justify=Gtk.Justification.RIGHT,
+                          xalign=1)
+        grid.attach(label, 0, 0, 1, 1)
+        self.input_bars = [Gtk.LevelBar(hexpand=True)]
+        grid.attach(self.input_bars[0], 1, 0, 1, 1)
+        self.output_bars = []
+        for i in range(OUTPUT_CHANNELS):
+            label = Gtk.Label("Output {}:".format(i + 1),
+                              justify=Gtk.Justification.RIGHT,
+                              xalign=1)
+            grid.attach(label, 0, i + 1, 1, 1)
+            bar = Gtk.LevelBar(hexpand=True)
+            grid.attach(bar, 1, i + 1, 1, 1)
+            self.output_bars.append(bar)
+        self.pack_start(grid, False, False, 2)
+
+        self.rpc_stats_l = Gtk.Label("",
+                                     justify=Gtk.Justification.LEFT,
+                                     xalign=0)
+        self.pack_end(self.rpc_stats_l, False, False, 2)
+
+        self.connect("map", self._mapped)
+        self.connect("unmap", self._unmapped)
+        self.gx_client.add_observer(self)
+
+    def _mapped(self, widget):
+        self._start()
+
+    def _unmapped(self, widget):
+        self._stop()
+
+    def gx_connected(self, gx_client):
+        if self.get_mapped():
+            self._start()
+
+    def gx_disconnected(self, gx_client):
+        self._stop()
+
+    def _start(self):
+        if self._timer_id is not None or not self.gx_client.connected():
+            return
+        logger.debug("Metering started")
+        try:
+            self.gx_client.api.switch_tuner(True)
+        except GuitarixClientError as err:
+            logger.debug("Cannot switch the tuner on: %s", err)
+            return
+        self._rpc_calls = 0
+        self._rpc_time = 0.0
+        self._stats_start = time.monotonic()
+        self._timer_id = GLib.timeout_add(1000 // self.rate, self._poll)
+
+    def _stop(self):
+        if self._timer_id is None:
+            return
+        logger.debug("Metering stopped")
+        GLib.source_remove(self._timer_id)
+        self._timer_id = None
+        self._tuner_off()
+
+    def _tuner_off(self):
+        if self.gx_client.connected():
+            try:
+                self.gx_client.api.switch_tuner(False)
+            except GuitarixClientError as err:
+                logger.debug("Cannot switch the tuner off: %s", err)
+
+    def _poll(self):
+        api = self.gx_client.api
+        start = time.monotonic()
+        try:
+            freq = api.get_tuner_freq()
+            input_levels = as_list(api.get_max_input_level())
+            output_levels = as_list(api.get_max_output_level(OUTPUT_CHANNELS))
+        except GuitarixClientError as err:
+            # restarted on the next map or guitarix connection
+            logger.debug("Metering failed: %s", err)
+            self._timer_id = None
+            self._tuner_off()
+            return False
+        now = time.monotonic()
+        self._rpc_calls += 3
+        self._rpc_time += now - start
+
+        if freq and freq > 0:
+            name, cents = freq_to_note(freq)
+            self.note_l.set_text("{} {:+.0f} cents ({:.1f} Hz)".format(name, cents, freq))
+            self.needle.set_cents(cents)
+        else:
+            self.note_l.set_text("--")
+            self.needle.set_cents(None)
+        for bar, level in zip(self.input_bars, input_levels):
+            bar.set_value(level_to_fraction(level))
+        for bar, level in zip(self.output_bars, output_levels):
+            bar.set_value(level_to_fraction(level))
+
+        period = now - self._stats_start
+        if period >= RPC_STATS_PERIOD:
+            self.rpc_stats_l.set_text("RPC: {:.0f} calls/s, {:.1f} ms/s".format(
+                    self._rpc_calls / period, self._rpc_time / period * 1000))
+            self._rpc_calls = 0
+            self._rpc_time = 0.0
+            self._stats_start = now
+        return True
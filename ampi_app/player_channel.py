@@ -0,0 +1,182 @@
+"""Command channel to the mplayer slave."""
+
+import time
+import logging
+import threading
+from collections import deque
+
+from gi.repository import GLib
+
+from .proc import LineAssembler
+
+logger = logging.getLogger("player_channel")
+
+# player state query interval (ms)
+STATE_POLL_INTERVAL = 500
+
+# commands where only the latest value matters
+CONTINUOUS_COMMANDS = {"volume", "speed_set"}
+
+STATE_QUERIES = [
+        "pausing_keep_force get_property pause",
+        "pausing_keep_force get_time_pos",
+        "pausing_keep_force get_time_length",
+        "pausing_keep_force get_file_name",
+        ]
+
+class PlayerState:
+    """mplayer state, as reported by the ANS_* replies."""
+    def __init__(self):
+        self.loaded = False
+        self.paused = True
+        self.position = None
+        self.length = None
+        self.filename = None
+        # time.monotonic() when the position was reported
+        self.updated = None
+
+    def __eq__(self, other):
+        return (dict(vars(self), updated=None)
+                == dict(vars(other), updated=None))
+
+    def copy(self):
+        state = PlayerState()
+        state.__dict__.update(vars(self))
+        return state
+
+class MPlayerChannel:
+    """Non-blocking, coalescing command queue for the mplayer slave.
+
+    Commands are written to the player stdin by a separate thread, so
+    a stalled player cannot block the GUI. A continuous control command
+    (volume, speed_set) replaces the same command still waiting in
+    the queue, unless another command was queued after it, so dragging
+    a slider sends only the latest value.
+
+    The player state is polled with 'pausing_keep_force' queries and
+    `state_callback(state)` is called in the main loop when it changes."""
+    def __init__(self, nanny, state_callback=None):
+        self.nanny = nanny
+        self.state_callback = state_callback
+        self.state = PlayerState()
+        self._reported = self.state.copy()
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._lines = LineAssembler()
+        self._coalesced = 0
+        self._poll_id = None
+        self._thread = threading.Thread(name="Player commands",
+                                        target=self._run,
+                                        daemon=True)
+        self._thread.start()
+
+    def send(self, command):
+        """Queue a command line (without the line end)."""
+        parts = command.split()
+        if parts[0].startswith("pausing"):
+            name = parts[1] if len(parts) > 1 else None
+        else:
+            name = parts[0]
+        with self._cond:
+            if name in CONTINUOUS_COMMANDS:
+                for entry in reversed(self._queue):
+                    if entry[0] not in CONTINUOUS_COMMANDS:
+                        break
+                    if entry[0] == name:
+                        entry[1] = command
+                        self._coalesced += 1
+                        return
+            self._queue.append([name, command])
+            self._cond.notify()
+
+    def clear(self):
+        """Drop the queued commands (e.g. when the player is restarted)."""
+        with self._cond:
+            self._queue.clear()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                name, command = self._queue.popleft()
+            try:
+                self.nanny.write(command + "\n")
+            except (OSError, ValueError) as err:
+                logger.error("Cannot send %r command to the track player: %s",
+                             command, err)
+
+    def start_polling(self):
+        if self._poll_id is None:
+            self._poll_id = GLib.timeout_add(STATE_POLL_INTERVAL, self._poll)
+
+    def stop_polling(self):
+        if self._poll_id is not None:
+            GLib.source_remove(self._poll_id)
+            self._poll_id = None
+        self.state = PlayerState()
+        self._state_changed()
+
+    def _poll(self):
+        with self._cond:
+            # do not pile up queries when the player does not read them
+            if len(self._queue) > len(STATE_QUERIES):
+                return True
+            self._queue.extend([None, query] for query in STATE_QUERIES)
+            self._cond.notify()
+        if self._coalesced:
+            logger.debug("%i player commands coalesced", self._coalesced)
+            self._coalesced = 0
+        return True
+
+    def feed(self, data):
+        """Process player output (called from the output thread).
+
+        Returns the lines which were not ANS_* replies."""
+        other = []
+        changed = False
+        for line in self._lines.feed(data):
+            # status lines are terminated with '\r' only
+            line = line.rsplit(b"\r", 1)[-1].decode("utf-8", "replace").strip()
+            if not line.startswith("ANS_"):
+                other.append(line)
+                continue
+            changed |= self._parse_answer(line)
+        if changed:
+            GLib.idle_add(self._state_changed)
+        return other
+
+    def _parse_answer(self, line):
+        state = self.state
+        key, _, value = line.partition("=")
+        try:
+            if key == "ANS_pause":
+                state.loaded = True
+                state.paused = value == "yes"
+            elif key == "ANS_TIME_POSITION":
+                state.position = float(value)
+                state.updated = time.monotonic()
+            elif key == "ANS_LENGTH":
+                state.length = float(value)
+            elif key == "ANS_FILENAME":
+                state.filename = value.strip("'")
+            elif key == "ANS_ERROR" and value == "PROPERTY_UNAVAILABLE":
+                # no file loaded
+                state.loaded = False
+                state.paused = True
+                state.position = None
+                state.length = None
+                state.filename = None
+            else:
+                return False
+        except ValueError:
+            logger.debug("Unexpected player answer: %r", line)
+            return False
+        return True
+
+    def _state_changed(self):
+        if self.state != self._reported:
+            self._reported = self.state.copy()
+            if self.state_callback:
+                self.state_callback(self._reported)
+        return False
@@ -0,0 +1,224 @@
+
+"""Searchable preset browser."""
+
+import os
+import json
+import logging
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, GLib
+
+logger = logging.getLogger("preset_browser")
+
+FAVOURITES_FILE = os.path.expanduser("~/.config/ampi_app/favourites.json")
+
+COL_BANK = 0
+COL_PRESET = 1
+COL_FAVOURITE = 2
+COL_VISIBLE = 3
+
+class PresetIndex:
+    """Incremental search over bank and preset names.
+
+    All words of the query must be found in the bank or preset name. When
+    the query only extends the previous one, just the previous matches are
+    searched again."""
+    def __init__(self):
+        self.keys = []
+        self._texts = []
+        self._last_query = None
+        self._last_result = None
+
+    def update(self, banks):
+        self.keys = [(bank_name, preset)
+                     for bank_name in sorted(banks)
+                     for preset in banks[bank_name]]
+        self._texts = ["{}\n{}".format(bank_name, preset).casefold()
+                       for bank_name, preset in self.keys]
+        self._last_query = None
+        self._last_result = None
+
+    def search(self, query):
+        """Return indices (into `keys`) of the entries matching `query`."""
+        query = query.casefold()
+        words = query.split()
+        if not words:
+            result = list(range(len(self.keys)))
+        else:
+            if self._last_result is not None and query.startswith(self._last_query):
+                candidates = self._last_result
+            else:
+                candidates = range(len(self.keys))
+            texts = self._texts
+            result = [i for i in candidates
+                      if all(word in texts[i] for word in words)]
+        self._last_query = query
+        self._last_result = result
+        return result
+
+def load_favourites():
+    try:
+        with open(FAVOURITES_FILE, "rt", encoding="utf-8") as fav_f:
+            return [tuple(item) for item in json.load(fav_f)]
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError, TypeError) as err:
+        logger.warning("Cannot load %r: %s", FAVOURITES_FILE, err)
+        return []
+
+def save_favourites(favourites):
+    try:
+        os.makedirs(os.path.dirname(FAVOURITES_FILE), exist_ok=True)
+        tmp_path = FAVOURITES_FILE + ".tmp"
+        with open(tmp_path, "wt", encoding="utf-8") as fav_f:
+            json.dump([list(item) for item in favourites], fav_f, indent=1)
+        os.replace(tmp_path, FAVOURITES_FILE)
+    except OSError as err:
+        logger.warning("Cannot save %r: %s", FAVOURITES_FILE, err)
+
+class PresetBrowser(Gtk.Box):
+    """Preset list with search and a favourites/setlist view.
+
+    Backed by a Gtk.ListStore, so only the visible rows are rendered."""
+    def __init__(self, activate_cb):
+        Gtk.Box.__init__(self, orientation=Gtk.Orientation.VERTICAL)
+        self.activate_cb = activate_cb
+
+        top_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL,
+                          border_width=5)
+        self.search_e = Gtk.SearchEntry(hexpand=True)
+        self.search_e.connect("search-changed", self._search_changed)
+        top_box.pack_start(self.search_e, True, True, 2)
+        self.favourites_b = Gtk.ToggleButton.new_with_label("Favourites")
+        self.favourites_b.connect("toggled", self._favourites_toggled)
+        top_box.pack_start(self.favourites_b, False, False, 2)
+        self.pack_start(top_box, False, False, 0)
+
+        self.store = Gtk.ListStore(str, str, bool, bool)
+        self.filter = self.store.filter_new()
+        self.filter.set_visible_column(COL_VISIBLE)
+        self.fav_store = Gtk.ListStore(str, str, bool, bool)
+        self.fav_store.connect("row-deleted", self._fav_reordered)
+
+        self.view = Gtk.TreeView(model=self.filter,
+                                 headers_visible=False,
+                                 enable_search=False,
+                                 activate_on_single_click=True)
+        renderer = Gtk.CellRendererToggle(activatable=True)
+        renderer.connect("toggled", self._favourite_toggled)
+        self.view.append_column(Gtk.TreeViewColumn("", renderer,
+                                                   active=COL_FAVOURITE))
+        self.view.append_column(Gtk.TreeViewColumn("Bank", Gtk.CellRendererText(),
+                                                   text=COL_BANK))
+        self.view.append_column(Gtk.TreeViewColumn("Preset", Gtk.CellRendererText(),
+                                                   text=COL_PRESET))
+        self.view.connect("row-activated", self._row_activated)
+
+        scrolled = Gtk.ScrolledWindow(hexpand=True, vexpand=True)
+        scrolled.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        scrolled.add(self.view)
+        self.pack_start(scrolled, True, True, 0)
+
+        self.index = PresetIndex()
+        self.banks = {}
+        self._rows = {}
+        self._visible = set()
+        self._saving_favourites = False
+        self.favourites = load_favourites()
+        self._fill_fav_store()
+
+    def update_banks(self, banks):
+        """Load a new bank -> presets mapping into the model."""
+        if banks == self.banks:
+            return
+        self.banks = banks
+        self.index.update(banks)
+        favourites = set(self.favourites)
+        # detach the model while filling it, so the view is not updated
+        # for every row
+        self.view.set_model(None)
+        self.store.clear()
+        self._rows = {}
+        for i, key in enumerate(self.index.keys):
+            self.store.append([key[0], key[1], key in favourites, True])
+            self._rows[key] = i
+        self._visible = set(range(len(self.index.keys)))
+        self._attach_model()
+        self._search_changed(self.search_e)
+
+    def _attach_model(self):
+        if self.favourites_b.get_active():
+            self.view.set_model(self.fav_store)
+            self.view.set_reorderable(True)
+        else:
+            self.view.set_model(self.filter)
+            self.view.set_reorderable(False)
+
+    def _search_changed(self, entry):
+        visible = set(self.index.search(entry.get_text()))
+        # only touch the rows that changed
+        for i in visible ^ self._visible:
+            self.store[i][COL_VISIBLE] = i in visible
+        self._visible = visible
+
+    def _favourites_toggled(self, button):
+        self.search_e.set_sensitive(not button.get_active())
+        self._attach_model()
+
+    def _row_activated(self, view, path, column):
+        model = view.get_model()
+        row = model[path]
+        self.activate_cb(row[COL_BANK], row[COL_PRESET])
+
+    def _favourite_toggled(self, renderer, path):
+        model = self.view.get_model()
+        row = model[path]
+        key = (row[COL_BANK], row[COL_PRESET])
+        if key in self.favourites:
+            self.favourites.remove(key)
+        else:
+            self.favourites.append(key)
+        index = self._rows.get(key)
+        if index is not None:
+            self.store[index][COL_FAVOURITE] = key in self.favourites
+        self._fill_fav_store()
+        save_favourites(self.favourites)
+
+    def _fill_fav_store(self):
+        self._saving_favourites = True
+        try:
+            self.fav_store.clear()
+            for bank_name, preset in self.favourites:
+                self.fav_store.append([bank_name, preset, True, True])
+        finally:
+            self._saving_favourites = False
+
+    def _fav_reordered(self, model, path):
+        # drag and drop reordering ends with a 'row-deleted'
+        if not self._saving_favourites:
+            GLib.idle_add(self._save_fav_order)
+
+    def _save_fav_order(self):
+        favourites = [(row[COL_BANK], row[COL_PRESET]) for row in self.fav_store]
+        if favourites != self.favourites:
+            logger.debug("Favourites reordered: %r", favourites)
+            self.favourites = favourites
+            save_favourites(favourites)
+        return False
+
+    def select(self, bank_name, preset):
+        """Move the cursor to the given preset, if it is shown."""
+        model = self.view.get_model()
+        if model is self.filter:
+            index = self._rows.get((bank_name, preset))
+            if index is None:
+                return
+            path = self.filter.convert_child_path_to_path(Gtk.TreePath(index))
+            if path is not None:
+                self.view.set_cursor(path, None, False)
+        elif model is self.fav_store:
+            for row in model:
+                if row[COL_BANK] == bank_name and row[COL_PRESET] == preset:
+                    self.view.set_cursor(row.path, None, False)
+                    return
@@ -0,0 +1,182 @@
+"""Per-preset DSP cost profiling."""
+
+import os
+import time
+import json
+import logging
+
+from gi.repository import GLib
+
+from .guitarix import GuitarixClientError
+
+logger = logging.getLogger("preset_profile")
+
+COST_FILE = os.path.expanduser("~/.config/ampi_app/preset_cost.json")
+
+# time given to a preset to load and settle before measuring (seconds)
+PROFILE_SETTLE_TIME = 2.0
+# measurement window (seconds)
+PROFILE_WINDOW = 3.0
+# load sampling interval (ms)
+PROFILE_SAMPLE_INTERVAL = 100
+
+# cost classes for the preset buttons: (max load, class name)
+COST_CLASSES = [
+        (50.0, "low"),
+        (80.0, "medium"),
+        ]
+
+def load_costs():
+    try:
+        with open(COST_FILE, "rt", encoding="utf-8") as cost_f:
+            data = json.load(cost_f)
+        return {tuple(item["preset"]): item["cost"] for item in data}
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, TypeError, KeyError) as err:
+        logger.warning("Cannot load %r: %s", COST_FILE, err)
+        return {}
+
+def save_costs(costs):
+    data = [{"preset": list(key), "cost": cost} for key, cost in costs.items()]
+    try:
+        os.makedirs(os.path.dirname(COST_FILE), exist_ok=True)
+        tmp_path = COST_FILE + ".tmp"
+        with open(tmp_path, "wt", encoding="utf-8") as cost_f:
+            json.dump(data, cost_f)
+        os.replace(tmp_path, COST_FILE)
+    except OSError as err:
+        logger.warning("Cannot save %r: %s", COST_FILE, err)
+
+def cost_class(cost):
+    """Classify a preset cost: 'low', 'medium' or 'high'."""
+    if cost["xruns"]:
+        return "high"
+    for max_load, name in COST_CLASSES:
+        if cost["max_load"] < max_load:
+            return name
+    return "high"
+
+def cost_description(cost):
+    return "DSP load avg {:.0f}%, max {:.0f}%, {} xruns (at {} frames)".format(
+            cost["avg_load"], cost["max_load"], cost["xruns"], cost["frames"])
+
+class PresetProfiler:
+    """Loads presets one by one and measures the JACK DSP load and xruns
+    each causes once settled.
+
+    `callback(key, cost)` is called for every measured preset and
+    `callback(None, None)` when profiling ends (also when aborted, e.g.
+    because guitarix got disconnected)."""
+    def __init__(self, gx_client, jack_client, frames, callback=None):
+        self.gx_client = gx_client
+        self.jack_client = jack_client
+        self.frames = frames
+        self.callback = callback
+        self.costs = load_costs()
+        self._queue = []
+        self._restore = None
+        self._key = None
+        self._samples = []
+        self._xruns_start = 0
+        self._stage = None
+        self._stage_end = 0
+        self._timer_id = None
+        gx_client.add_observer(self)
+
+    def gx_disconnected(self, gx_client):
+        if self.is_running():
+            logger.warning("Guitarix disconnected, profiling aborted")
+            self._restore = None
+            self._done()
+
+    def get_cost(self, bank_name, preset_name):
+        """Measured cost of a preset (None if not measured at the current
+        period size)."""
+        cost = self.costs.get((bank_name, preset_name))
+        if cost and cost.get("frames") == self.frames:
+            return cost
+        return None
+
+    def is_running(self):
+        return self._timer_id is not None
+
+    def start(self, bank_name, presets, restore=None):
+        """Profile presets of a bank, then load the `restore` preset."""
+        if self.is_running():
+            return
+        logger.info("Profiling %i presets of bank %r", len(presets), bank_name)
+        self._queue = [(bank_name, preset) for preset in presets]
+        self._restore = restore
+        self._timer_id = GLib.timeout_add(PROFILE_SAMPLE_INTERVAL, self._tick)
+        if not self._next_preset():
+            self._done()
+
+    def cancel(self):
+        if not self.is_running():
+            return
+        logger.info("Profiling cancelled")
+        self._done()
+
+    def _next_preset(self):
+        self._key = self._queue.pop(0)
+        logger.debug("Profiling %r", self._key)
+        try:
+            self.gx_client.api.setpreset(*self._key)
+        except GuitarixClientError as err:
+            logger.warning("Cannot load %r, profiling aborted: %s", self._key, err)
+            return False
+        self._stage = "settle"
+        self._stage_end = time.monotonic() + PROFILE_SETTLE_TIME
+        return True
+
+    def _tick(self):
+        now = time.monotonic()
+        if self._stage == "settle":
+            if now >= self._stage_end:
+                self._samples = []
+                self._xruns_start = self.jack_client.xruns
+                self._stage = "measure"
+                self._stage_end = now + PROFILE_WINDOW
+            return True
+        load = self.jack_client.get_cpu_load()
+        if load is None:
+            logger.warning("JACK not available, profiling aborted")
+            self._timer_id = None
+            self._done()
+            return False
+        self._samples.append(load)
+        if now < self._stage_end:
+            return True
+        cost = {
+                "avg_load": sum(self._samples) / len(self._samples),
+                "max_load": max(self._samples),
+                "xruns": self.jack_client.xruns - self._xruns_start,
+                "frames": self.frames,
+                "measured": time.time(),
+                }
+        logger.info("Preset %s/%s: %s", self._key[0], self._key[1],
+                    cost_description(cost))
+        self.costs[self._key] = cost
+        if self.callback:
+            self.callback(self._key, cost)
+        if not self._queue or not self._next_preset():
+            self._timer_id = None
+            self._done()
+            return False
+        return True
+
+    def _done(self):
+        timer_id, self._timer_id = self._timer_id, None
+        if timer_id is not None:
+            GLib.source_remove(timer_id)
+        self._queue = []
+        save_costs(self.costs)
+        restore, self._restore = self._restore, None
+        if restore:
+            try:
+                self.gx_client.api.setpreset(*restore)
+            except GuitarixClientError as err:
+                logger.warning("Cannot restore preset %r: %s", restore, err)
+        if self.callback:
+            self.callback(None, None)
@@ -0,0 +1,175 @@
+"""Preset switching."""
+
+import os
+import time
+import json
+import logging
+
+from .bank_cache import read_bank_contents
+from .guitarix import GuitarixClientError
+
+logger = logging.getLogger("preset_switch")
+
+# parameters which define the rack layout
+RACK_PARAMS = ("on_off", "position", "pp")
+
+def rack_layout(engine):
+    """Rack layout of a preset: active rack units (the ones with 'on_off'
+    and 'position' parameters) with their position plus all non-scalar
+    values (like convolver settings), which cannot be changed with a simple
+    'set'."""
+    units = {}
+    complex_values = []
+    for name, value in engine.items():
+        if not isinstance(value, (int, float, str)):
+            complex_values.append((name, json.dumps(value, sort_keys=True)))
+            continue
+        unit, _, param = name.rpartition(".")
+        if param in RACK_PARAMS:
+            units.setdefault(unit, {})[param] = value
+    active = [(unit, params["position"], params.get("pp"))
+              for unit, params in units.items()
+              if params.get("on_off") and "position" in params]
+    return (tuple(sorted(active, key=repr)), tuple(sorted(complex_values)))
+
+def parameter_delta(old_engine, new_engine):
+    """Parameters to set to get from `old_engine` to `new_engine`.
+
+    Returns None when this is not possible with 'set' alone."""
+    if old_engine.keys() != new_engine.keys():
+        return None
+    if rack_layout(old_engine) != rack_layout(new_engine):
+        return None
+    return {name: value for name, value in new_engine.items()
+            if old_engine[name] != value}
+
+class SwitchStats:
+    """Switch latency statistics of one switching method."""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = None
+
+    def add(self, latency):
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+        self.last = latency
+
+    def __str__(self):
+        if not self.count:
+            return "no switches"
+        return "{} switches, last {:.1f} ms, avg {:.1f} ms, max {:.1f} ms".format(
+                self.count, self.last * 1000, self.total / self.count * 1000,
+                self.max * 1000)
+
+class PresetSwitcher:
+    """Loads guitarix presets.
+
+    In the fast mode, when the live parameters and the new preset share
+    the same rack layout, only the parameters which differ are sent, in
+    a single 'set'. Preset contents are read from the bank files (located
+    with 'bank_get_filename'). Guitarix does not know about such a switch
+    (its current preset stays the old one), so it is reported to
+    the observers added with add_observer(): `observer.preset_switched(
+    bank_name, preset_name)` is called, and `switched` is the preset
+    loaded so, until guitarix reports another one.
+
+    Otherwise (or when anything goes wrong) 'setpreset' is used."""
+    def __init__(self, gx_client, fast=False, tracker=None):
+        self.gx_client = gx_client
+        self.fast = fast
+        self.tracker = tracker
+        self.current = None
+        self.switched = None
+        self.stats = {"setpreset": SwitchStats(), "delta": SwitchStats()}
+        self._banks = {}
+        self._pending_setpreset = None
+        self._observers = []
+        gx_client.add_observer(self, "preset")
+
+    def add_observer(self, observer):
+        self._observers.append(observer)
+
+    def gx_connected(self, gx_client):
+        self._banks = {}
+        self.current = None
+
+    def gx_preset_changed(self, gx_client, bank_name, preset_name):
+        pending = self._pending_setpreset
+        if pending and pending[0] == (bank_name, preset_name):
+            self._pending_setpreset = None
+            latency = time.monotonic() - pending[1]
+            self.stats["setpreset"].add(latency)
+            logger.info("Preset %r, %r loaded in %.1f ms (setpreset)",
+                        bank_name, preset_name, latency * 1000)
+        self.current = (bank_name, preset_name)
+        self.switched = None
+        if self.tracker:
+            self.tracker.changed(bank_name, preset_name)
+
+    def get_engine(self, bank_name, preset_name):
+        """Saved parameter values ('engine' section) of a preset."""
+        path, mtime, contents = self._banks.get(bank_name, (None, None, None))
+        if path is None:
+            path = self.gx_client.api.bank_get_filename(bank_name)
+        stat = os.stat(path)
+        if contents is None or stat.st_mtime != mtime:
+            contents = read_bank_contents(path)
+            self._banks[bank_name] = (path, stat.st_mtime, contents)
+        return contents[preset_name]["engine"]
+
+    def _try_delta(self, bank_name, preset_name):
+        start = time.monotonic()
+        try:
+            new_engine = self.get_engine(bank_name, preset_name)
+        except (GuitarixClientError, OSError, ValueError, KeyError, TypeError) as err:
+            logger.debug("Preset contents not available: %s", err)
+            return False
+        live = self.gx_client.api.get_parameter_value(*new_engine)
+        if not isinstance(live, dict):
+            logger.debug("Unexpected parameter values: %r", live)
+            return False
+        delta = parameter_delta(live, new_engine)
+        if delta is None:
+            logger.debug("Rack layout differs, cannot switch by parameters")
+            return False
+        if self.tracker:
+            self.tracker.sent(bank_name, preset_name, "delta")
+        if delta:
+            args = []
+            for name, value in delta.items():
+                args += [name, value]
+            self.gx_client.api.set(*args)
+            # wait for the 'set' to be processed
+            self.gx_client.api.get_parameter_value(next(iter(delta)))
+        latency = time.monotonic() - start
+        self.stats["delta"].add(latency)
+        logger.info("Preset %r, %r loaded in %.1f ms (%i parameters changed)",
+                    bank_name, preset_name, latency * 1000, len(delta))
+        if self.tracker:
+            self.tracker.changed(bank_name, preset_name)
+        self.current = (bank_name, preset_name)
+        self.switched = self.current
+        for observer in self._observers:
+            observer.preset_switched(bank_name, preset_name)
+        return True
+
+    def load(self, bank_name, preset_name):
+        """Load a preset. Returns True when done by parameter delta."""
+        if self.fast:
+            try:
+                if self._try_delta(bank_name, preset_name):
+                    return True
+            except GuitarixClientError as err:
+                logger.warning("Fast preset switch failed: %s", err)
+        self._pending_setpreset = ((bank_name, preset_name), time.monotonic())
+        self.gx_client.api.setpreset(bank_name, preset_name)
+        if self.tracker:
+            self.tracker.sent(bank_name, preset_name, "setpreset")
+        return False
+
+    def get_stats_string(self):
+        return "; ".join("{}: {}".format(method, stats)
+                         for method, stats in sorted(self.stats.items()))
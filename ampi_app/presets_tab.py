@@ -5,13 +5,49 @@ import logging
 
 import gi
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk
+from gi.repository import Gtk, Gdk
+
+from .preset_browser import PresetBrowser
+from .bank_cache import load_cache, save_cache, read_guitarix_banks
+from .preset_profile import PresetProfiler, cost_class, cost_description
+from .gx_instance import MAIN_INSTANCE
+from .guitarix import GuitarixClientError
 
 logger = logging.getLogger("presets_tab")
 
+# preset target: all guitarix instances
+ALL_INSTANCES = "*"
+
+COST_CSS = b"""
+button.preset-cost-low { background: #b0e0b0; }
+button.preset-cost-medium { background: #f0d090; }
+button.preset-cost-high { background: #f0a0a0; }
+"""
+
 def get_value(params, name):
     return params.get(name, {}).get("value", "{}").get(name)
 
+def install_css():
+    provider = Gtk.CssProvider()
+    provider.load_from_data(COST_CSS)
+    Gtk.StyleContext.add_provider_for_screen(
+            Gdk.Screen.get_default(), provider,
+            Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
+
+class BankPage(Gtk.ScrolledWindow):
+    """Preset buttons of a single bank."""
+    def __init__(self, bank_name):
+        Gtk.ScrolledWindow.__init__(self)
+        self.bank_name = bank_name
+        self.presets = []
+        self.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        self.box = Gtk.FlowBox()
+        self.box.set_border_width(10)
+        self.box.set_valign(Gtk.Align.START)
+        self.box.set_max_children_per_line(30)
+        self.box.set_selection_mode(Gtk.SelectionMode.NONE)
+        self.add(self.box)
+
 class PresetsTab(Gtk.Notebook):
     def __init__(self, main_window):
         Gtk.Notebook.__init__(self)
@@ -19,80 +55,276 @@ class PresetsTab(Gtk.Notebook):
 
         self.set_tab_pos(Gtk.PositionType.LEFT)
 
-        self.tabs = {}
+        self.max_buttons = main_window.config["UI"].getint("max_preset_buttons", 500)
+        self.browser = PresetBrowser(self.load_preset)
+        self.append_page(self.browser, Gtk.Label("Find"))
+
+        self.pages = {}
+        self.buttons = {}
         self.banks = {}
-        self.current_banke = None
+        self.current_bank = None
         self.current_preset = None
+        # selected while guitarix was not running, to be loaded on connect
+        self.pending_preset = None
+        # the buttons are being set to the current preset
+        self._showing_current = False
+        # never shown, active when no preset button is
+        self._no_preset_b = Gtk.RadioButton()
+
+        self.offline_l = Gtk.Label(no_show_all=True)
+        self.offline_l.set_markup("<span foreground='#800000'>offline</span>")
+        self.set_action_widget(self.offline_l, Gtk.PackType.END)
+        self.offline_l.show()
+
+        install_css()
+        self.profiler = PresetProfiler(main_window.gx_client,
+                                       main_window.jack_client,
+                                       main_window.config["Jack"].getint("frames"),
+                                       callback=self._preset_profiled)
+        self.profile_b = Gtk.Button.new_with_label("Profile")
+        self.profile_b.set_tooltip_text("Measure DSP load of each preset in the bank")
+        self.profile_b.connect("clicked", self._profile_clicked)
+        actions = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        actions.pack_start(self.profile_b, False, False, 0)
+        self.target_cb = None
+        instances = main_window.gx_instances
+        if len(instances) > 1:
+            self.target_cb = Gtk.ComboBoxText()
+            self.target_cb.set_tooltip_text("Guitarix instance to load presets in")
+            for instance in instances:
+                self.target_cb.append(instance.name, instance.name)
+            self.target_cb.append(ALL_INSTANCES, "all")
+            self.target_cb.set_active_id(MAIN_INSTANCE)
+            actions.pack_start(self.target_cb, False, False, 2)
+        self.set_action_widget(actions, Gtk.PackType.START)
+        actions.show_all()
+
+        self._load_offline_banks()
         self.main_window.gx_client.add_observer(self)
+        self.main_window.preset_switcher.add_observer(self)
+
+    def _load_offline_banks(self):
+        """Show the banks known from the last run (or from guitarix bank
+        files) until guitarix is connected."""
+        cache = load_cache()
+        if cache:
+            banks, self.current_bank, self.current_preset = cache
+            logger.debug("Banks loaded from cache")
+        else:
+            banks = read_guitarix_banks()
+            logger.debug("Banks loaded from guitarix bank files")
+        if banks:
+            self.update_banks(banks)
 
     def gx_connected(self, gx_client):
         params = gx_client.api.get_parameter("system.current_bank",
                                              "system.current_preset")
         self.current_bank = get_value(params, "system.current_bank")
         self.current_preset = get_value(params, "system.current_preset")
+        switched = self.main_window.preset_switcher.switched
+        if switched:
+            # loaded by parameter delta, guitarix does not know
+            self.current_bank, self.current_preset = switched
         logger.info("Current preset: %r, %r", self.current_bank, self.current_preset)
         banks = gx_client.api.banks()
         logger.info("Banks: %r", banks)
-        self.banks = {b["name"]: b for b in banks}
-        self.update_tabs()
+        self.update_banks({b["name"]: list(b["presets"]) for b in banks})
+        self.offline_l.hide()
+        if self.pending_preset:
+            bank_name, preset_name = self.pending_preset
+            self.pending_preset = None
+            load_guard = self.main_window.load_guard
+            if preset_name not in self.banks.get(bank_name, ()):
+                logger.warning("Queued preset %r, %r not available",
+                               bank_name, preset_name)
+            elif load_guard.is_starting():
+                # loaded by the guard once the system is stable
+                load_guard.set_startup_target(bank_name, preset_name)
+            else:
+                self.load_preset(bank_name, preset_name)
+        self._save_cache()
 
     def gx_disconnected(self, gx_client):
-        self.banks = {}
-        self.update_tabs()
+        # keep the widgets, they will most probably be needed again
+        # and presets selected now will be loaded on reconnect
+        self.offline_l.show()
+
+    def _save_cache(self):
+        save_cache(self.banks, self.current_bank, self.current_preset)
+
+    def preset_switched(self, bank_name, preset_name):
+        """Preset loaded by parameter delta (see PresetSwitcher)."""
+        self.gx_preset_changed(None, bank_name, preset_name)
 
     def gx_preset_changed(self, gx_client, bank_name, preset_name):
         logger.info("Preset changed to: %r, %r", bank_name, preset_name)
-        button = self.buttons.get((bank_name, preset_name))
-        if not button:
-            logging.warning("No preset button for %, %r", bank_name, preset_name)
-        elif not button.get_active():
-            button.set_active(True)
-        tab_num = self.tabs.get(bank_name, [0, None])[0]
-        self.set_current_page(tab_num)
         self.current_bank = bank_name
         self.current_preset = preset_name
+        if (bank_name, preset_name) not in self.buttons:
+            logger.warning("No preset button for %r, %r", bank_name, preset_name)
+        self._show_current()
+        self._save_cache()
 
     def _button_toggled(self, button, bank_name, preset_name):
         logger.debug("Button toggled: %r: %r, %r", button, bank_name, preset_name)
-        if not button.get_active():
+        if not button.get_active() or self._showing_current:
             return
+        target = self.target_cb.get_active_id() if self.target_cb else MAIN_INSTANCE
+        for instance in self.main_window.gx_instances[1:]:
+            if target in (instance.name, ALL_INSTANCES):
+                self._load_on_instance(instance, bank_name, preset_name)
+        if target in (MAIN_INSTANCE, ALL_INSTANCES):
+            self.load_preset(bank_name, preset_name)
+        else:
+            # the buttons show the preset of the main instance
+            self._show_current()
+
+    def load_preset(self, bank_name, preset_name):
+        """Load a preset in the main guitarix instance."""
         if bank_name == self.current_bank and preset_name == self.current_preset:
             return
         self.current_bank = bank_name
         self.current_preset = preset_name
+        if not self.main_window.gx_client.connected():
+            logger.info("Guitarix not connected, preset %r, %r queued",
+                        bank_name, preset_name)
+            self.pending_preset = (bank_name, preset_name)
+            return
         logger.info("Loading preset: %r, %r", bank_name, preset_name)
-        self.main_window.gx_client.api.setpreset(bank_name, preset_name)
+        self.main_window.switch_tracker.pressed(bank_name, preset_name)
+        self.main_window.preset_switcher.load(bank_name, preset_name)
 
-    def update_tabs(self):
-        for name, tabinfo in self.tabs.items():
-            logger.debug("Removing tab for bank %r", name)
-            self.remove(tabinfo[1])
-        self.tabs = {}
-        self.buttons = {}
-        button = None
-        for bank_name, bank in sorted(self.banks.items()):
-            logger.debug("Creating tab for bank %r", bank_name)
-            tab = Gtk.ScrolledWindow()
-            tab.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
-            box = Gtk.FlowBox()
-            box.set_border_width(10)
-            box.set_valign(Gtk.Align.START)
-            box.set_max_children_per_line(30)
-            box.set_selection_mode(Gtk.SelectionMode.NONE)
-            tab.add(box)
-            tab_num = self.append_page(tab, Gtk.Label(bank_name))
-            if bank_name == self.current_bank:
-                tab.show()
-                self.set_current_page(tab_num)
-            self.tabs[bank_name] = (tab_num, tab)
-            for preset in bank["presets"]:
-                button = Gtk.RadioButton.new_with_label_from_widget(button, preset)
+    def _load_on_instance(self, instance, bank_name, preset_name):
+        """Load a preset in one of the additional guitarix instances."""
+        if not instance.client.connected():
+            logger.warning("Guitarix %r not connected, cannot load %r, %r",
+                           instance.name, bank_name, preset_name)
+            return
+        logger.info("Loading preset %r, %r in guitarix %r",
+                    bank_name, preset_name, instance.name)
+        try:
+            instance.client.api.setpreset(bank_name, preset_name)
+        except GuitarixClientError as err:
+            logger.warning("Cannot load %r, %r in guitarix %r: %s",
+                           bank_name, preset_name, instance.name, err)
+
+    def _profile_clicked(self, button):
+        if self.profiler.is_running():
+            self.profiler.cancel()
+            return
+        page = self.get_nth_page(self.get_current_page())
+        if not isinstance(page, BankPage) or not page.presets:
+            logger.warning("Select a bank to profile first")
+            return
+        if not self.main_window.gx_client.connected():
+            logger.warning("Guitarix not connected, cannot profile")
+            return
+        restore = None
+        if self.current_bank is not None:
+            restore = (self.current_bank, self.current_preset)
+        self.profile_b.set_label("Stop")
+        self.main_window.load_guard.paused = True
+        self.profiler.start(page.bank_name, page.presets, restore)
+
+    def _preset_profiled(self, key, cost):
+        if key is None:
+            self.profile_b.set_label("Profile")
+            self.main_window.load_guard.paused = False
+            return
+        button = self.buttons.get(key)
+        if button:
+            self._annotate_button(button, cost)
+
+    def _annotate_button(self, button, cost):
+        style = button.get_style_context()
+        for name in ("low", "medium", "high"):
+            style.remove_class("preset-cost-" + name)
+        if cost:
+            style.add_class("preset-cost-" + cost_class(cost))
+            button.set_tooltip_text(cost_description(cost))
+        else:
+            button.set_tooltip_text(None)
+
+    def _show_current(self):
+        self.browser.select(self.current_bank, self.current_preset)
+        button = self.buttons.get((self.current_bank, self.current_preset))
+        if not button:
+            self._no_preset_b.set_active(True)
+            return
+        if not button.get_active():
+            self._showing_current = True
+            try:
+                button.set_active(True)
+            finally:
+                self._showing_current = False
+        if self.get_nth_page(self.get_current_page()) is not self.browser:
+            self.set_current_page(self.page_num(self.pages[self.current_bank]))
+
+    def update_banks(self, banks):
+        """Make the view match `banks` (bank name -> list of preset names).
+
+        Only the differences are applied, existing widgets are reused."""
+        self.browser.update_banks(banks)
+        self.banks = banks
+        if sum(len(presets) for presets in banks.values()) > self.max_buttons:
+            # too many to have a button each, use the browser only
+            logger.info("More than %i presets, not creating preset buttons",
+                        self.max_buttons)
+            banks = {}
+        for bank_name in list(self.pages):
+            if bank_name not in banks:
+                self._remove_bank(bank_name)
+        # the browser is the first page
+        for position, bank_name in enumerate(sorted(banks), 1):
+            page = self.pages.get(bank_name)
+            if page is None:
+                page = self._add_bank(bank_name)
+            if self.page_num(page) != position:
+                self.reorder_child(page, position)
+            self._update_presets(page, banks[bank_name])
+        self.show_all()
+        self._show_current()
+
+    def _add_bank(self, bank_name):
+        logger.debug("Creating tab for bank %r", bank_name)
+        page = BankPage(bank_name)
+        self.append_page(page, Gtk.Label(bank_name))
+        self.pages[bank_name] = page
+        return page
+
+    def _remove_bank(self, bank_name):
+        logger.debug("Removing tab for bank %r", bank_name)
+        page = self.pages.pop(bank_name)
+        self._update_presets(page, [])
+        self.remove_page(self.page_num(page))
+        page.destroy()
+
+    def _update_presets(self, page, presets):
+        if page.presets == presets:
+            return
+        bank_name = page.bank_name
+        for preset in page.presets:
+            if preset not in presets:
+                logger.debug("Removing button for preset %r, %r", bank_name, preset)
+                button = self.buttons.pop((bank_name, preset))
+                if button.get_active():
+                    self._no_preset_b.set_active(True)
+                button.get_parent().destroy()
+        for position, preset in enumerate(presets):
+            button = self.buttons.get((bank_name, preset))
+            if button is None:
+                logger.debug("Creating button for preset %r, %r", bank_name, preset)
+                button = Gtk.RadioButton.new_with_label_from_widget(
+                        self._no_preset_b, preset)
                 button.set_mode(False)
                 button.set_size_request(80, 80)
-                if bank_name == self.current_bank and preset == self.current_preset:
-                    button.set_active(True)
                 button.connect("toggled", self._button_toggled, bank_name, preset)
-                box.add(button)
+                self._annotate_button(button, self.profiler.get_cost(bank_name, preset))
+                page.box.insert(button, position)
                 self.buttons[bank_name, preset] = button
-        self.show_all()
-
+            else:
+                child = button.get_parent()
+                if child.get_index() != position:
+                    page.box.remove(child)
+                    page.box.insert(child, position)
+        page.presets = list(presets)
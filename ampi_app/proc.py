@@ -7,12 +7,33 @@ import time
 import errno
 import subprocess
 import fcntl
+import signal
 import threading
 
 from gi.repository import GObject
 
+from .sched import SchedSettings
+
 logger = logging.getLogger("proc")
 
+# stop sequence stage timeouts (seconds)
+TERM_TIMEOUT = 2
+KILL_TIMEOUT = 1
+CLEANUP_TIMEOUT = 2
+JOIN_TIMEOUT = 1
+# stop sequence poll interval (ms)
+STOP_POLL_INTERVAL = 100
+
+# default child output rate limit (lines per second, per child)
+OUTPUT_RATE = 50
+# default size limit of the raw output log (bytes)
+OUTPUT_LOG_SIZE = 1024 * 1024
+# longest output line logged as a whole
+MAX_LINE_LEN = 4096
+
+# delay before re-applying scheduling settings to child threads (ms)
+SCHED_SETTLE_TIME = 5000
+
 class Processes:
     def __init__(self):
         pass
@@ -51,19 +72,44 @@ class Processes:
                 if (name and os.path.basename(name) == query
                         or exe_name and os.path.basename(exe_name) == query):
                     yield pid, name, exe_name
-    def killall(self, name):
+    def signal_all(self, name, signum):
+        """Send a signal to all processes matching name.
+
+        Returns the set of pids the signal was delivered to."""
         pids = set(proc[0] for proc in self.find(name))
         if not pids:
             logger.debug("killall(%r): nothing to kill", name)
-            return
+            return pids
         logger.info("killing %r (%s)", name, ",".join(str(pid) for pid in pids))
         for pid in sorted(pids):
             try:
-                os.kill(pid, 15)
+                os.kill(pid, signum)
             except OSError as err:
                 if err.errno != errno.ESRCH:
                     logger.warning("cannot kill %r (%i): %s", name, pid, err)
                 pids.remove(pid)
+        return pids
+    def alive(self, pids):
+        """Return the subset of pids still running."""
+        result = set()
+        for pid in sorted(pids):
+            try:
+                os.kill(pid, 0)
+            except OSError as err:
+                if err.errno != errno.ESRCH:
+                    logger.warning("cannot kill -0 (%i): %s", pid, err)
+                continue
+            result.add(pid)
+        return result
+    def kill_with_fire(self, pids):
+        for pid in sorted(pids):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError as err:
+                if err.errno != errno.ESRCH:
+                    logger.warning("cannot kill -9 (%i): %s", pid, err)
+    def killall(self, name):
+        pids = self.signal_all(name, signal.SIGTERM)
 
         # wait up to 5 seconds for them to die
         for i in range(25):
@@ -71,22 +117,184 @@ class Processes:
                 # all dead
                 return
             time.sleep(0.2)
-            for pid in sorted(pids):
-                try:
-                    os.kill(pid, 0)
-                except OSError as err:
-                    if err.errno != errno.ESRCH:
-                        logger.warning("cannot kill -0 %r (%i): %s", name, pid, err)
-                    pids.remove(pid)
+            pids = self.alive(pids)
 
         # kill with fire!
-        for pid in sorted(pids):
+        self.kill_with_fire(pids)
+
+class KillOperation:
+    """Non-blocking kill of stray processes (by name), run on the main loop.
+
+    SIGTERM is sent first, SIGKILL to the ones still running after
+    CLEANUP_TIMEOUT. `callback(operation)` is called when all are gone."""
+    def __init__(self, names, procs=None):
+        self.names = names
+        self.procs = procs or Processes()
+        self.pids = set()
+        self.running = False
+        self._deadline = 0
+        self._timer_id = None
+        self._callbacks = []
+
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def start(self):
+        self.running = True
+        for name in self.names:
+            self.pids |= self.procs.signal_all(name, signal.SIGTERM)
+        if not self.pids:
+            self._finish()
+            return
+        self._deadline = time.monotonic() + CLEANUP_TIMEOUT
+        self._timer_id = GObject.timeout_add(STOP_POLL_INTERVAL, self._poll)
+
+    def cancel(self):
+        if self._timer_id is not None:
+            GObject.source_remove(self._timer_id)
+            self._timer_id = None
+        self.running = False
+        self._callbacks = []
+
+    def _poll(self):
+        self.pids = self.procs.alive(self.pids)
+        if self.pids and time.monotonic() >= self._deadline:
+            self.procs.kill_with_fire(self.pids)
+            self.pids = set()
+        if self.pids:
+            return True
+        self._timer_id = None
+        self._finish()
+        return False
+
+    def _finish(self):
+        self.running = False
+        for callback in self._callbacks:
+            callback(self)
+
+
+class LineAssembler:
+    """Incremental line splitter for a byte stream."""
+    def __init__(self, max_line=MAX_LINE_LEN):
+        self.max_line = max_line
+        self._buf = bytearray()
+
+    def feed(self, data):
+        """Add data, return list of complete lines (without line ends)."""
+        buf = self._buf
+        buf += data
+        end = buf.rfind(b"\n")
+        if end < 0:
+            if len(buf) > self.max_line:
+                line = bytes(buf)
+                buf.clear()
+                return [line]
+            return []
+        lines = buf[:end].split(b"\n")
+        del buf[:end + 1]
+        return lines
+
+    def flush(self):
+        """Return the incomplete last line, if any."""
+        line = bytes(self._buf)
+        self._buf.clear()
+        return line
+
+class RateLimiter:
+    """Token bucket rate limiter counting suppressed events."""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate * 2
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._suppressed = 0
+        self._lock = threading.Lock()
+
+    def check(self):
+        """Check if the next event is allowed.
+
+        Returns (allowed, suppressed) where `suppressed` is the number of
+        events suppressed since the previous allowed one (to be reported)."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                suppressed, self._suppressed = self._suppressed, 0
+                return True, suppressed
+            self._suppressed += 1
+            return False, 0
+
+    def take_suppressed(self):
+        with self._lock:
+            suppressed, self._suppressed = self._suppressed, 0
+            return suppressed
+
+class RotatingOutputLog:
+    """Raw child output file, rotated to '<path>.1' when it grows over
+    `max_size` bytes."""
+    def __init__(self, path, max_size=OUTPUT_LOG_SIZE):
+        self.path = os.path.expanduser(path)
+        self.max_size = max_size
+        self._file = None
+        self._size = 0
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        with self._lock:
+            if self._failed:
+                return
             try:
-                os.kill(pid, 9)
+                if not self._file:
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    self._file = open(self.path, "ab")
+                    self._size = self._file.tell()
+                if self._size and self._size + len(data) > self.max_size:
+                    self._file.close()
+                    os.replace(self.path, self.path + ".1")
+                    self._file = open(self.path, "ab")
+                    self._size = 0
+                self._file.write(data)
+                self._file.flush()
+                self._size += len(data)
             except OSError as err:
-                if err.errno != errno.ESRCH:
-                    logger.warning("cannot kill -9 %r (%i): %s", name, pid, err)
+                logger.warning("Cannot write %r: %s", self.path, err)
+                self._failed = True
 
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+class OutputLogger:
+    """Logs child process output stream line by line."""
+    def __init__(self, nanny, level):
+        self.nanny = nanny
+        self.level = level
+        self.lines = LineAssembler()
+
+    def __call__(self, data):
+        for line in self.lines.feed(data):
+            self.nanny._log_line(line, self.level)
+
+    def close(self):
+        line = self.lines.flush()
+        if line:
+            self.nanny._log_line(line, self.level)
+        self.nanny._log_suppressed()
+
+def output_options(section):
+    """Read Nanny output handling options from a config section."""
+    output_log = section.get("output_log", "").strip() or None
+    return {
+            "output_rate": section.getint("output_rate", OUTPUT_RATE),
+            "output_log": output_log,
+            "output_log_size": section.getint("output_log_size", OUTPUT_LOG_SIZE),
+            }
 
 def unblock_fd(stream):
     fd = stream.fileno()
@@ -97,34 +305,77 @@ class Nanny:
     """Child process monitor."""
     def __init__(self, name, command, kill_list=None,
                  restart=True, callback=None, stdout_callback=None,
-                 input_pipe=False):
+                 stderr_callback=None, input_pipe=False, sched=None,
+                 output_rate=OUTPUT_RATE, output_log=None,
+                 output_log_size=OUTPUT_LOG_SIZE):
         self.name = name
         self.command = command
         self.kill_list = kill_list
         self.logger = logging.getLogger("proc." + name)
         self.callback = callback
         self.stdout_callback = stdout_callback
+        self.stderr_callback = stderr_callback
         self.input_pipe = input_pipe
+        self.sched = sched or SchedSettings()
+        if output_rate:
+            self._rate_limiter = RateLimiter(output_rate)
+        else:
+            self._rate_limiter = None
+        if output_log:
+            self._output_log = RotatingOutputLog(output_log, output_log_size)
+        else:
+            self._output_log = None
         self._lock = threading.RLock()
         self._procs = Processes()
         self._child = None
         self._stdout_thread = None
         self._stderr_thread = None
         self._should_be_running = False
-        if kill_list:
-            for name in kill_list:
-                self._procs.killall(name)
+        self._stop_op = None
+        # stray processes from the kill list being killed before the start
+        self._kill_op = None
 
     def __del__(self):
         self.stop()
 
     def start(self):
+        """Start the child, after killing the processes from the kill list
+        (without blocking the main loop)."""
         with self._lock:
+            if self._stop_op:
+                logger.debug("%s still stopping, will start when done", self.name)
+                self._stop_op.add_callback(lambda nanny: self.start())
+                return
+            if self._kill_op:
+                return
             if self._stdout_thread or self._stderr_thread or self._child:
                 return
+            kill_op = None
             if self.kill_list:
-                for name in self.kill_list:
-                    self._procs.killall(name)
+                kill_op = self._kill_op = KillOperation(self.kill_list, self._procs)
+                kill_op.add_callback(self._strays_killed)
+        if kill_op:
+            kill_op.start()
+        else:
+            self._spawn()
+
+    def _strays_killed(self, kill_op):
+        with self._lock:
+            if self._kill_op is not kill_op:
+                return
+            self._kill_op = None
+        self._spawn()
+
+    def _cancel_start(self):
+        with self._lock:
+            if self._kill_op:
+                self._kill_op.cancel()
+                self._kill_op = None
+
+    def _spawn(self):
+        with self._lock:
+            if self._stdout_thread or self._stderr_thread or self._child:
+                return
 
             logger.info("Starting: %s", " ".join(self.command))
             try:
@@ -135,16 +386,23 @@ class Nanny:
                 self._child = subprocess.Popen(self.command,
                                                stdin=stdin,
                                                stdout=subprocess.PIPE,
-                                               stderr=subprocess.PIPE)
-            except OSError as err:
+                                               stderr=subprocess.PIPE,
+                                               preexec_fn=self.sched.preexec)
+            except (OSError, subprocess.SubprocessError) as err:
                 logger.error("Could not start %r: %s", " ".join(self.command), err)
                 return
 
+            if self.sched:
+                self.sched.apply(self._child.pid)
+                if self.sched.threads:
+                    # catch threads started by the child after exec
+                    GObject.timeout_add(SCHED_SETTLE_TIME, self._sched_settled)
+
             thread_args = [self._child, self._child.stdout]
             if self.stdout_callback:
                 thread_args += [self.stdout_callback]
             else:
-                thread_args += [self._log_output, logging.INFO]
+                thread_args += [OutputLogger(self, logging.INFO)]
             thread_name = "{} nanny (stdout)".format(self.name)
             self._stdout_thread = threading.Thread(target=self._output_thread,
                                                    args=thread_args,
@@ -152,8 +410,11 @@ class Nanny:
                                                    daemon=True)
             self._stdout_thread.start()
 
-            thread_args = [self._child, self._child.stderr,
-                    self._log_output, logging.WARNING]
+            thread_args = [self._child, self._child.stderr]
+            if self.stderr_callback:
+                thread_args += [self.stderr_callback]
+            else:
+                thread_args += [OutputLogger(self, logging.WARNING)]
             thread_name = "{} nanny (stderr)".format(self.name)
             self._stderr_thread = threading.Thread(target=self._output_thread,
                                                    args=thread_args,
@@ -168,6 +429,7 @@ class Nanny:
         self._should_be_running = False
 
     def stop(self):
+        self._cancel_start()
         with self._lock:
             self._should_be_running = False
             child = self._child
@@ -204,6 +466,43 @@ class Nanny:
             self._stdout_thread = None
             self._stderr_thread = None
 
+    def stop_async(self, callback=None, progress=None, grace=0):
+        """Stop the child without blocking the main loop.
+
+        `progress(nanny, stage)` is called whenever the stop sequence moves
+        to the next stage, `callback(nanny)` when it is finished. The child
+        is given `grace` seconds to exit by itself before SIGTERM. Total
+        time is bounded by the stage timeouts."""
+        with self._lock:
+            if not self._stop_op:
+                self._stop_op = StopOperation(self, grace)
+                self._stop_op.add_callback(self._stop_op_finished)
+                new_op = True
+            else:
+                new_op = False
+            stop_op = self._stop_op
+        if callback:
+            stop_op.add_callback(callback)
+        if progress:
+            stop_op.add_progress_callback(progress)
+        if new_op:
+            stop_op.start()
+
+    def _stop_op_finished(self, nanny):
+        with self._lock:
+            self._stop_op = None
+
+    def is_stopping(self):
+        return self._stop_op is not None
+
+    def restart_async(self, callback=None, progress=None, grace=0):
+        """Restart the child without blocking the main loop."""
+        def stopped(nanny):
+            self.start()
+            if callback:
+                callback(self)
+        self.stop_async(stopped, progress, grace)
+
     def write(self, data):
         with self._lock:
             if not self._child:
@@ -215,20 +514,23 @@ class Nanny:
         pipe.write(data)
         pipe.flush()
 
-    def _log_output(self, data, log_level):
-        local = threading.local()
-        if not hasattr(local, "buf"):
-            local.nanny_io_buf = b""
-            buf = data
-        else:
-            buf = local.nanny_io_buf + data
-
-        lines = buf.split(b"\n")
-        local.nanny_io_buf = lines[-1]
+    def _log_line(self, line, log_level):
+        if not self.logger.isEnabledFor(log_level):
+            return
+        if self._rate_limiter:
+            allowed, suppressed = self._rate_limiter.check()
+            if suppressed:
+                self.logger.warning("[%s] %i lines suppressed", self.name, suppressed)
+            if not allowed:
+                return
+        line = line.rstrip(b"\r").decode("utf-8", "replace")
+        self.logger.log(log_level, "[%s] %s", self.name, line)
 
-        for line in lines[:-1]:
-            line = line.rstrip(b"\r").decode("utf-8", "replace")
-            self.logger.log(log_level, "[%s] %s", self.name, line)
+    def _log_suppressed(self):
+        if self._rate_limiter:
+            suppressed = self._rate_limiter.take_suppressed()
+            if suppressed:
+                self.logger.warning("[%s] %i lines suppressed", self.name, suppressed)
 
     def _output_thread(self, child, stream, callback, *args):
         """Proccess output of the child process."""
@@ -240,7 +542,12 @@ class Nanny:
                 break
             if not data:
                 break
+            if self._output_log:
+                self._output_log.write(data)
             callback(data, *args)
+        close = getattr(callback, "close", None)
+        if close:
+            close()
 
         rc = child.wait()
 
@@ -265,6 +572,33 @@ class Nanny:
             if self._should_be_running:
                 GObject.timeout_add(1000, self.restart_if_needed)
 
+    def _sched_settled(self):
+        self.apply_sched()
+        for problem in self.check_sched():
+            logger.warning("%s: %s", self.name, problem)
+        return False
+
+    def get_pid(self):
+        with self._lock:
+            if self._child:
+                return self._child.pid
+            return None
+
+    def apply_sched(self):
+        """(Re)apply CPU affinity and scheduling to the child."""
+        pid = self.get_pid()
+        if pid and self.sched:
+            logger.debug("Applying %r to %s (%i)", self.sched, self.name, pid)
+            self.sched.apply(pid)
+
+    def check_sched(self):
+        """Check if the child runs with the configured CPU affinity and
+        scheduling. Returns list of problems found."""
+        pid = self.get_pid()
+        if not pid:
+            return []
+        return self.sched.check(pid)
+
     def restart_if_needed(self):
         if self._should_be_running:
             if not self._child:
@@ -285,6 +619,143 @@ class Nanny:
     def is_started(self):
         return any((self._stdout_thread, self._stderr_thread, self._child))
 
+class StopOperation:
+    """Non-blocking child process stop sequence, run on the main loop.
+
+    Stages: waiting (for voluntary exit), terminating (SIGTERM sent),
+    killing (SIGKILL sent), cleanup (stray processes from the kill list),
+    joining (output threads) and stopped."""
+    def __init__(self, nanny, grace=0):
+        self.nanny = nanny
+        self.grace = grace
+        self.stage = None
+        self.child = None
+        self.strays = set()
+        self.threads = ()
+        self._deadline = 0
+        self._started = None
+        self._callbacks = []
+        self._progress_callbacks = []
+
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def add_progress_callback(self, callback):
+        self._progress_callbacks.append(callback)
+
+    def _set_stage(self, stage, timeout=0):
+        logger.debug("%s: stop stage: %s", self.nanny.name, stage)
+        self.stage = stage
+        self._deadline = time.monotonic() + timeout
+        for callback in self._progress_callbacks:
+            callback(self.nanny, stage)
+
+    def start(self):
+        nanny = self.nanny
+        self._started = time.monotonic()
+        nanny._cancel_start()
+        with nanny._lock:
+            nanny._should_be_running = False
+            self.child = nanny._child
+            self.threads = (nanny._stdout_thread, nanny._stderr_thread)
+        if self.child:
+            if nanny.input_pipe and self.child.stdin:
+                try:
+                    self.child.stdin.close()
+                except OSError as err:
+                    logger.warning("%s stdin.close(): %s", nanny.name, err)
+            if self.grace:
+                self._set_stage("waiting", self.grace)
+            else:
+                self._terminate()
+        else:
+            self._cleanup()
+        GObject.timeout_add(STOP_POLL_INTERVAL, self._poll)
+
+    def _terminate(self):
+        logger.info("Terminating %s with SIGTERM...", self.nanny.name)
+        try:
+            self.child.terminate()
+        except OSError as err:
+            logger.warning("%s terminate(): %s", self.nanny.name, err)
+        self._set_stage("terminating", TERM_TIMEOUT)
+
+    def _kill(self):
+        logger.info("Killing %s with SIGKILL...", self.nanny.name)
+        try:
+            self.child.kill()
+        except OSError as err:
+            logger.warning("%s kill(): %s", self.nanny.name, err)
+        self._set_stage("killing", KILL_TIMEOUT)
+
+    def _cleanup(self):
+        for name in self.nanny.kill_list or []:
+            self.strays |= self.nanny._procs.signal_all(name, signal.SIGTERM)
+        self._set_stage("cleanup", CLEANUP_TIMEOUT)
+
+    def _join(self):
+        self._set_stage("joining", JOIN_TIMEOUT)
+
+    def _poll(self):
+        timed_out = time.monotonic() >= self._deadline
+        if self.stage in ("waiting", "terminating", "killing"):
+            if self.child.poll() is not None:
+                self._cleanup()
+            elif timed_out and self.stage == "waiting":
+                self._terminate()
+            elif timed_out and self.stage == "terminating":
+                self._kill()
+            elif timed_out:
+                logger.warning("%s (%i) won't die", self.nanny.name, self.child.pid)
+                self._cleanup()
+        if self.stage == "cleanup":
+            self.strays = self.nanny._procs.alive(self.strays)
+            if self.strays and timed_out:
+                self.nanny._procs.kill_with_fire(self.strays)
+                self.strays = set()
+            if not self.strays:
+                self._join()
+        if self.stage == "joining":
+            alive = [thread for thread in self.threads
+                     if thread and thread.is_alive()]
+            if not alive or timed_out:
+                for thread in alive:
+                    logger.warning("%s nanny thread %r won't die",
+                                   self.nanny.name, thread)
+                self._finish()
+                return False
+        return True
+
+    def _finish(self):
+        nanny = self.nanny
+        with nanny._lock:
+            if nanny._child is self.child:
+                nanny._child = None
+            if nanny._stdout_thread is self.threads[0]:
+                nanny._stdout_thread = None
+            if nanny._stderr_thread is self.threads[1]:
+                nanny._stderr_thread = None
+        logger.info("%s stopped in %.2fs", nanny.name,
+                    time.monotonic() - self._started)
+        self._set_stage("stopped")
+        for callback in self._callbacks:
+            callback(nanny)
+
+def stop_all_async(nannies, callback=None, progress=None, grace=0):
+    """Stop multiple nannies in parallel, call `callback()` when all are
+    stopped."""
+    pending = set(nanny for nanny in nannies if nanny)
+    if not pending:
+        if callback:
+            GObject.idle_add(callback)
+        return
+    def stopped(nanny):
+        pending.discard(nanny)
+        if not pending and callback:
+            callback()
+    for nanny in list(pending):
+        nanny.stop_async(stopped, progress, grace)
+
 if __name__ == "__main__":
     print("Processes:")
     proc = Processes()
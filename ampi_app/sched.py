@@ -0,0 +1,194 @@
+"""CPU affinity and scheduling."""
+
+import os
+import logging
+import subprocess
+
+logger = logging.getLogger("sched")
+
+SCHED_POLICIES = {
+        "other": os.SCHED_OTHER,
+        "batch": os.SCHED_BATCH,
+        "idle": os.SCHED_IDLE,
+        "fifo": os.SCHED_FIFO,
+        "rr": os.SCHED_RR,
+        }
+SCHED_POLICY_NAMES = {value: key for key, value in SCHED_POLICIES.items()}
+
+IO_CLASSES = {
+        "none": 0,
+        "realtime": 1,
+        "best-effort": 2,
+        "idle": 3,
+        }
+
+IONICE = "/usr/bin/ionice"
+
+# CPUs available before the app confined itself
+INITIAL_CPUS = frozenset(os.sched_getaffinity(0))
+
+def parse_cpu_list(spec):
+    """Parse a CPU list in the taskset/cpuset format (e.g. '0,2-3')."""
+    cpus = set()
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if "-" in item:
+            first, last = item.split("-", 1)
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(item))
+    return frozenset(cpus)
+
+def format_cpu_list(cpus):
+    """Format a set of CPUs in the taskset/cpuset format."""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(first) if first == last else "{}-{}".format(first, last)
+                    for first, last in ranges)
+
+def list_tasks(pid):
+    """List thread ids of a process."""
+    try:
+        return sorted(int(tid) for tid in os.listdir("/proc/{}/task".format(pid)))
+    except OSError:
+        return [pid]
+
+def task_name(pid, tid):
+    try:
+        with open("/proc/{}/task/{}/comm".format(pid, tid), "rt") as comm_f:
+            return comm_f.read().strip()
+    except OSError:
+        return "?"
+
+class SchedSettings:
+    """CPU affinity, scheduling policy and IO priority of a process."""
+    def __init__(self, cpus=None, threads=False, policy=None, priority=0,
+                 io_class=None, io_priority=None):
+        self.cpus = frozenset(cpus) if cpus else None
+        self.threads = threads
+        self.policy = policy
+        self.priority = priority
+        self.io_class = io_class
+        self.io_priority = io_priority
+
+    @classmethod
+    def from_config(cls, section):
+        """Read settings from a config section.
+
+        Recognized keys: cpus, cpu_threads, sched_policy, sched_priority,
+        io_class and io_priority. All are optional."""
+        cpus = section.get("cpus", "").strip()
+        cpus = parse_cpu_list(cpus) if cpus else None
+        threads = section.getboolean("cpu_threads", False)
+        policy = section.get("sched_policy", "").strip().lower() or None
+        if policy is not None and policy not in SCHED_POLICIES:
+            raise ValueError("Unknown scheduling policy: {!r}".format(policy))
+        priority = section.getint("sched_priority", 0)
+        io_class = section.get("io_class", "").strip().lower() or None
+        if io_class is not None and io_class not in IO_CLASSES:
+            raise ValueError("Unknown IO scheduling class: {!r}".format(io_class))
+        io_priority = section.get("io_priority", "").strip()
+        io_priority = int(io_priority) if io_priority else None
+        return cls(cpus, threads, policy, priority, io_class, io_priority)
+
+    def __bool__(self):
+        return bool(self.cpus or self.policy or self.io_class)
+
+    def __repr__(self):
+        return "<SchedSettings cpus={} threads={!r} policy={!r}/{} io={!r}/{!r}>".format(
+                format_cpu_list(self.cpus) if self.cpus else "*",
+                self.threads, self.policy, self.priority,
+                self.io_class, self.io_priority)
+
+    def preexec(self):
+        """Apply settings in a forked child, just before exec.
+
+        Threads created later by the child inherit these. When no CPU set
+        is configured the child gets all the CPUs the app started with, so
+        it does not inherit the app's own confinement."""
+        try:
+            os.sched_setaffinity(0, self.cpus or INITIAL_CPUS)
+            if self.policy is not None:
+                os.sched_setscheduler(0, SCHED_POLICIES[self.policy],
+                                      os.sched_param(self.priority))
+        except OSError:
+            # cannot log here, check() will report the problem
+            pass
+
+    def _tasks(self, pid):
+        if self.threads:
+            return list_tasks(pid)
+        else:
+            return [pid]
+
+    def apply(self, pid):
+        """Apply settings to a running process (and its threads)."""
+        tids = self._tasks(pid)
+        for tid in tids:
+            try:
+                if self.cpus:
+                    os.sched_setaffinity(tid, self.cpus)
+                if self.policy is not None:
+                    os.sched_setscheduler(tid, SCHED_POLICIES[self.policy],
+                                          os.sched_param(self.priority))
+            except OSError as err:
+                logger.warning("Cannot set scheduling of task %i: %s", tid, err)
+        if self.io_class is not None:
+            command = [IONICE, "-c", str(IO_CLASSES[self.io_class])]
+            if self.io_priority is not None:
+                command += ["-n", str(self.io_priority)]
+            command += ["-p"] + [str(tid) for tid in tids]
+            try:
+                subprocess.check_output(command, stderr=subprocess.STDOUT)
+            except OSError as err:
+                logger.warning("Could not exec %r: %s", command, err)
+            except subprocess.CalledProcessError as err:
+                logger.warning("%r failed: %s", command, err)
+
+    def check(self, pid):
+        """Compare actual process settings with the configured ones.
+
+        Returns a list of problem descriptions (empty when all is fine)."""
+        problems = []
+        for tid in self._tasks(pid):
+            try:
+                cpus = os.sched_getaffinity(tid)
+                policy = os.sched_getscheduler(tid)
+                priority = os.sched_getparam(tid).sched_priority
+            except OSError:
+                # thread gone
+                continue
+            name = task_name(pid, tid)
+            if self.cpus and cpus != self.cpus:
+                problems.append("{} ({}): CPUs {} instead of {}".format(
+                                name, tid, format_cpu_list(cpus),
+                                format_cpu_list(self.cpus)))
+            if self.policy is not None and (
+                    policy != SCHED_POLICIES[self.policy]
+                    or priority != self.priority):
+                problems.append("{} ({}): policy {}/{} instead of {}/{}".format(
+                                name, tid,
+                                SCHED_POLICY_NAMES.get(policy, policy), priority,
+                                self.policy, self.priority))
+        return problems
+
+def describe(pid):
+    """Describe CPU affinity and scheduling of all threads of a process."""
+    lines = []
+    for tid in list_tasks(pid):
+        try:
+            cpus = os.sched_getaffinity(tid)
+            policy = os.sched_getscheduler(tid)
+            priority = os.sched_getparam(tid).sched_priority
+        except OSError:
+            continue
+        lines.append("{:7d} {:16s} cpus={} {}/{}".format(
+                     tid, task_name(pid, tid), format_cpu_list(cpus),
+                     SCHED_POLICY_NAMES.get(policy, policy), priority))
+    return lines
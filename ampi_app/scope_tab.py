@@ -0,0 +1,222 @@
+"""Oscilloscope tab."""
+
+import time
+import logging
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, GLib
+
+logger = logging.getLogger("scope_tab")
+
+# NumPy and the JACK-Client module, imported when the scope is first shown
+np = None
+jack = None
+
+def _import_modules():
+    global np, jack
+    if np is None:
+        import numpy
+        np = numpy
+    if jack is None:
+        import jack as jack_module
+        jack = jack_module
+
+# ring buffer length (seconds)
+RING_LENGTH = 1.0
+# frame cost statistics period (seconds)
+COST_STATS_PERIOD = 1.0
+
+class SampleRing:
+    """Preallocated ring buffer of float32 samples.
+
+    Written from the JACK process thread, read from the GUI; a reader may
+    get a few samples from the previous cycle, which is fine for display."""
+    def __init__(self, size):
+        self.buf = np.zeros(size, dtype=np.float32)
+        self.pos = 0
+
+    def write(self, samples):
+        buf = self.buf
+        size = len(buf)
+        count = len(samples)
+        pos = self.pos
+        end = pos + count
+        if end <= size:
+            buf[pos:end] = samples
+        else:
+            split = size - pos
+            buf[pos:] = samples[:split]
+            buf[:count - split] = samples[split:]
+        self.pos = end % size
+
+    def read_latest(self, out):
+        """Copy the latest len(out) samples to `out`."""
+        count = len(out)
+        pos = self.pos
+        if count <= pos:
+            out[:] = self.buf[pos - count:pos]
+        else:
+            head = count - pos
+            out[:head] = self.buf[-head:]
+            out[head:] = self.buf[:pos]
+        return out
+
+def decimate(samples, columns):
+    """Min and max of the samples for each of `columns` pixel columns."""
+    per_column = len(samples) // columns
+    if per_column < 1:
+        return samples, samples
+    blocks = samples[-per_column * columns:].reshape(columns, per_column)
+    return blocks.min(axis=1), blocks.max(axis=1)
+
+class ScopeTab(Gtk.Box):
+    """Oscilloscope of the guitarix output.
+
+    Guitarix RPC only reports the oscilloscope state, not the samples, so
+    they are tapped from JACK by a separate client, which exists only while
+    the tab is shown. The display is refreshed at [UI] scope_rate and the
+    per-frame cost (sample copy, decimation, drawing) is shown, together
+    with the JACK DSP load and the xruns since the scope was started: the
+    tap client's process callback needs the GIL, which the drawing holds,
+    so the scope itself may disturb the audio."""
+    def __init__(self, main_window):
+        Gtk.Box.__init__(self)
+        self.main_window = main_window
+        config = main_window.config["UI"]
+        self.rate = config.getint("scope_rate", 25)
+        self.window = config.getfloat("scope_window", 50) / 1000
+        gx_name = main_window.config["Guitarix"].get("jack_name", "gx_head")
+        self.source = config.get("scope_source", gx_name + "_fx:out_0")
+        self.client = None
+        self.ring = None
+        self._frame = None
+        self._timer_id = None
+        self._costs = [0.0, 0.0, 0.0]
+        self._frames = 0
+        self._stats_start = time.monotonic()
+        self._xruns_start = 0
+
+        self.set_orientation(Gtk.Orientation.VERTICAL)
+        self.area = Gtk.DrawingArea(hexpand=True, vexpand=True)
+        self.area.connect("draw", self._draw)
+        self.pack_start(self.area, True, True, 0)
+        self.cost_l = Gtk.Label("",
+                                justify=Gtk.Justification.LEFT,
+                                xalign=0)
+        self.pack_end(self.cost_l, False, False, 2)
+
+        self.connect("map", self._mapped)
+        self.connect("unmap", self._unmapped)
+
+    def _mapped(self, widget):
+        self._start()
+
+    def _unmapped(self, widget):
+        self._stop()
+
+    def _start(self):
+        if self.client:
+            return
+        try:
+            _import_modules()
+        except ImportError as err:
+            self.cost_l.set_text("Oscilloscope not available: {}".format(err))
+            return
+        client = None
+        try:
+            client = jack.Client("ampi_scope", no_start_server=True)
+            port = client.inports.register("in")
+            rate = client.samplerate
+            self.ring = SampleRing(int(rate * RING_LENGTH))
+            self._frame = np.zeros(int(rate * self.window), dtype=np.float32)
+            ring = self.ring
+
+            def process(frames):
+                ring.write(port.get_array())
+            client.set_process_callback(process)
+            client.activate()
+            client.connect(self.source, port)
+        except jack.JackError as err:
+            logger.warning("Cannot tap %r: %s", self.source, err)
+            if client:
+                client.close()
+            self.cost_l.set_text("No signal: {}".format(err))
+            return
+        self.client = client
+        self._frames = 0
+        self._costs = [0.0, 0.0, 0.0]
+        self._stats_start = time.monotonic()
+        self._xruns_start = self.main_window.jack_client.xruns
+        self._timer_id = GLib.timeout_add(1000 // self.rate, self._tick)
+        logger.debug("Oscilloscope started")
+
+    def _stop(self):
+        if self._timer_id is not None:
+            GLib.source_remove(self._timer_id)
+            self._timer_id = None
+        if self.client:
+            try:
+                self.client.deactivate()
+                self.client.close()
+            except jack.JackError as err:
+                logger.debug("Closing the scope client: %s", err)
+            self.client = None
+            logger.debug("Oscilloscope stopped")
+
+    def _tick(self):
+        self.area.queue_draw()
+        return True
+
+    def _draw(self, widget, ctx):
+        width = widget.get_allocated_width()
+        height = widget.get_allocated_height()
+        ctx.set_source_rgb(0, 0, 0)
+        ctx.paint()
+        if not self.client or width < 1:
+            return
+
+        start = time.monotonic()
+        samples = self.ring.read_latest(self._frame)
+        copied = time.monotonic()
+        mins, maxs = decimate(samples, width)
+        scale = height / 2
+        tops = (1 - maxs) * scale
+        bottoms = (1 - mins) * scale
+        decimated = time.monotonic()
+
+        ctx.set_source_rgb(0.3, 0.3, 0.3)
+        ctx.move_to(0, scale)
+        ctx.line_to(width, scale)
+        ctx.stroke()
+        ctx.set_source_rgb(0, 1, 0)
+        ctx.set_line_width(1)
+        for x, (top, bottom) in enumerate(zip(tops.tolist(), bottoms.tolist())):
+            ctx.move_to(x + 0.5, top)
+            ctx.line_to(x + 0.5, bottom + 1)
+        ctx.stroke()
+        drawn = time.monotonic()
+
+        costs = self._costs
+        costs[0] += copied - start
+        costs[1] += decimated - copied
+        costs[2] += drawn - decimated
+        self._frames += 1
+        period = drawn - self._stats_start
+        if period >= COST_STATS_PERIOD:
+            frames = self._frames
+            text = ("{:.0f} fps, per frame: copy {:.2f} ms, decimate {:.2f} ms,"
+                    " draw {:.2f} ms".format(frames / period,
+                                             costs[0] / frames * 1000,
+                                             costs[1] / frames * 1000,
+                                             costs[2] / frames * 1000))
+            jack_client = self.main_window.jack_client
+            load = jack_client.get_cpu_load()
+            if load is not None:
+                text += "; JACK DSP load {:.0f}%".format(load)
+            text += ", {} xruns since started".format(
+                    jack_client.xruns - self._xruns_start)
+            self.cost_l.set_text(text)
+            self._costs = [0.0, 0.0, 0.0]
+            self._frames = 0
+            self._stats_start = drawn
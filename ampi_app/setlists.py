@@ -0,0 +1,46 @@
+"""Setlists."""
+
+import os
+import logging
+
+logger = logging.getLogger("setlists")
+
+SETLIST_DIR = os.path.expanduser("~/.config/ampi_app/setlists")
+SETLIST_EXT = ".m3u"
+
+def list_setlists():
+    """Names of the available setlists."""
+    try:
+        names = [os.path.splitext(name)[0] for name in os.listdir(SETLIST_DIR)
+                 if name.endswith(SETLIST_EXT)]
+    except FileNotFoundError:
+        return []
+    except OSError as err:
+        logger.warning("Cannot read %r: %s", SETLIST_DIR, err)
+        return []
+    return sorted(names)
+
+def load_setlist(name, tracks_dir):
+    """Track paths of a setlist.
+
+    A setlist is a simple M3U file in SETLIST_DIR: one track per line,
+    absolute or relative to `tracks_dir`, '#' starts a comment line.
+    Missing tracks are skipped."""
+    path = os.path.join(SETLIST_DIR, name + SETLIST_EXT)
+    try:
+        with open(path, "rt", encoding="utf-8") as setlist_f:
+            lines = setlist_f.readlines()
+    except OSError as err:
+        logger.warning("Cannot load %r: %s", path, err)
+        return []
+    tracks = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        track = os.path.join(tracks_dir, line)
+        if not os.path.isfile(track):
+            logger.warning("%s: track %r not found", name, line)
+            continue
+        tracks.append(track)
+    return tracks
@@ -0,0 +1,116 @@
+"""Guitarix state snapshot for crash recovery."""
+
+import time
+import logging
+
+from .guitarix import GuitarixClientError
+
+logger = logging.getLogger("state_snapshot")
+
+class StateSnapshot:
+    """Keeps the current bank/preset and the parameters changed since the
+    preset was loaded (from guitarix 'set' notifications), and restores
+    them when guitarix comes back after a crash.
+
+    Only values which differ from the preset as saved are kept, when the
+    preset contents are available. The preset is loaded through the load
+    guard, when it is starting, then the parameters are sent in a single
+    'set'."""
+    def __init__(self, gx_client, preset_switcher, load_guard=None):
+        self.gx_client = gx_client
+        self.preset_switcher = preset_switcher
+        self.load_guard = load_guard
+        self.preset = None
+        self.changed = {}
+        self._baseline = None
+        self._restoring = None
+        self._restore_start = None
+        gx_client.add_observer(self, ["preset", "param"])
+        preset_switcher.add_observer(self)
+
+    def _set_preset(self, preset):
+        self.preset = preset
+        self.changed = {}
+        try:
+            self._baseline = self.preset_switcher.get_engine(*preset)
+        except (GuitarixClientError, OSError, ValueError, KeyError, TypeError) as err:
+            logger.debug("Preset contents not available: %s", err)
+            self._baseline = None
+
+    def gx_connected(self, gx_client):
+        if not self.preset:
+            values = gx_client.api.get_parameter_value("system.current_bank",
+                                                       "system.current_preset")
+            bank_name = values.get("system.current_bank")
+            preset_name = values.get("system.current_preset")
+            if bank_name and preset_name:
+                self._set_preset((bank_name, preset_name))
+            return
+        preset = self.preset
+        self._restoring = (preset, dict(self.changed))
+        self._restore_start = time.monotonic()
+        logger.info("Restoring preset %r with %i changed parameters",
+                    preset, len(self.changed))
+        load_guard = self.load_guard
+        if load_guard and load_guard.is_starting():
+            load_guard.set_startup_target(*preset)
+        else:
+            self.gx_client.api.setpreset(*preset)
+
+    def gx_disconnected(self, gx_client):
+        self._restoring = None
+
+    def gx_preset_changed(self, gx_client, bank_name, preset_name):
+        preset = (bank_name, preset_name)
+        if self._restoring:
+            target, changed = self._restoring
+            if preset == target:
+                self._restoring = None
+                self._set_preset(preset)
+                self._restore_params(changed)
+                return
+            if self.load_guard and preset == self.load_guard.safe_preset:
+                return
+            logger.info("Another preset loaded, state not restored")
+            self._restoring = None
+        self._set_preset(preset)
+
+    def preset_switched(self, bank_name, preset_name):
+        """Preset loaded by parameter delta."""
+        if not self._restoring:
+            self._set_preset((bank_name, preset_name))
+
+    def gx_set(self, gx_client, *args):
+        if self._restoring:
+            return
+        baseline = self._baseline
+        for name, value in zip(args[::2], args[1::2]):
+            if baseline is None:
+                if not name.startswith(("system.", "ui.")):
+                    self.changed[name] = value
+            elif name not in baseline:
+                continue
+            elif baseline[name] == value:
+                self.changed.pop(name, None)
+            else:
+                self.changed[name] = value
+
+    def _restore_params(self, changed):
+        start = time.monotonic()
+        if changed:
+            args = []
+            for name, value in changed.items():
+                args += [name, value]
+            try:
+                self.gx_client.api.set(*args)
+                # wait for the 'set' to be processed
+                self.gx_client.api.get_parameter_value(next(iter(changed)))
+            except GuitarixClientError as err:
+                logger.warning("Cannot restore parameters: %s", err)
+                return
+            self.changed = dict(changed)
+        now = time.monotonic()
+        logger.info("State restored %.1f ms after reconnecting,"
+                    " %i parameters set in %.1f ms",
+                    (now - self._restore_start) * 1000, len(changed),
+                    (now - start) * 1000)
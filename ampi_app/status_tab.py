@@ -63,6 +63,53 @@ class StatusTab(Gtk.Box):
                                      xalign=0)
         grid.attach(self.gx_status_l, 1, 4, 1, 1)
 
+        label = Gtk.Label("Preset switching:",
+                          justify=Gtk.Justification.RIGHT,
+                          xalign=1)
+        grid.attach(label, 0, 5, 1, 1)
+        self.switch_stats_l = Gtk.Label('unknown',
+                                        justify=Gtk.Justification.LEFT,
+                                        xalign=0)
+        grid.attach(self.switch_stats_l, 1, 5, 1, 1)
+
+        label = Gtk.Label("Load guard:",
+                          justify=Gtk.Justification.RIGHT,
+                          xalign=1)
+        grid.attach(label, 0, 6, 1, 1)
+        self.load_guard_l = Gtk.Label('unknown',
+                                      justify=Gtk.Justification.LEFT,
+                                      xalign=0)
+        grid.attach(self.load_guard_l, 1, 6, 1, 1)
+
+        label = Gtk.Label("Guitarix load:",
+                          justify=Gtk.Justification.RIGHT,
+                          xalign=1)
+        grid.attach(label, 0, 7, 1, 1)
+        self.gx_load_l = Gtk.Label('unknown',
+                                   justify=Gtk.Justification.LEFT,
+                                   xalign=0)
+        grid.attach(self.gx_load_l, 1, 7, 1, 1)
+
+        if main_window.bridges:
+            label = Gtk.Label("Bridges:",
+                              justify=Gtk.Justification.RIGHT,
+                              xalign=1)
+            grid.attach(label, 0, 8, 1, 1)
+        self.bridges_l = Gtk.Label('',
+                                   justify=Gtk.Justification.LEFT,
+                                   xalign=0)
+        grid.attach(self.bridges_l, 1, 8, 1, 1)
+
+        if main_window.config["Jack"].getboolean("failover", False):
+            label = Gtk.Label("Jack backend:",
+                              justify=Gtk.Justification.RIGHT,
+                              xalign=1)
+            grid.attach(label, 0, 9, 1, 1)
+        self.backend_l = Gtk.Label('',
+                                   justify=Gtk.Justification.LEFT,
+                                   xalign=0)
+        grid.attach(self.backend_l, 1, 9, 1, 1)
+
         self.pack_start(grid, False, False, 2)
 
         self.log_sw = Gtk.ScrolledWindow()
@@ -81,12 +128,31 @@ class StatusTab(Gtk.Box):
 
         GLib.timeout_add(2000, self.update_jack_status)
 
-    def update_iface_status(self, present):
-        if present:
+    def update_iface_status(self, present, card_id=None):
+        if present and card_id:
+            self.iface_status_l.set_markup(
+                    "<span foreground='#008000'>present</span> (hw:{})".format(
+                        GLib.markup_escape_text(card_id)))
+        elif present:
             self.iface_status_l.set_markup("<span foreground='#008000'>present</span>")
         else:
             self.iface_status_l.set_markup("<span foreground='#800000'>absent</span>")
 
+    def update_backend_status(self, switcher, device, ok):
+        """Show the backend in use and the result of the last switch
+        to `device`."""
+        if not switcher.running:
+            markup = "<span foreground='#800000'>not running</span>"
+        elif switcher.device:
+            markup = "<span foreground='#008000'>alsa</span> ({})".format(
+                    GLib.markup_escape_text(switcher.device))
+        else:
+            markup = "<span foreground='#808000'>dummy</span>"
+        if not ok:
+            markup += ", <span foreground='#800000'>switch to {} failed</span>".format(
+                    GLib.markup_escape_text(device or "dummy"))
+        self.backend_l.set_markup(markup)
+
     def update_jackd_proc_status(self, started):
         if started:
             self.jackd_proc_l.set_markup("<span foreground='#008000'>started</span>")
@@ -101,11 +167,48 @@ class StatusTab(Gtk.Box):
             self.gx_proc_l.set_markup("<span foreground='#800000'>stopped</span>")
             self.gx_status_l.set_markup("<span foreground='#800000'>disconnected</span>")
 
+    def _proc_stage_markup(self, stage):
+        if stage == "stopped":
+            color = "#800000"
+        else:
+            color = "#c06000"
+        return "<span foreground='{}'>{}</span>".format(color, stage)
+
+    def update_jackd_proc_stage(self, stage):
+        self.jackd_proc_l.set_markup(self._proc_stage_markup(stage))
+
+    def update_gx_proc_stage(self, stage):
+        self.gx_proc_l.set_markup(self._proc_stage_markup(stage))
+
     def update_jack_status(self):
         status_str = self.main_window.jack_client.get_status_string()
         self.jack_status_l.set_markup(status_str)
+        switcher = self.main_window.preset_switcher
+        self.switch_stats_l.set_text(switcher.get_stats_string())
+        self.load_guard_l.set_text(self.main_window.load_guard.get_status_string())
+        self.update_gx_load()
+        jack_client = self.main_window.jack_client
+        self.bridges_l.set_text("; ".join(bridge.get_status_string(jack_client)
+                                          for bridge in self.main_window.bridges))
         return True
 
+    def update_gx_load(self):
+        """Show CPU usage of each guitarix instance."""
+        parts = []
+        for instance in self.main_window.gx_instances:
+            load = instance.get_cpu_load()
+            if load is not None:
+                state = "{:.0f}% CPU".format(load)
+                if not instance.client.connected():
+                    state += ", not connected"
+            elif instance.nanny and instance.nanny.get_pid():
+                # no previous sample yet
+                state = "started"
+            else:
+                state = "stopped"
+            parts.append("{}: {}".format(instance.name, state))
+        self.gx_load_l.set_text("; ".join(parts))
+
     def update_gx_status(self, color, status_str):
         self.gx_status_l.set_markup("<span foreground='{}'>{}</span>".format(color, status_str))
 
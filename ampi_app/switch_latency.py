@@ -0,0 +1,211 @@
+"""Preset switch latency tracking."""
+
+import os
+import time
+import json
+import logging
+
+from gi.repository import GLib
+
+logger = logging.getLogger("switch_latency")
+
+STATS_FILE = os.path.expanduser("~/.config/ampi_app/switch_latency.json")
+
+# JACK load poll interval while waiting for the load to settle (ms)
+SETTLE_POLL_INTERVAL = 20
+# load is considered settled when it changes less than this (percent)...
+SETTLE_DELTA = 2.0
+# ...for this many consecutive samples
+SETTLE_SAMPLES = 5
+# and stays below this
+SETTLE_MAX_LOAD = 80.0
+# give up waiting for the load to settle after (seconds)
+SETTLE_TIMEOUT = 5.0
+
+class PresetSwitch:
+    """Timeline of a single preset switch."""
+    def __init__(self, bank_name, preset_name, xruns):
+        self.key = (bank_name, preset_name)
+        self.method = None
+        self.pressed = time.monotonic()
+        self.sent = None
+        self.changed = None
+        self.settled = None
+        self.xruns_start = xruns
+        self.xruns = 0
+        self.max_load = 0.0
+
+    def __str__(self):
+        def delta(stamp):
+            if stamp is None:
+                return "-"
+            return "{:.1f} ms".format((stamp - self.pressed) * 1000)
+        return ("{}/{} ({}): sent {}, changed {}, settled {}, max load {:.0f}%,"
+                " {} xruns".format(self.key[0], self.key[1], self.method,
+                                   delta(self.sent), delta(self.changed),
+                                   delta(self.settled), self.max_load,
+                                   self.xruns))
+
+class PresetLatencyStats:
+    """Accumulated switch statistics of a single preset."""
+    FIELDS = ("count", "changed_total", "changed_max", "settled_count",
+              "settled_total", "settled_max", "xruns", "max_load")
+
+    def __init__(self, data=None):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+        if data:
+            for field in self.FIELDS:
+                setattr(self, field, data.get(field, 0))
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def add(self, switch):
+        self.count += 1
+        if switch.changed is not None:
+            changed = switch.changed - switch.pressed
+            self.changed_total += changed
+            self.changed_max = max(self.changed_max, changed)
+        if switch.settled is not None:
+            settled = switch.settled - switch.pressed
+            self.settled_count += 1
+            self.settled_total += settled
+            self.settled_max = max(self.settled_max, settled)
+        self.xruns += switch.xruns
+        self.max_load = max(self.max_load, switch.max_load)
+
+    def __str__(self):
+        changed_avg = self.changed_total / self.count if self.count else 0
+        if self.settled_count:
+            settled_avg = self.settled_total / self.settled_count
+        else:
+            settled_avg = 0
+        return ("{} switches, changed avg {:.0f} ms max {:.0f} ms, settled avg"
+                " {:.0f} ms max {:.0f} ms, {} xruns, max load {:.0f}%".format(
+                    self.count, changed_avg * 1000, self.changed_max * 1000,
+                    settled_avg * 1000, self.settled_max * 1000,
+                    self.xruns, self.max_load))
+
+class SwitchLatencyTracker:
+    """Measures preset switches end-to-end.
+
+    Records the time from the button press to the request being sent, to
+    the preset change confirmed by guitarix and to the JACK DSP load
+    settling down, together with the xruns in between. The load is polled
+    (JACK only reports a smoothed value), so 'settled' is accurate to about
+    SETTLE_POLL_INTERVAL."""
+    def __init__(self, jack_client):
+        self.jack_client = jack_client
+        self.current = None
+        self.stats = {}
+        self._poll_id = None
+        self._last_load = None
+        self._quiet_samples = 0
+        self._quiet_since = None
+        self._load_stats()
+
+    def _load_stats(self):
+        try:
+            with open(STATS_FILE, "rt", encoding="utf-8") as stats_f:
+                data = json.load(stats_f)
+            self.stats = {tuple(item["preset"]): PresetLatencyStats(item["stats"])
+                          for item in data}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError, KeyError) as err:
+            logger.warning("Cannot load %r: %s", STATS_FILE, err)
+
+    def _save_stats(self):
+        data = [{"preset": list(key), "stats": stats.as_dict()}
+                for key, stats in self.stats.items()]
+        try:
+            os.makedirs(os.path.dirname(STATS_FILE), exist_ok=True)
+            tmp_path = STATS_FILE + ".tmp"
+            with open(tmp_path, "wt", encoding="utf-8") as stats_f:
+                json.dump(data, stats_f)
+            os.replace(tmp_path, STATS_FILE)
+        except OSError as err:
+            logger.warning("Cannot save %r: %s", STATS_FILE, err)
+
+    def pressed(self, bank_name, preset_name):
+        if self.current:
+            logger.debug("Switch superseded: %s", self.current)
+            self._finish()
+        self.current = PresetSwitch(bank_name, preset_name, self.jack_client.xruns)
+
+    def sent(self, bank_name, preset_name, method):
+        switch = self.current
+        if switch and switch.key == (bank_name, preset_name):
+            switch.sent = time.monotonic()
+            switch.method = method
+
+    def changed(self, bank_name, preset_name):
+        switch = self.current
+        if not switch or switch.key != (bank_name, preset_name):
+            return
+        if switch.changed is not None:
+            return
+        switch.changed = time.monotonic()
+        self._last_load = None
+        self._quiet_samples = 0
+        self._quiet_since = None
+        self._poll_id = GLib.timeout_add(SETTLE_POLL_INTERVAL, self._poll_load)
+
+    def _poll_load(self):
+        switch = self.current
+        if not switch:
+            self._poll_id = None
+            return False
+        now = time.monotonic()
+        load = self.jack_client.get_cpu_load()
+        if load is None:
+            self._poll_id = None
+            self._finish()
+            return False
+        switch.max_load = max(switch.max_load, load)
+        if (self._last_load is not None and load < SETTLE_MAX_LOAD
+                and abs(load - self._last_load) < SETTLE_DELTA):
+            if not self._quiet_samples:
+                self._quiet_since = now
+            self._quiet_samples += 1
+        else:
+            self._quiet_samples = 0
+        self._last_load = load
+        if self._quiet_samples >= SETTLE_SAMPLES:
+            switch.settled = self._quiet_since
+            self._poll_id = None
+            self._finish()
+            return False
+        if now - switch.changed > SETTLE_TIMEOUT:
+            logger.warning("JACK load did not settle after switching to %r",
+                           switch.key)
+            self._poll_id = None
+            self._finish()
+            return False
+        return True
+
+    def _finish(self):
+        switch = self.current
+        self.current = None
+        if self._poll_id is not None:
+            GLib.source_remove(self._poll_id)
+            self._poll_id = None
+        switch.xruns = self.jack_client.xruns - switch.xruns_start
+        if switch.changed is None:
+            logger.debug("Preset switch not completed: %s", switch)
+            return
+        logger.info("Preset switch: %s", switch)
+        stats = self.stats.setdefault(switch.key, PresetLatencyStats())
+        stats.add(switch)
+        self._save_stats()
+
+    def report(self):
+        """Log per-preset statistics, slowest presets first."""
+        def sort_key(item):
+            stats = item[1]
+            return (stats.xruns, stats.settled_max, stats.changed_max)
+        if not self.stats:
+            logger.info("No preset switches recorded")
+        for key, stats in sorted(self.stats.items(), key=sort_key, reverse=True):
+            logger.info("%s/%s: %s", key[0], key[1], stats)
@@ -24,6 +24,20 @@ class SystemTab(Gtk.FlowBox):
             button.connect("clicked", self._button_clicked, name, command)
             self.add(button)
 
+        button = Gtk.Button.new_with_label("Check CPU layout")
+        button.connect("clicked", self._check_cpu_layout_clicked)
+        self.add(button)
+
+        button = Gtk.Button.new_with_label("Preset latency report")
+        button.connect("clicked", self._latency_report_clicked)
+        self.add(button)
+
+    def _latency_report_clicked(self, button):
+        self.main_window.switch_tracker.report()
+
+    def _check_cpu_layout_clicked(self, button):
+        self.main_window.check_cpu_layout()
+
     def _button_clicked(self, button, name, command):
         logger.debug("Button clicked: %r: %r, %r", button, name, command)
         try:
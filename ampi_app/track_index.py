@@ -0,0 +1,220 @@
+"""Backing track index."""
+
+import os
+import json
+import queue
+import logging
+import threading
+import subprocess
+
+from gi.repository import GLib, Gio
+
+logger = logging.getLogger("track_index")
+
+INDEX_FILE = os.path.expanduser("~/.config/ampi_app/tracks_index.json")
+
+# delay before saving the index after a change (ms)
+INDEX_SAVE_DELAY = 2000
+# max time for probing a single file (seconds)
+PROBE_TIMEOUT = 20
+# niceness of the prober processes
+PROBE_NICE = 10
+
+def track_name(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return name.replace("_", " ")
+
+def _lower_priority():
+    os.nice(PROBE_NICE)
+
+def probe_track(path, player):
+    """Read track information: stat() and, with mplayer, -identify output."""
+    stat = os.stat(path)
+    info = {
+            "path": path,
+            "name": track_name(path),
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "duration": None,
+            "rate": None,
+            "tags": {},
+            }
+    if not player or "mplayer" not in os.path.basename(player):
+        return info
+    try:
+        result = subprocess.run([player, "-noconfig", "all", "-vo", "null",
+                                 "-ao", "null", "-frames", "0", "-identify",
+                                 path],
+                                stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL,
+                                timeout=PROBE_TIMEOUT,
+                                preexec_fn=_lower_priority)
+    except (OSError, subprocess.TimeoutExpired) as err:
+        logger.warning("Cannot probe %r: %s", path, err)
+        return info
+    tag_names = {}
+    tag_values = {}
+    for line in result.stdout.decode("utf-8", "replace").splitlines():
+        key, sep, value = line.partition("=")
+        if not sep:
+            continue
+        try:
+            if key == "ID_LENGTH":
+                info["duration"] = float(value)
+            elif key == "ID_AUDIO_RATE":
+                info["rate"] = int(value) or info["rate"]
+        except ValueError:
+            continue
+        if key.startswith("ID_CLIP_INFO_NAME"):
+            tag_names[key[17:]] = value.lower()
+        elif key.startswith("ID_CLIP_INFO_VALUE"):
+            tag_values[key[18:]] = value
+    info["tags"] = {name: tag_values[num] for num, name in tag_names.items()
+                    if tag_values.get(num)}
+    return info
+
+class TrackIndex:
+    """Persistent index of the backing track files.
+
+    The index is loaded from INDEX_FILE, so the track list is available
+    immediately, and kept up to date by a directory monitor (inotify).
+    Files are probed in a background thread, at lowered priority; one
+    stat() scan at start-up catches changes made while the app was not
+    running. `callback()` is called in the main loop after the index
+    changes."""
+    def __init__(self, tracks_dir, player=None, callback=None):
+        self.tracks_dir = tracks_dir
+        self.player = player
+        self.callback = callback
+        self.tracks = {}
+        self._queue = queue.Queue()
+        self._save_id = None
+        self._monitor = None
+        self._load()
+        self._thread = threading.Thread(name="Track index",
+                                        target=self._run,
+                                        daemon=True)
+        self._thread.start()
+        self._queue.put(("scan", None))
+        self._start_monitor()
+
+    def _load(self):
+        try:
+            with open(INDEX_FILE, "rt", encoding="utf-8") as index_f:
+                data = json.load(index_f)
+            self.tracks = {item["path"]: item for item in data
+                           if os.path.dirname(item["path"]) == self.tracks_dir}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError, KeyError) as err:
+            logger.warning("Cannot load %r: %s", INDEX_FILE, err)
+
+    def _save(self):
+        self._save_id = None
+        try:
+            os.makedirs(os.path.dirname(INDEX_FILE), exist_ok=True)
+            tmp_path = INDEX_FILE + ".tmp"
+            with open(tmp_path, "wt", encoding="utf-8") as index_f:
+                json.dump(list(self.tracks.values()), index_f)
+            os.replace(tmp_path, INDEX_FILE)
+        except OSError as err:
+            logger.warning("Cannot save %r: %s", INDEX_FILE, err)
+        return False
+
+    def _changed(self):
+        if self._save_id is None:
+            self._save_id = GLib.timeout_add(INDEX_SAVE_DELAY, self._save)
+        if self.callback:
+            self.callback()
+
+    def get_tracks(self):
+        """Indexed tracks, sorted by name."""
+        return sorted(self.tracks.values(), key=lambda track: track["name"])
+
+    def _start_monitor(self):
+        directory = Gio.File.new_for_path(self.tracks_dir)
+        try:
+            self._monitor = directory.monitor_directory(
+                    Gio.FileMonitorFlags.WATCH_MOVES, None)
+        except GLib.Error as err:
+            logger.warning("Cannot monitor %r: %s", self.tracks_dir, err)
+            return
+        self._monitor.connect("changed", self._file_changed)
+
+    def _file_changed(self, monitor, gfile, other_file, event):
+        path = gfile.get_path()
+        logger.debug("%r: %s", path, event.value_nick)
+        if event in (Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+                     Gio.FileMonitorEvent.MOVED_IN):
+            self._queue.put(("probe", path))
+        elif event in (Gio.FileMonitorEvent.DELETED,
+                       Gio.FileMonitorEvent.MOVED_OUT):
+            self._removed(path)
+        elif event == Gio.FileMonitorEvent.RENAMED:
+            self._removed(path)
+            self._queue.put(("probe", other_file.get_path()))
+
+    def _removed(self, path):
+        if self.tracks.pop(path, None):
+            logger.debug("Track removed: %r", path)
+            self._changed()
+
+    def _update(self, path, info):
+        if info:
+            logger.debug("Track indexed: %r", info)
+            self.tracks[path] = info
+        elif path in self.tracks:
+            del self.tracks[path]
+        else:
+            return False
+        self._changed()
+        return False
+
+    def _scan_done(self, removed):
+        for path in removed:
+            self.tracks.pop(path, None)
+        self._changed()
+        return False
+
+    def _run(self):
+        while True:
+            request, path = self._queue.get()
+            if request == "scan":
+                self._scan()
+            elif request == "probe":
+                self._probe(path)
+
+    def _probe(self, path):
+        try:
+            if not os.path.isfile(path):
+                info = None
+            else:
+                info = probe_track(path, self.player)
+        except OSError as err:
+            logger.debug("Cannot probe %r: %s", path, err)
+            info = None
+        GLib.idle_add(self._update, path, info)
+
+    def _scan(self):
+        logger.debug("Checking backing track files...")
+        known = dict(self.tracks)
+        paths = set()
+        try:
+            entries = list(os.scandir(self.tracks_dir))
+        except OSError as err:
+            logger.warning("Cannot read %r: %s", self.tracks_dir, err)
+            entries = []
+        for entry in entries:
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            paths.add(entry.path)
+            info = known.get(entry.path)
+            if (not info or info["mtime"] != stat.st_mtime
+                    or info["size"] != stat.st_size):
+                self._probe(entry.path)
+        GLib.idle_add(self._scan_done, set(known) - paths)
@@ -0,0 +1,238 @@
+"""Waveform overviews of the backing tracks."""
+
+import os
+import hashlib
+import logging
+import threading
+import subprocess
+from collections import deque
+
+from gi.repository import GLib
+
+logger = logging.getLogger("track_peaks")
+
+# NumPy, imported by the worker thread
+np = None
+
+def _import_numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+
+# stored next to the track index
+PEAKS_DIR = os.path.expanduser("~/.config/ampi_app/track_peaks")
+
+# sample rate the tracks are decoded at for the overview (Hz)
+PEAKS_RATE = 8000
+# overview resolution (peaks per second)
+PEAKS_PER_SECOND = 50
+PEAK_BLOCK = PEAKS_RATE // PEAKS_PER_SECOND
+# decoder output read at once (peak blocks)
+READ_BLOCKS = 256
+# interval of partial results while generating (peak blocks)
+PROGRESS_BLOCKS = PEAKS_PER_SECOND * 30
+
+def peaks_path(info):
+    """Overview file of an indexed track."""
+    key = "{}\0{}\0{}\0{}".format(info["path"], info["mtime"], info["size"],
+                                  PEAKS_PER_SECOND)
+    digest = hashlib.sha1(key.encode("utf-8", "surrogateescape")).hexdigest()
+    return os.path.join(PEAKS_DIR, digest + ".npy")
+
+def _idle_priority():
+    os.nice(19)
+    try:
+        os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+    except (AttributeError, OSError):
+        pass
+
+def overview(peaks, columns):
+    """Min and max of the peaks for each of `columns` pixel columns,
+    as lists."""
+    count = len(peaks)
+    if not count or columns < 1:
+        return [], []
+    if count < columns:
+        return peaks[:, 0].tolist(), peaks[:, 1].tolist()
+    edges = np.linspace(0, count, columns + 1).astype(int)
+    mins = np.minimum.reduceat(peaks[:, 0], edges[:-1])
+    maxs = np.maximum.reduceat(peaks[:, 1], edges[:-1])
+    return mins.tolist(), maxs.tolist()
+
+class PeaksGenerator:
+    """Generates and caches min/max waveform overviews (PEAKS_PER_SECOND
+    pairs per second, a (N, 2) float32 array) of tracks.
+
+    Tracks are decoded with `cmdline` (to mono float32 on stdout) one at
+    a time by a worker thread, both at idle priority, so the overviews
+    never compete with the audio processing. Partial overviews are
+    reported while generating and a pending or running job can be
+    cancelled. `callback(path, peaks, complete)` is called in the main
+    loop."""
+    def __init__(self, cmdline, callback=None):
+        self.cmdline = cmdline
+        self.callback = callback
+        self._cache = {}
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._current = None
+        self._cancelled = False
+        self._thread = None
+
+    def get(self, info):
+        """Overview of an indexed track, None if not generated yet."""
+        path = info["path"]
+        cached = self._cache.get(path)
+        if cached and cached[0] == peaks_path(info):
+            return cached[1]
+        try:
+            _import_numpy()
+            peaks = np.load(peaks_path(info))
+        except (ImportError, OSError, ValueError):
+            return None
+        self._cache[path] = (peaks_path(info), peaks)
+        return peaks
+
+    def request(self, info, first=False):
+        """Generate the overview of a track in the background, unless
+        available already."""
+        if os.path.exists(peaks_path(info)):
+            return
+        with self._cond:
+            if self._current and self._current["path"] == info["path"]:
+                return
+            for queued in self._queue:
+                if queued["path"] == info["path"]:
+                    self._queue.remove(queued)
+                    break
+            if first:
+                self._queue.appendleft(info)
+            else:
+                self._queue.append(info)
+            self._cond.notify()
+        if self._thread is None:
+            self._thread = threading.Thread(name="Track peaks",
+                                            target=self._run,
+                                            daemon=True)
+            self._thread.start()
+
+    def cancel(self, path=None):
+        """Cancel generation of a track overview, or of all of them."""
+        with self._cond:
+            if path is None:
+                self._queue.clear()
+            else:
+                for queued in self._queue:
+                    if queued["path"] == path:
+                        self._queue.remove(queued)
+                        break
+            if self._current and (path is None or self._current["path"] == path):
+                self._cancelled = True
+
+    def prune(self, tracks):
+        """Remove the overviews of tracks no longer indexed (or changed)."""
+        wanted = {os.path.basename(peaks_path(info)) for info in tracks}
+        self._cache = {path: cached for path, cached in self._cache.items()
+                       if os.path.basename(cached[0]) in wanted}
+        try:
+            names = os.listdir(PEAKS_DIR)
+        except OSError:
+            return
+        for name in names:
+            if (name.endswith(".npy") and not name.endswith(".tmp.npy")
+                    and name not in wanted):
+                logger.debug("Removing stale overview %r", name)
+                try:
+                    os.unlink(os.path.join(PEAKS_DIR, name))
+                except OSError as err:
+                    logger.warning("Cannot remove %r: %s", name, err)
+
+    def _run(self):
+        try:
+            os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+        except (AttributeError, OSError):
+            os.nice(19)
+        try:
+            _import_numpy()
+        except ImportError as err:
+            logger.warning("Track overviews not available: %s", err)
+            return
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                self._current = self._queue.popleft()
+                self._cancelled = False
+            try:
+                self._generate(self._current)
+            except OSError as err:
+                logger.warning("Cannot generate overview of %r: %s",
+                               self._current["path"], err)
+            except Exception:
+                # e.g. a bad peaks_cmdline, keep the worker running
+                logger.exception("Generating overview of %r failed",
+                                 self._current["path"])
+            with self._cond:
+                self._current = None
+
+    def _generate(self, info):
+        path = info["path"]
+        logger.debug("Generating overview of %r", path)
+        command = [arg.format(input=path, rate=PEAKS_RATE)
+                   for arg in self.cmdline.split()]
+        proc = subprocess.Popen(command,
+                                stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL,
+                                preexec_fn=_idle_priority)
+        chunks = []
+        done = reported = 0
+        read_size = PEAK_BLOCK * READ_BLOCKS * 4
+        tail = b""
+        try:
+            while not self._cancelled:
+                data = proc.stdout.read(read_size)
+                if not data:
+                    break
+                data = tail + data
+                usable = len(data) // (PEAK_BLOCK * 4) * PEAK_BLOCK * 4
+                tail = data[usable:]
+                if not usable:
+                    continue
+                blocks = np.frombuffer(data[:usable], dtype=np.float32)
+                blocks = blocks.reshape(-1, PEAK_BLOCK)
+                chunks.append(np.stack((blocks.min(axis=1),
+                                        blocks.max(axis=1)), axis=1))
+                done += len(blocks)
+                if done - reported >= PROGRESS_BLOCKS:
+                    reported = done
+                    GLib.idle_add(self._report, path, np.concatenate(chunks),
+                                  False)
+        finally:
+            proc.stdout.close()
+            if self._cancelled:
+                proc.kill()
+            proc.wait()
+        if self._cancelled:
+            logger.debug("Overview of %r cancelled", path)
+            return
+        if proc.returncode or not chunks:
+            logger.warning("Cannot decode %r for the overview (exit code %r)",
+                           path, proc.returncode)
+            return
+        peaks = np.concatenate(chunks)
+        output = peaks_path(info)
+        os.makedirs(PEAKS_DIR, exist_ok=True)
+        tmp_path = output + ".tmp.npy"
+        np.save(tmp_path, peaks)
+        os.replace(tmp_path, output)
+        logger.debug("Overview of %r: %i peaks", path, len(peaks))
+        GLib.idle_add(self._report, path, peaks, True)
+
+    def _report(self, path, peaks, complete):
+        if complete:
+            self._cache.pop(path, None)
+        if self.callback:
+            self.callback(path, peaks, complete)
+        return False
@@ -0,0 +1,537 @@
+"""Built-in JACK backing track player."""
+
+import os
+import time
+import queue
+import hashlib
+import logging
+import threading
+import subprocess
+from collections import deque
+
+from gi.repository import GLib
+
+logger = logging.getLogger("track_player")
+
+# NumPy and the JACK-Client module, imported when the player is started
+np = None
+jack = None
+
+def _import_modules():
+    global np, jack
+    if np is None:
+        import numpy
+        np = numpy
+    if jack is None:
+        import jack as jack_module
+        jack = jack_module
+
+DECODE_DIR = os.path.expanduser("~/.cache/ampi_app/decoded")
+
+CHANNELS = 2
+# bytes per (interleaved, float32) frame
+FRAME_BYTES = 4 * CHANNELS
+# ring buffer length (seconds)
+RING_LENGTH = 0.5
+# max frames written to the ring buffer at once
+FEED_CHUNK = 4096
+# feeder sleep time when the ring is full or there is nothing to feed (seconds)
+FEED_INTERVAL = 0.005
+# niceness of the decoder processes
+DECODE_NICE = 10
+# default max size of the decoded files (bytes)
+DECODE_CACHE_SIZE = 2000 * 1024 * 1024
+# interval of checking for the process callback events (ms)
+EVENT_INTERVAL = 50
+
+def decoded_path(path, rate):
+    """Decode cache file for a track at a sample rate."""
+    stat = os.stat(path)
+    key = "{}\0{}\0{}\0{}".format(path, stat.st_mtime, stat.st_size, rate)
+    digest = hashlib.sha1(key.encode("utf-8", "surrogateescape")).hexdigest()
+    return os.path.join(DECODE_DIR, digest + ".f32")
+
+def _lower_priority():
+    os.nice(DECODE_NICE)
+
+class TrackDecoder:
+    """Decodes tracks to raw interleaved float32 files in a worker thread.
+
+    The files are kept in a size-bounded LRU cache (their mtime is the last
+    use). `callback(path, decoded_path)` is called in the main loop when
+    done (decoded_path is None on failure)."""
+    def __init__(self, cmdline, callback, cache_size=DECODE_CACHE_SIZE):
+        self.cmdline = cmdline
+        self.callback = callback
+        self.cache_size = cache_size
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(name="Track decoder",
+                                        target=self._run,
+                                        daemon=True)
+        self._thread.start()
+
+    def decode(self, path, rate):
+        self._queue.put((path, rate))
+
+    def _run(self):
+        self._remove_stale()
+        while True:
+            path, rate = self._queue.get()
+            try:
+                result = self._decode(path, rate)
+            except OSError as err:
+                logger.warning("Cannot decode %r: %s", path, err)
+                result = None
+            GLib.idle_add(self.callback, path, result)
+
+    def _decode(self, path, rate):
+        output = decoded_path(path, rate)
+        try:
+            os.utime(output)
+            return output
+        except FileNotFoundError:
+            pass
+        os.makedirs(DECODE_DIR, exist_ok=True)
+        tmp_path = output + ".tmp"
+        command = [arg.format(input=path, output=tmp_path, rate=rate,
+                              channels=CHANNELS)
+                   for arg in self.cmdline.split()]
+        start = time.monotonic()
+        logger.debug("Decoding %r: %r", path, command)
+        try:
+            subprocess.run(command,
+                           stdin=subprocess.DEVNULL,
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL,
+                           preexec_fn=_lower_priority,
+                           check=False)
+            size = os.path.getsize(tmp_path) if os.path.exists(tmp_path) else 0
+            if size < FRAME_BYTES:
+                logger.warning("Cannot decode %r", path)
+                return None
+            os.replace(tmp_path, output)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        logger.info("%r decoded in %.1f s", path, time.monotonic() - start)
+        self._evict(output)
+        return output
+
+    def _remove_stale(self):
+        """Remove temporary files left by an interrupted decoder."""
+        try:
+            names = os.listdir(DECODE_DIR)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(".tmp"):
+                logger.debug("Removing stale %r", name)
+                try:
+                    os.unlink(os.path.join(DECODE_DIR, name))
+                except OSError as err:
+                    logger.warning("Cannot remove %r: %s", name, err)
+
+    def _evict(self, keep):
+        """Remove the least recently used files over the cache size
+        (except `keep`, the one just decoded)."""
+        try:
+            entries = [entry for entry in os.scandir(DECODE_DIR)
+                       if entry.name.endswith(".f32")]
+            files = [(entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                     for entry in entries]
+        except OSError as err:
+            logger.warning("Cannot read %r: %s", DECODE_DIR, err)
+            return
+        total = sum(size for mtime, size, path in files)
+        for mtime, size, path in sorted(files):
+            if total <= self.cache_size:
+                break
+            if path == keep:
+                continue
+            # a track being played stays mapped, only the file is removed
+            logger.debug("Removing %r from the decode cache", path)
+            try:
+                os.unlink(path)
+            except OSError as err:
+                logger.warning("Cannot remove %r: %s", path, err)
+                continue
+            total -= size
+
+class TrackPlayer:
+    """Plays decoded tracks through its own JACK client ('ampi_player').
+
+    Decoded tracks are memory-mapped; a feeder thread copies the audio to
+    a lock-free JACK ring buffer which the process callback reads, so
+    neither disk access nor the GIL-heavy work happens in the process
+    callback. Seeking and loading work by asking the process callback to
+    flush the ring, once the feeder stopped writing the old data.
+
+    A track queued with queue_next() is preloaded and follows the current
+    one without a gap (or after `gap` seconds of silence); the switch is
+    made in the process callback and `track_changed_callback(path, gap)`
+    is called with the measured gap (seconds, including underruns).
+
+    `eof_callback()` is called in the main loop when the end of track is
+    reached (the exact frame is logged), `ready_callback(path)` when a
+    loaded track is decoded and ready to play.
+
+    The process callback is Python code: it takes the GIL on every cycle
+    and still creates small objects (the port array views, slices of
+    the preallocated sample buffer, an event tuple on EOF or track change),
+    but no sample-sized buffers, and it does not call into GLib: its
+    events are queued and picked up by a main loop timer."""
+    def __init__(self, decoder_cmdline, ready_callback=None, eof_callback=None,
+                 track_changed_callback=None, decode_cache_size=DECODE_CACHE_SIZE):
+        self.decoder = TrackDecoder(decoder_cmdline, self._decoded,
+                                    decode_cache_size)
+        self.ready_callback = ready_callback
+        self.eof_callback = eof_callback
+        self.track_changed_callback = track_changed_callback
+        self.gap = 0.0
+        self.client = None
+        self.rate = None
+        self.path = None
+        self.ready = False
+        self.playing = False
+        self.gain = 1.0
+        self.loop = None
+        self._ports = []
+        self._ring = None
+        self._feeder = None
+        self._closing = False
+        self._total = 0
+        self._position = 0
+        self._feed_pos = 0
+        self._seek_gen = 0
+        self._seek_target = (None, 0, 0)
+        # data of the track being played, as switched by the process callback
+        self._data = None
+        self._flush_request = (0, (None, 0, 0))
+        self._flushed = 0
+        self._play_requested = None
+        self._load_position = 0
+        self._next_path = None
+        self._next = None
+        self._handoffs = deque()
+        self._gap_remaining = 0
+        self._switch = None
+        self._buffer = None
+        self._buffer_bytes = None
+        # reused for the port arrays
+        self._outputs = [None] * CHANNELS
+        # (handler, args) of the process callback, for the main loop
+        self._events = deque()
+        self._events_id = None
+
+    def _allocate(self, frames):
+        self._buffer = np.zeros((frames, CHANNELS), dtype=np.float32)
+        self._buffer_bytes = memoryview(self._buffer).cast("B")
+
+    def start(self):
+        """Connect to JACK (call when jackd is running)."""
+        if self.client:
+            return False
+        try:
+            _import_modules()
+        except ImportError as err:
+            logger.error("Cannot start the track player: %s", err)
+            return False
+        try:
+            client = jack.Client("ampi_player", no_start_server=True)
+            self.rate = client.samplerate
+            self._ports = [client.outports.register("out_{}".format(i))
+                           for i in range(CHANNELS)]
+            self._ring = jack.RingBuffer(int(self.rate * RING_LENGTH) * FRAME_BYTES)
+            self._allocate(client.blocksize)
+            client.set_process_callback(self._process)
+            client.set_shutdown_callback(self._shutdown_cb)
+            client.activate()
+        except jack.JackError as err:
+            logger.error("Cannot connect the track player to JACK: %s", err)
+            return False
+        self._closing = False
+        self._flushed = self._seek_gen
+        self._flush_request = (self._seek_gen, self._seek_target)
+        self.client = client
+        self._feeder = threading.Thread(name="Track feeder",
+                                        target=self._feed,
+                                        daemon=True)
+        self._feeder.start()
+        self._events.clear()
+        self._events_id = GLib.timeout_add(EVENT_INTERVAL, self._handle_events)
+        if self.path:
+            self.load(self.path)
+        return False
+
+    def close(self):
+        self.playing = False
+        self._closing = True
+        if self._feeder:
+            self._feeder.join()
+            self._feeder = None
+        if self.client:
+            try:
+                self.client.deactivate()
+                self.client.close()
+            except jack.JackError as err:
+                logger.debug("Closing the player client: %s", err)
+            self.client = None
+        if self._events_id is not None:
+            GLib.source_remove(self._events_id)
+            self._events_id = None
+        self.ready = False
+        return False
+
+    def _shutdown_cb(self, status, reason):
+        GLib.idle_add(self.close)
+
+    def is_started(self):
+        return self.client is not None
+
+    def load(self, path, position=0):
+        """Load a track, decoding it in the background when needed, and seek
+        to `position` (seconds)."""
+        self.path = path
+        self._load_position = position
+        self.ready = False
+        self.playing = False
+        self._next_path = None
+        self._next = None
+        if self.client:
+            self.decoder.decode(path, self.rate)
+
+    def queue_next(self, path):
+        """Preload the track to play after the current one."""
+        self._next_path = path
+        self._next = None
+        if self.client and path:
+            self.decoder.decode(path, self.rate)
+
+    def _decoded(self, path, decoded):
+        if path not in (self.path, self._next_path) or not self.client:
+            return False
+        if not decoded:
+            return False
+        data = np.memmap(decoded, dtype=np.float32, mode="r")
+        data = data[:len(data) // CHANNELS * CHANNELS].reshape(-1, CHANNELS)
+        if path == self._next_path and (path != self.path or self.ready):
+            # (the same track may follow itself)
+            logger.debug("Next track preloaded: %r", path)
+            self._next = (path, data)
+            return False
+        self._seek(int(self._load_position * self.rate), data)
+        self.ready = True
+        if self.ready_callback:
+            self.ready_callback(path)
+        return False
+
+    @property
+    def duration(self):
+        return self._total / self.rate if self.rate and self._total else None
+
+    @property
+    def position(self):
+        return self._position / self.rate if self.rate else 0
+
+    def _seek(self, frame, data=None):
+        if data is None:
+            data = self._data
+        if data is None:
+            return
+        frame = max(0, min(frame, len(data)))
+        self._seek_target = (data, len(data), frame)
+        self._seek_gen += 1
+
+    def seek(self, seconds):
+        if self.ready:
+            self._seek(int(seconds * self.rate))
+
+    def play(self):
+        if not self.ready:
+            return
+        if not self.playing:
+            self._play_requested = time.monotonic()
+        self.playing = True
+
+    def pause(self):
+        self.playing = False
+
+    def stop(self):
+        self.playing = False
+        self._seek(0)
+
+    def set_volume(self, percent):
+        self.gain = percent / 100.0
+
+    def set_loop(self, start, end):
+        """Set A-B loop (seconds), None to disable."""
+        if start is None or end is None or end <= start:
+            self.loop = None
+        else:
+            self.loop = (int(start * self.rate), int(end * self.rate))
+        # the feeder may already be past the new loop points
+        self._seek(self._position)
+
+    def _feed(self):
+        data = None
+        feed_gen = self._seek_gen
+        ring = self._ring
+        gap_left = 0
+        # the preloaded track the feeder switched to
+        fed_next = None
+        while not self._closing:
+            if feed_gen != self._seek_gen:
+                feed_gen = self._seek_gen
+                target = self._seek_target
+                self._flush_request = (feed_gen, target)
+                while self._flushed != feed_gen and not self._closing:
+                    time.sleep(FEED_INTERVAL)
+                data, _, self._feed_pos = target
+                gap_left = 0
+                fed_next = None
+                continue
+            if data is None:
+                time.sleep(FEED_INTERVAL)
+                continue
+            if gap_left:
+                count = min(ring.write_space // FRAME_BYTES, FEED_CHUNK, gap_left)
+                if count <= 0:
+                    time.sleep(FEED_INTERVAL)
+                    continue
+                ring.write(bytes(count * FRAME_BYTES))
+                gap_left -= count
+                continue
+            loop = self.loop
+            end = loop[1] if loop else len(data)
+            if self._feed_pos >= end:
+                if not loop:
+                    next_track = self._next
+                    if next_track and next_track is not fed_next:
+                        # gapless switch to the preloaded track; the player
+                        # state changes when the process callback gets there
+                        # (a flush before that goes back to the current one)
+                        fed_next = next_track
+                        data = next_track[1]
+                        gap_left = int(self.gap * self.rate)
+                        self._handoffs.append((next_track, gap_left))
+                        self._feed_pos = 0
+                        continue
+                    time.sleep(FEED_INTERVAL)
+                    continue
+                self._feed_pos = loop[0]
+            count = min(ring.write_space // FRAME_BYTES, FEED_CHUNK,
+                        end - self._feed_pos)
+            if count <= 0:
+                time.sleep(FEED_INTERVAL)
+                continue
+            ring.write(data[self._feed_pos:self._feed_pos + count].tobytes())
+            self._feed_pos += count
+
+    def _handle_events(self):
+        while self._events:
+            handler, args = self._events.popleft()
+            handler(*args)
+        return True
+
+    def _process(self, frames):
+        ring = self._ring
+        if frames > len(self._buffer):
+            # JACK buffer size changed
+            self._allocate(frames)
+        outputs = self._outputs
+        for channel, port in enumerate(self._ports):
+            outputs[channel] = port.get_array()
+        gen, target = self._flush_request
+        if gen != self._flushed:
+            ring.read_advance(ring.read_space)
+            self._data = target[0]
+            self._total = target[1]
+            self._position = target[2]
+            self._handoffs.clear()
+            self._gap_remaining = 0
+            self._switch = None
+            self._flushed = gen
+        done = 0
+        if self.playing:
+            gain = self.gain
+            loop = self.loop
+            while done < frames:
+                if self._gap_remaining:
+                    count = min(frames - done, self._gap_remaining,
+                                ring.read_space // FRAME_BYTES)
+                    if not count:
+                        # underrun
+                        if self._switch:
+                            self._switch[2] += frames - done
+                        break
+                    ring.read_advance(count * FRAME_BYTES)
+                    for output in outputs:
+                        output[done:done + count] = 0
+                    done += count
+                    self._gap_remaining -= count
+                    continue
+                end = loop[1] if loop else self._total
+                count = min(frames - done, end - self._position)
+                if count <= 0:
+                    if loop:
+                        self._position = loop[0]
+                        continue
+                    if self._handoffs:
+                        next_track, self._gap_remaining = self._handoffs.popleft()
+                        path, self._data = next_track
+                        if self._next is next_track:
+                            self._next = None
+                        self._total = len(self._data)
+                        self._position = 0
+                        # [path, gap frames, underrun frames]
+                        self._switch = [path, self._gap_remaining, 0]
+                        continue
+                    self.playing = False
+                    self._events.append((self._eof,
+                                         (self.client.last_frame_time + done,)))
+                    break
+                count = min(count, ring.read_space // FRAME_BYTES)
+                if not count:
+                    # underrun
+                    if self._switch:
+                        self._switch[2] += frames - done
+                    break
+                if self._switch:
+                    path, gap_frames, underrun = self._switch
+                    self._switch = None
+                    self._events.append((self._track_changed,
+                                         (path, (gap_frames + underrun) / self.rate)))
+                ring.readinto(self._buffer_bytes[:count * FRAME_BYTES])
+                for channel, output in enumerate(outputs):
+                    np.multiply(self._buffer[:count, channel], gain,
+                                out=output[done:done + count])
+                if self._play_requested is not None and not done:
+                    self._events.append((self._started,
+                                         (self._play_requested, time.monotonic())))
+                    self._play_requested = None
+                done += count
+                self._position += count
+        for output in outputs:
+            output[done:] = 0
+
+    def _started(self, requested, started):
+        if self.client:
+            logger.info("Playback started in %.1f ms (+%.1f ms JACK period)",
+                        (started - requested) * 1000,
+                        self.client.blocksize / self.rate * 1000)
+        return False
+
+    def _track_changed(self, path, gap):
+        logger.info("Switched to %r, gap: %.1f ms", path, gap * 1000)
+        self.path = path
+        self._next_path = None
+        if self.track_changed_callback:
+            self.track_changed_callback(path, gap)
+        return False
+
+    def _eof(self, frame):
+        logger.debug("End of track at frame %i", frame)
+        self._seek(0)
+        if self.eof_callback:
+            self.eof_callback()
+        return False
@@ -0,0 +1,196 @@
+"""Background pre-rendering of tempo-shifted backing tracks."""
+
+import os
+import hashlib
+import logging
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from gi.repository import GLib
+
+from .sched import parse_cpu_list
+
+logger = logging.getLogger("track_render")
+
+RENDER_DIR = os.path.expanduser("~/.cache/ampi_app/rendered")
+
+# niceness of the renderer processes
+RENDER_NICE = 19
+
+def tempo_key(tempo):
+    """Tempo as stored in the cache (percent, rounded)."""
+    return int(round(tempo * 100))
+
+def rendered_path(path, tempo):
+    """Cache file of a track rendered at a tempo."""
+    stat = os.stat(path)
+    key = "{}\0{}\0{}\0{}".format(path, stat.st_mtime, stat.st_size,
+                                  tempo_key(tempo))
+    digest = hashlib.sha1(key.encode("utf-8", "surrogateescape")).hexdigest()
+    return os.path.join(RENDER_DIR, digest + ".wav")
+
+def _init_worker(cpus):
+    """Renderer process set-up: lowest priority, on the given CPUs only."""
+    os.nice(RENDER_NICE)
+    try:
+        os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+    except (AttributeError, OSError):
+        pass
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+
+def render_track(cmdline, path, tempo, output):
+    """Run the render command (in a pool process). Returns the output path."""
+    tmp_path = output + ".tmp.wav"
+    command = [arg.format(input=path, output=tmp_path, tempo=tempo,
+                          time=1.0 / tempo)
+               for arg in cmdline.split()]
+    subprocess.run(command,
+                   stdin=subprocess.DEVNULL,
+                   stdout=subprocess.DEVNULL,
+                   stderr=subprocess.PIPE,
+                   check=True)
+    os.replace(tmp_path, output)
+    return output
+
+class TrackRenderer:
+    """Renders time-stretched versions of tracks with `cmdline` in a pool of
+    low priority processes and keeps them in a size-bounded LRU cache.
+
+    The cache is plain files in RENDER_DIR; their mtime is the last use.
+    A pool broken by a crashed worker is replaced on the next request.
+    `callback(path, tempo, rendered)` is called in the main loop when
+    a requested version is ready."""
+    def __init__(self, cmdline, cache_size, workers=1, cpus="", callback=None):
+        self.cmdline = cmdline
+        self.cache_size = cache_size
+        self.callback = callback
+        self.workers = workers
+        self.cpus = parse_cpu_list(cpus)
+        self._pending = set()
+        self._pool = None
+        self._remove_stale()
+
+    @classmethod
+    def from_config(cls, section, callback=None):
+        """Create the renderer from the [Tracks] config, None if disabled."""
+        cmdline = section.get("render_cmdline")
+        if not cmdline:
+            return None
+        return cls(cmdline,
+                   section.getint("render_cache_size", 2000) * 1024 * 1024,
+                   workers=section.getint("render_workers", 1),
+                   cpus=section.get("render_cpus", ""),
+                   callback=callback)
+
+    def lookup(self, path, tempo):
+        """Rendered file for a track and tempo, None if not in the cache."""
+        try:
+            rendered = rendered_path(path, tempo)
+            os.utime(rendered)
+        except OSError:
+            return None
+        return rendered
+
+    def request(self, path, tempo):
+        """Render a track at a tempo in the background, unless cached."""
+        key = (path, tempo_key(tempo))
+        if key in self._pending or self.lookup(path, tempo):
+            return
+        try:
+            output = rendered_path(path, tempo)
+            os.makedirs(RENDER_DIR, exist_ok=True)
+        except OSError as err:
+            logger.warning("Cannot render %r: %s", path, err)
+            return
+        logger.info("Rendering %r at %i%% tempo", path, key[1])
+        pool = self._get_pool()
+        try:
+            future = pool.submit(render_track, self.cmdline, path, tempo, output)
+        except BrokenProcessPool as err:
+            logger.warning("Renderer pool broken (%s), restarting it", err)
+            self._drop_pool(pool)
+            pool = self._get_pool()
+            future = pool.submit(render_track, self.cmdline, path, tempo, output)
+        self._pending.add(key)
+        future.add_done_callback(
+                lambda future: GLib.idle_add(self._done, key, tempo, future, pool))
+
+    def _get_pool(self):
+        if self._pool is None:
+            # a fresh process, not a fork of this (threaded, GTK) one
+            context = multiprocessing.get_context("forkserver")
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=context,
+                                             initializer=_init_worker,
+                                             initargs=(self.cpus,))
+        return self._pool
+
+    def _drop_pool(self, pool):
+        if self._pool is pool:
+            self._pool = None
+            pool.shutdown(wait=False)
+
+    def _done(self, key, tempo, future, pool):
+        self._pending.discard(key)
+        path = key[0]
+        try:
+            rendered = future.result()
+        except BrokenProcessPool as err:
+            logger.warning("Rendering %r at %i%% tempo failed, renderer pool"
+                           " broken: %s", path, key[1], err)
+            self._drop_pool(pool)
+            return False
+        except (OSError, subprocess.CalledProcessError) as err:
+            logger.warning("Rendering %r at %i%% tempo failed: %s",
+                           path, key[1], err)
+            return False
+        logger.info("%r at %i%% tempo rendered", path, key[1])
+        self._evict()
+        if self.callback:
+            self.callback(path, tempo, rendered)
+        return False
+
+    def _remove_stale(self):
+        """Remove temporary files left by interrupted renders."""
+        try:
+            names = os.listdir(RENDER_DIR)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(".tmp.wav"):
+                logger.debug("Removing stale %r", name)
+                try:
+                    os.unlink(os.path.join(RENDER_DIR, name))
+                except OSError as err:
+                    logger.warning("Cannot remove %r: %s", name, err)
+
+    def _evict(self):
+        """Remove the least recently used files over the cache size."""
+        try:
+            entries = [entry for entry in os.scandir(RENDER_DIR)
+                       if entry.name.endswith(".wav")
+                       and not entry.name.endswith(".tmp.wav")]
+            files = [(entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                     for entry in entries]
+        except OSError as err:
+            logger.warning("Cannot read %r: %s", RENDER_DIR, err)
+            return
+        total = sum(size for mtime, size, path in files)
+        for mtime, size, path in sorted(files):
+            if total <= self.cache_size:
+                break
+            logger.debug("Removing %r from the render cache", path)
+            try:
+                os.unlink(path)
+            except OSError as err:
+                logger.warning("Cannot remove %r: %s", path, err)
+                continue
+            total -= size
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
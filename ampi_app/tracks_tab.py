@@ -2,31 +2,166 @@
 """Tracks tab."""
 
 import os
-import glob
+import time
 import logging
 import subprocess
 
 import gi
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk, GLib
+from gi.repository import Gtk, Gdk, GLib
 
-from .proc import Nanny
+from .proc import Nanny, output_options
+from .sched import SchedSettings
+from .track_index import TrackIndex, track_name
+from .track_player import TrackPlayer
+from .player_channel import MPlayerChannel
+from .track_render import TrackRenderer, tempo_key
+from .setlists import list_setlists, load_setlist
+from .track_peaks import PeaksGenerator, PEAKS_PER_SECOND, overview
 
 TRACKS_DIR = os.path.expanduser("~/.config/ampi_app/tracks")
 
 logger = logging.getLogger("tracks_tab")
 
+# time after the last tempo change before rendering starts (ms)
+RENDER_DELAY = 1000
+# playhead refresh interval, built-in player (ms)
+PLAYHEAD_INTERVAL = 100
+# time for mplayer to go on to the appended track, before the current one
+# is considered finished (ms)
+NEXT_FILE_WAIT = 1500
+
+class WaveformView(Gtk.DrawingArea):
+    """Track overview with a playhead, a click seeks to the position.
+
+    `seek_callback(fraction)` is called on click."""
+    def __init__(self, seek_callback):
+        Gtk.DrawingArea.__init__(self, hexpand=True)
+        self.set_size_request(-1, 60)
+        self.seek_callback = seek_callback
+        self.peaks = None
+        self.length = 0
+        self.position = None
+        self._columns = None
+        self.add_events(Gdk.EventMask.BUTTON_PRESS_MASK)
+        self.connect("draw", self._draw)
+        self.connect("button-press-event", self._button_pressed)
+
+    def set_peaks(self, peaks, length=None):
+        """Show an overview, `length` is the expected number of peaks
+        when it is not complete yet."""
+        self.peaks = peaks
+        self.length = max(length or 0, len(peaks) if peaks is not None else 0)
+        self._columns = None
+        self.queue_draw()
+
+    def set_position(self, fraction):
+        if fraction != self.position:
+            self.position = fraction
+            self.queue_draw()
+
+    def _draw(self, widget, ctx):
+        width = self.get_allocated_width()
+        height = self.get_allocated_height()
+        ctx.set_source_rgb(0.1, 0.1, 0.1)
+        ctx.paint()
+        if self.peaks is not None and len(self.peaks) and width > 0:
+            # the peaks span only part of the width while generating
+            columns = int(width * len(self.peaks) / self.length)
+            if not self._columns or len(self._columns[0]) != columns:
+                self._columns = overview(self.peaks, columns)
+            mins, maxs = self._columns
+            played = (self.position or 0) * width
+            scale = height / 2
+            ctx.set_line_width(1)
+            for x, (low, high) in enumerate(zip(mins, maxs)):
+                if x == int(played):
+                    # the played part in a different colour
+                    ctx.set_source_rgb(0.3, 0.6, 1)
+                    ctx.stroke()
+                ctx.move_to(x + 0.5, (1 - high) * scale)
+                ctx.line_to(x + 0.5, (1 - low) * scale + 1)
+            if played >= len(mins):
+                ctx.set_source_rgb(0.3, 0.6, 1)
+            else:
+                ctx.set_source_rgb(0.6, 0.6, 0.6)
+            ctx.stroke()
+        if self.position is not None:
+            ctx.set_source_rgb(1, 0.2, 0.2)
+            ctx.set_line_width(2)
+            ctx.move_to(self.position * width, 0)
+            ctx.line_to(self.position * width, height)
+            ctx.stroke()
+
+    def _button_pressed(self, widget, event):
+        width = self.get_allocated_width()
+        if event.button == 1 and width > 0:
+            self.seek_callback(min(max(event.x / width, 0.0), 1.0))
+        return True
+
 class TracksTab(Gtk.Box):
     def __init__(self, main_window):
         Gtk.Box.__init__(self)
         self.main_window = main_window
 
-        player_cmd = main_window.config["Tracks"]["player_cmdline"].split()
+        tracks_config = main_window.config["Tracks"]
+        player_cmd = tracks_config["player_cmdline"].split()
         player_name = os.path.basename(player_cmd[0])
-        self.player_nanny = Nanny(player_name, player_cmd,
-                                  callback=self._update_player_status,
-                                  stdout_callback=self._mplayer_output,
-                                  input_pipe=True)
+        self.player_nanny = None
+        self.player_channel = None
+        self.track_player = None
+        if tracks_config.get("player", "mplayer") == "builtin":
+            self.track_player = TrackPlayer(tracks_config["decoder_cmdline"],
+                                            ready_callback=self._track_ready,
+                                            eof_callback=self._track_eof,
+                                            track_changed_callback=self._track_changed,
+                                            decode_cache_size=tracks_config.getint(
+                                                "decode_cache_size", 2000) * 1024 * 1024)
+        else:
+            self.player_nanny = Nanny(player_name, player_cmd,
+                                      callback=self._update_player_status,
+                                      stdout_callback=self._mplayer_output,
+                                      input_pipe=True,
+                                      sched=SchedSettings.from_config(tracks_config),
+                                      **output_options(tracks_config))
+            self.player_channel = MPlayerChannel(self.player_nanny,
+                                                 self._player_state_changed)
+        # the player reported the loaded track (after the last _load_track())
+        self._track_seen = False
+        self._loop_start = None
+        self.renderer = TrackRenderer.from_config(tracks_config,
+                                                  self._track_rendered)
+        self._render_id = None
+        # tempo of the loaded file (rendered tracks are already stretched)
+        self._loaded_tempo = 1.0
+        # setlist playback: silence (count-in) between the tracks (seconds)
+        self.setlist = []
+        # index of the current track in the setlist (it may be there
+        # more than once), None when not known
+        self._setlist_pos = None
+        self.setlist_gap = tracks_config.getfloat("setlist_gap", 0)
+        if self.track_player:
+            self.track_player.gap = self.setlist_gap
+        # next setlist track handed to the player:
+        # (name, track, file, tempo, setlist index)
+        self._queued = None
+        # start playing when the loaded track is ready
+        self._autoplay = False
+        # resume playing when the reloaded (rendered) track is ready
+        self._resume = False
+        # end of the previous track (time.monotonic()), for the gap measurement
+        self._eof_time = None
+        self._start_id = None
+        self._last_state = None
+        # the last mplayer state with a file loaded
+        self._last_loaded = None
+        self._finish_id = None
+        peaks_cmdline = tracks_config.get("peaks_cmdline")
+        if peaks_cmdline:
+            self.peaks = PeaksGenerator(peaks_cmdline, callback=self._peaks_ready)
+        else:
+            self.peaks = None
+        self._playhead_id = None
 
         self.set_orientation(Gtk.Orientation.VERTICAL)
 
@@ -35,6 +170,12 @@ class TracksTab(Gtk.Box):
                                        xalign=0.5)
         self.pack_start(self.track_title_l, False, False, 2)
 
+        self.waveform = WaveformView(self._waveform_clicked)
+        self.pack_start(self.waveform, False, False, 2)
+        if self.track_player:
+            self.connect("map", self._mapped)
+            self.connect("unmap", self._unmapped)
+
         grid = Gtk.Grid(border_width=10,
                         column_spacing=5,
                         hexpand=True)
@@ -68,8 +209,23 @@ class TracksTab(Gtk.Box):
         for pos in range(25, 250, 25):
             self.tempo_s.add_mark(pos, Gtk.PositionType.TOP, "{}%".format(pos))
         self.tempo_s.connect("value-changed", self._tempo_changed)
+        if self.track_player and not self.renderer:
+            self.tempo_s.set_sensitive(False)
+            self.tempo_s.set_tooltip_text("Not supported by the built-in player")
+        elif self.track_player:
+            self.tempo_s.set_tooltip_text("Applied when the track is loaded again")
         grid.attach(self.tempo_s, 1, 1, 1, 1)
 
+        label = Gtk.Label("Setlist:",
+                          justify=Gtk.Justification.RIGHT,
+                          xalign=1)
+        grid.attach(label, 0, 2, 1, 1)
+        self.setlist_cb = Gtk.ComboBoxText(hexpand=True)
+        self._setlist_names = None
+        self._update_setlists()
+        self.setlist_cb.connect("changed", self._setlist_changed)
+        grid.attach(self.setlist_cb, 1, 2, 1, 1)
+
         self.pack_start(grid, False, False, 2)
 
         button_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL,
@@ -80,6 +236,18 @@ class TracksTab(Gtk.Box):
         self.stop_b = Gtk.Button.new_with_label("Stop")
         self.stop_b.connect("clicked", self._stop_clicked)
         button_box.pack_start(self.stop_b, False, False, 2)
+        if self.track_player:
+            self.loop_a_b = Gtk.Button.new_with_label("A")
+            self.loop_a_b.set_tooltip_text("Set loop start")
+            self.loop_a_b.connect("clicked", self._loop_a_clicked)
+            button_box.pack_start(self.loop_a_b, False, False, 2)
+            self.loop_b_b = Gtk.Button.new_with_label("B")
+            self.loop_b_b.set_tooltip_text("Set loop end and start looping")
+            self.loop_b_b.connect("clicked", self._loop_b_clicked)
+            button_box.pack_start(self.loop_b_b, False, False, 2)
+            self.loop_off_b = Gtk.Button.new_with_label("No loop")
+            self.loop_off_b.connect("clicked", self._loop_off_clicked)
+            button_box.pack_start(self.loop_off_b, False, False, 2)
 
         self.pack_start(button_box, False, False, 2)
 
@@ -93,9 +261,17 @@ class TracksTab(Gtk.Box):
         self.current_track_filename = None
         self.playing = False
 
+        self._tracklist_update_id = None
+        self.track_index = TrackIndex(TRACKS_DIR, player_cmd[0],
+                                      callback=self._tracks_changed)
         self.update_tracklist()
         self._update_button_states()
 
+        # the tab is built on first view, jackd may be running already
+        jack_nanny = main_window.jack_nanny
+        if jack_nanny and jack_nanny.is_started():
+            self.update_jackd_proc_status(True)
+
     def __del__(self):
         if hasattr(self, "player_nanny"):
             self.stop_player()
@@ -104,38 +280,410 @@ class TracksTab(Gtk.Box):
         if self.player_nanny:
             self.player_nanny.stop()
             self.player_nanny = None
+        if self.track_player:
+            self.track_player.close()
+        if self.renderer:
+            self.renderer.shutdown()
+        if self.peaks:
+            self.peaks.cancel()
+
+    def _player_started(self):
+        if self.track_player:
+            return self.track_player.is_started()
+        return self.player_nanny.is_started()
 
     def update_jackd_proc_status(self, started):
-        if started and self.player_nanny:
+        if self.track_player:
+            if started:
+                GLib.timeout_add(1000, self._start_track_player)
+            else:
+                self.track_player.close()
+                self.playing = False
+                self._update_button_states()
+        elif started and self.player_nanny:
             GLib.timeout_add(1000, self.player_nanny.start)
         elif self.player_nanny:
-            GLib.timeout_add(1000, self.player_nanny.stop)
+            GLib.timeout_add(1000, self.player_nanny.stop_async)
+
+    def _start_track_player(self):
+        self.track_player.start()
+        if self.current_track_filename:
+            self._load_track()
+        self._update_button_states()
+        return False
 
     def _update_player_status(self, started):
+        GLib.idle_add(self._player_started_changed, started)
+
+    def _player_started_changed(self, started):
+        if started:
+            self.player_channel.start_polling()
+        else:
+            self.player_channel.clear()
+            self.player_channel.stop_polling()
+        self._update_button_states()
+        return False
+
+    def _player_state_changed(self, state):
+        self._last_state = state
+        was_playing = self.playing
+        if not self._autoplay and self._start_id is None:
+            # not in the count-in, follow what mplayer reports
+            self.playing = bool(state.loaded and not state.paused)
+        if state.loaded:
+            if self._finish_id is not None:
+                GLib.source_remove(self._finish_id)
+                self._finish_id = None
+            previous = self._last_loaded
+            self._last_loaded = state
+            if (self._queued and previous and previous.filename
+                    and state.filename != previous.filename
+                    and state.filename == os.path.basename(self._queued[2])):
+                # mplayer went on to the next file of its playlist
+                if (previous.position is not None and previous.length
+                        and state.position is not None):
+                    old_end = (previous.updated + previous.length
+                               - previous.position)
+                    new_start = state.updated - state.position
+                    self._log_gap(new_start - old_end, "estimated from the"
+                                  " reported positions")
+                self._adopt_queued()
+                self._player_command("speed_set",
+                                     self.tempo_s.get_value() / 100 / self._loaded_tempo)
+            if not self._track_seen:
+                self._track_seen = True
+                if self._autoplay:
+                    self._autoplay = False
+                    self._count_in()
+            if self._eof_time and not state.paused and state.position is not None:
+                self._log_gap(state.updated - state.position - self._eof_time,
+                              "estimated from the reported position")
+                self._eof_time = None
+        elif was_playing and self._track_seen and self._finish_id is None:
+            if self._queued:
+                # may be just switching to the appended file
+                self._finish_id = GLib.timeout_add(NEXT_FILE_WAIT,
+                                                   self._track_finished)
+            else:
+                self._track_finished()
+        title = self.current_track_name or "-- no track --"
+        if state.loaded and state.position is not None and state.length:
+            title += "  {}:{:02d} / {}:{:02d}".format(
+                    int(state.position) // 60, int(state.position) % 60,
+                    int(state.length) // 60, int(state.length) % 60)
+            self.waveform.set_position(min(state.position / state.length, 1.0))
+        else:
+            self.waveform.set_position(None)
+        self.track_title_l.set_text(title)
+
+    def _track_finished(self):
+        self._finish_id = None
+        logger.debug("Track finished")
+        self.playing = False
+        last = self._last_loaded
+        if last and last.position is not None and last.length:
+            self._eof_time = last.updated + last.length - last.position
+        else:
+            self._eof_time = time.monotonic()
+        if not self._play_next():
+            self._load_track()
+        return False
+
+    def _track_ready(self, path):
         self._update_button_states()
+        if self._resume:
+            self._resume = False
+            self.playing = True
+            self.track_player.play()
+        elif self._autoplay:
+            self._autoplay = False
+            self._count_in()
+        self._queue_next()
+
+    def _track_changed(self, path, gap):
+        if self._queued and path == self._queued[2]:
+            self._log_gap(gap, "measured by the player")
+            self._adopt_queued()
+
+    def _track_eof(self):
+        self.playing = False
+        # the next track was not preloaded in time
+        self._eof_time = time.monotonic()
+        self._play_next()
+
+    def _setlist_index(self):
+        """Index of the current track in the setlist, None if not there."""
+        pos = self._setlist_pos
+        if (pos is not None and pos < len(self.setlist)
+                and self.setlist[pos] == self.current_track_filename):
+            return pos
+        try:
+            return self.setlist.index(self.current_track_filename)
+        except ValueError:
+            return None
+
+    def _next_track(self):
+        """Name, path and setlist index of the track following the current
+        one in the setlist, None if there is none."""
+        index = self._setlist_index()
+        if index is None or index + 1 >= len(self.setlist):
+            return None
+        path = self.setlist[index + 1]
+        info = self.track_index.tracks.get(path)
+        return info["name"] if info else track_name(path), path, index + 1
+
+    def _queue_next(self):
+        """Give the next setlist track to the player ahead of time."""
+        next_track = self._next_track()
+        if not next_track:
+            self._queued = None
+            if self.track_player:
+                self.track_player.queue_next(None)
+            return
+        if not self.track_player and self.setlist_gap:
+            # loaded by _play_next() after the count-in
+            self._queued = None
+            return
+        name, track, index = next_track
+        filename, tempo = self._track_file(track)
+        self._queued = (name, track, filename, tempo, index)
+        logger.debug("Next track: %r", filename)
+        if self.track_player:
+            self.track_player.queue_next(filename)
+        else:
+            # appended to the mplayer playlist, played right after this one
+            self._player_command("loadfile", filename, 1)
+
+    def _adopt_queued(self):
+        """The player switched to the queued track."""
+        name, track, filename, self._loaded_tempo, self._setlist_pos = self._queued
+        self._queued = None
+        self.current_track_name = name
+        self.current_track_filename = track
+        self.track_title_l.set_text(name)
+        self._show_peaks()
+        self._queue_next()
+
+    def _play_next(self):
+        """Load and start the next setlist track after the count-in."""
+        next_track = self._next_track()
+        if not next_track:
+            self._eof_time = None
+            return False
+        name, track, self._setlist_pos = next_track
+        self._select_track(name, track, autoplay=True)
+        return True
+
+    def _count_in(self):
+        elapsed = time.monotonic() - self._eof_time if self._eof_time else 0
+        delay = max(self.setlist_gap - elapsed, 0)
+        if self._start_id is not None:
+            GLib.source_remove(self._start_id)
+        self._start_id = GLib.timeout_add(int(delay * 1000), self._start_playback)
+
+    def _start_playback(self):
+        self._start_id = None
+        if self.playing:
+            return False
+        self.playing = True
+        if self.track_player:
+            self.track_player.play()
+            if self._eof_time:
+                self._log_gap(time.monotonic() - self._eof_time,
+                              "after reload, main loop time")
+                self._eof_time = None
+        else:
+            self._player_command("pause")
+        return False
+
+    def _show_peaks(self):
+        info = self.track_index.tracks.get(self.current_track_filename)
+        if not info or not self.peaks:
+            self.waveform.set_peaks(None)
+            return
+        peaks = self.peaks.get(info)
+        if peaks is None:
+            self.peaks.request(info, first=True)
+        length = info["duration"] * PEAKS_PER_SECOND if info["duration"] else None
+        self.waveform.set_peaks(peaks, length)
+
+    def _peaks_ready(self, path, peaks, complete):
+        if path != self.current_track_filename:
+            return
+        info = self.track_index.tracks.get(path)
+        if complete or not info or not info["duration"]:
+            self.waveform.set_peaks(peaks)
+        else:
+            self.waveform.set_peaks(peaks, info["duration"] * PEAKS_PER_SECOND)
+
+    def _waveform_clicked(self, fraction):
+        if self.track_player:
+            duration = self.track_player.duration
+            if duration:
+                self.track_player.seek(fraction * duration)
+                self.waveform.set_position(fraction)
+        elif self._player_started() and self._track_seen:
+            self._player_command("seek", "{:.2f}".format(fraction * 100), 1)
+
+    def _mapped(self, widget):
+        if self._playhead_id is None:
+            self._playhead_id = GLib.timeout_add(PLAYHEAD_INTERVAL,
+                                                 self._update_playhead)
+
+    def _unmapped(self, widget):
+        if self._playhead_id is not None:
+            GLib.source_remove(self._playhead_id)
+            self._playhead_id = None
+
+    def _update_playhead(self):
+        duration = self.track_player.duration
+        if self.track_player.ready and duration:
+            self.waveform.set_position(self.track_player.position / duration)
+        else:
+            self.waveform.set_position(None)
+        return True
+
+    def _log_gap(self, gap, how):
+        logger.info("Gap between the tracks: %.0f ms (%s)", gap * 1000, how)
+
+    def _update_setlists(self):
+        names = list_setlists()
+        if names == self._setlist_names:
+            return
+        self._setlist_names = names
+        active = self.setlist_cb.get_active_id()
+        self.setlist_cb.remove_all()
+        self.setlist_cb.append("", "-- none --")
+        for name in names:
+            self.setlist_cb.append(name, name)
+        if not self.setlist_cb.set_active_id(active or ""):
+            self.setlist_cb.set_active_id("")
+
+    def _setlist_changed(self, combo):
+        name = combo.get_active_id()
+        self.setlist = load_setlist(name, TRACKS_DIR) if name else []
+        logger.debug("Setlist %r: %r", name, self.setlist)
+        self._setlist_pos = None
+        if not self.setlist:
+            self._queue_next()
+            return
+        if self.current_track_filename not in self.setlist:
+            path = self.setlist[0]
+            info = self.track_index.tracks.get(path)
+            self._select_track(info["name"] if info else track_name(path), path)
+        elif self._player_started():
+            self._queue_next()
+
+    def _loop_a_clicked(self, button):
+        self._loop_start = self.track_player.position
+        logger.debug("Loop start at %.3f s", self._loop_start)
+
+    def _loop_b_clicked(self, button):
+        loop_end = self.track_player.position
+        if self._loop_start is None or loop_end <= self._loop_start:
+            logger.warning("Loop end must be after the loop start")
+            return
+        logger.info("Looping %.3f s - %.3f s", self._loop_start, loop_end)
+        self.track_player.set_loop(self._loop_start, loop_end)
+
+    def _loop_off_clicked(self, button):
+        self._loop_start = None
+        self.track_player.set_loop(None, None)
 
     def _player_command(self, *args):
-        if not self.player_nanny:
+        if not self.player_channel:
             return
         command = " ".join(str(arg) for arg in args)
         if not self.playing and args[0] != "pause":
             command = "pausing " + command
-        try:
-            self.player_nanny.write(command + "\n")
-        except OSError as err:
-            logger.error("Cannot set %r command to the track player: %s",
-                         command, err)
+        self.player_channel.send(command)
+
+    def _track_file(self, filename=None):
+        """File to play for the current (or given) track and tempo and
+        the tempo of that file.
+
+        A pre-rendered version is used when available, otherwise it is
+        requested and the original is played (stretched in real time by
+        mplayer)."""
+        if filename is None:
+            filename = self.current_track_filename
+        tempo = self.tempo_s.get_value() / 100
+        if self.renderer and tempo_key(tempo) != 100:
+            rendered = self.renderer.lookup(filename, tempo)
+            if rendered:
+                logger.debug("Using pre-rendered %r", rendered)
+                return rendered, tempo
+            self.renderer.request(filename, tempo)
+        return filename, 1.0
+
+    def _track_rendered(self, path, tempo, rendered):
+        """Switch to a finished render of the current track, if it matches
+        the tempo set, keeping the position in the song."""
+        current_tempo = self.tempo_s.get_value() / 100
+        if (path != self.current_track_filename
+                or tempo_key(tempo) != tempo_key(current_tempo)
+                or tempo_key(tempo) == tempo_key(self._loaded_tempo)
+                or self._autoplay or self._start_id is not None):
+            return
+        if self.track_player:
+            if not self.track_player.ready:
+                return
+            position = self.track_player.position
+        else:
+            state = self._last_state
+            if not self._track_seen or not state or not state.loaded:
+                return
+            position = state.position or 0
+        # the same point of the song in the file at the new tempo
+        position = position * self._loaded_tempo / tempo
+        logger.info("Switching to pre-rendered %r at %.1f s", rendered, position)
+        self._loaded_tempo = tempo
+        self._queued = None
+        if self.track_player:
+            self._resume = self.playing
+            self.playing = False
+            self.track_player.load(rendered, position)
+            return
+        self._track_seen = False
+        self._player_command("loadfile", rendered)
+        self._player_command("seek", position, 2)
+        self._player_command("volume", self.volume_s.get_value(), 1)
+        self._player_command("speed_set", current_tempo / tempo)
+        self._queue_next()
 
     def _load_track(self):
-        self._player_command("stop")
         self.playing = False
-        if self.current_track_filename:
-            self._player_command("loadfile", self.current_track_filename)
-            self._player_command("volume", self.volume_s.get_value(), 1)
-            self._player_command("speed_set", self.tempo_s.get_value() / 100)
+        self._resume = False
+        self._track_seen = False
+        self._queued = None
+        if self._finish_id is not None:
+            GLib.source_remove(self._finish_id)
+            self._finish_id = None
+        if self._start_id is not None:
+            GLib.source_remove(self._start_id)
+            self._start_id = None
+        if not self.current_track_filename:
+            if not self.track_player:
+                self._player_command("stop")
+            return
+        filename, self._loaded_tempo = self._track_file()
+        if self.track_player:
+            self.track_player.set_volume(self.volume_s.get_value())
+            self.track_player.load(filename)
+            return
+        self._player_command("stop")
+        self._player_command("loadfile", filename)
+        self._player_command("volume", self.volume_s.get_value(), 1)
+        self._player_command("speed_set",
+                             self.tempo_s.get_value() / 100 / self._loaded_tempo)
+        self._queue_next()
 
     def _update_button_states(self):
-        if self.player_nanny.is_started() and self.current_track_name is not None:
+        if self.track_player and not self.track_player.ready:
+            ready = False
+        else:
+            ready = self._player_started()
+        if ready and self.current_track_name is not None:
             self.play_b.set_sensitive(True)
             self.stop_b.set_sensitive(True)
         else:
@@ -143,52 +691,92 @@ class TracksTab(Gtk.Box):
             self.stop_b.set_sensitive(False)
 
     def _volume_changed(self, scale):
+        if self.track_player:
+            self.track_player.set_volume(self.volume_s.get_value())
+            return
         self._player_command("volume", self.volume_s.get_value(), 1)
 
     def _tempo_changed(self, scale):
-        self._player_command("speed_set", self.tempo_s.get_value() / 100.0)
+        if self.renderer:
+            if self._render_id is not None:
+                GLib.source_remove(self._render_id)
+            self._render_id = GLib.timeout_add(RENDER_DELAY, self._tempo_settled)
+        if self.track_player:
+            return
+        self._player_command("speed_set",
+                             self.tempo_s.get_value() / 100.0 / self._loaded_tempo)
+
+    def _tempo_settled(self):
+        self._render_id = None
+        tempo = self.tempo_s.get_value() / 100
+        if self.current_track_filename and tempo_key(tempo) != 100:
+            self.renderer.request(self.current_track_filename, tempo)
+        return False
 
     def _play_clicked(self, button):
         self.playing = not self.playing
         logger.debug("Play clicked, now playing: %r", self.playing)
+        if self.track_player:
+            if self.playing:
+                self.track_player.play()
+            else:
+                self.track_player.pause()
+            return
         self._player_command("pause")
 
     def _stop_clicked(self, button):
+        self._autoplay = False
+        self._resume = False
+        self._eof_time = None
+        if self.track_player:
+            self.playing = False
+            self.track_player.stop()
+            return
         self._load_track()
 
-    def _track_selected(self, button, track_name, track_filename):
-        logger.debug("Track selected: %r: %r, %r", button, track_name, track_filename)
-        self.current_track_name = track_name
+    def _track_selected(self, button, name, track_filename):
+        logger.debug("Track selected: %r: %r, %r", button, name, track_filename)
+        self._eof_time = None
+        self._setlist_pos = None
+        self._select_track(name, track_filename)
+
+    def _select_track(self, name, track_filename, autoplay=False):
+        self.current_track_name = name
         self.current_track_filename = track_filename
-        self.track_title_l.set_text(track_name)
+        self.track_title_l.set_text(name)
+        self._show_peaks()
+        self._autoplay = autoplay
         self._update_button_states()
-        if self.player_nanny.is_started():
+        if self._player_started():
             self._load_track()
 
     def _mplayer_output(self, data):
-        if b"=====  PAUSE  =====" in data:
-            logger.debug("Got %r from mplayer, paused", data)
-            self.playing = False
-        elif self.playing and (b"\n\n" in data or not data.strip()):
-            # EOF?
-            logger.debug("Got %r from mplayer, stopped?", data)
-            self.playing = False
-            GLib.idle_add(self._load_track)
+        self.player_channel.feed(data)
+
+    def _tracks_changed(self):
+        # many changes may come at once (e.g. when copying files)
+        if self._tracklist_update_id is None:
+            self._tracklist_update_id = GLib.idle_add(self._update_tracklist_idle)
+
+    def _update_tracklist_idle(self):
+        self._tracklist_update_id = None
+        self.update_tracklist()
+        if self.peaks:
+            tracks = self.track_index.get_tracks()
+            self.peaks.prune(tracks)
+            for info in tracks:
+                self.peaks.request(info)
+            if self.current_track_filename and self.waveform.peaks is None:
+                self._show_peaks()
+        return False
 
     def update_tracklist(self):
+        self._update_setlists()
         for child in self.tracklist.get_children():
             child.destroy()
 
-        tracks = []
-        logger.debug("Searching for backing track files...")
-        for filename in glob.glob(os.path.join(TRACKS_DIR, "*")):
-            if not os.path.isfile(filename):
-                logger.debug("Skipping %r: not a regular file")
-                continue
-            name = os.path.splitext(os.path.basename(filename))[0]
-            name = name.replace("_", " ")
-            logger.debug("Track found: %s (%s)", name, filename)
-            tracks.append((name, filename))
+        tracks = [(track["name"], track["path"], track["duration"])
+                  for track in self.track_index.get_tracks()]
 
         if not tracks:
             label = Gtk.Label("No tracks",
@@ -197,8 +785,13 @@ class TracksTab(Gtk.Box):
             self.tracklist.add(label)
             return
 
-        for name, filename in tracks:
-            button = Gtk.Button.new_with_label(name)
+        for name, filename, duration in tracks:
+            if duration:
+                label = "{} ({}:{:02d})".format(name, int(duration) // 60,
+                                                int(duration) % 60)
+            else:
+                label = name
+            button = Gtk.Button.new_with_label(label)
             button.connect("clicked", self._track_selected, name, filename)
             self.tracklist.add(button)
 